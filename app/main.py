@@ -11,12 +11,19 @@ import pandas as pd
 import io
 import traceback
 import uuid
+import time
+import asyncio
 from datetime import timedelta
 
 # App Imports
-from app.services.data_processing import AndreaniProcessor
-from app.services.pdf_processing import process_pdf_labels, construir_mapa_skus
-from app.services.tiendanube import TiendaNubeAuth, TiendaNubeClient
+from app.services import process_pool
+from app.services.process_pool import ejecutar, tarea_process_csv, tarea_generate_excel, procesar_etiquetas
+from app.services.tiendanube import TiendaNubeAuth, TiendaNubeClient, rate_limit_stats
+from app.services.tiendanube_async import AsyncTiendaNubeClient, close_async_http_client
+from app.services.tracking_file import leer_archivo_tracking
+from app.services.response_cache import orders_cache
+from app.services.batch_jobs import batch_queue, crear_job, obtener_job, resultado_job, marcar_interrumpidos
+from app.services.webhooks import webhook_queue, verificar_firma, parse_evento, SIGNATURE_HEADER, WEBHOOK_URL, ORDER_EVENTS
 from app.services.csv_generator import TiendaNubeCSVGenerator
 from app.database import init_db, get_session
 from app.dependencies import get_current_store_id, get_current_store
@@ -37,14 +44,38 @@ templates = Jinja2Templates(directory="app/templates")
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 ANDREANI_TEMPLATE = os.path.join(BASE_DIR, "EnvioMasivoExcelPaquetes.xlsx")
 # Output configs
-OUTPUT_EXCEL = "/tmp/EnvioMasivoExcelPaquetes_cargado.xlsx"
 OUTPUT_PDF = "/tmp/documentos_combinados_con_sku.pdf"
 
 if os.name == 'nt':
-    OUTPUT_EXCEL = os.path.join(BASE_DIR, "temp_output_excel.xlsx")
     OUTPUT_PDF = os.path.join(BASE_DIR, "temp_output_pdf.pdf")
 
-processor = AndreaniProcessor(ANDREANI_TEMPLATE)
+# CSV, Excel y etiquetas corren en el pool de procesos; el AndreaniProcessor se arma a demanda
+# en el proceso que lo usa (en este mismo solo con PROCESS_POOL_WORKERS=0)
+process_pool.configurar(ANDREANI_TEMPLATE)
+
+def _leer_y_cerrar(archivo, chunk_size: int = 64 * 1024, borrar: str = None):
+    try:
+        archivo.seek(0)
+        while True:
+            chunk = archivo.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        archivo.close()
+        if borrar:
+            os.remove(borrar)
+
+def archivo_response(archivo, filename: str, media_type: str, borrar: str = None) -> StreamingResponse:
+    """
+    Devuelve como descarga un archivo temporal/buffer propio del request y lo cierra al terminar
+    (si se pasa `borrar`, tambien elimina ese archivo del disco).
+    """
+    return StreamingResponse(
+        _leer_y_cerrar(archivo, borrar=borrar),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
 
 # --- Auth Routes ---
 from pydantic import BaseModel
@@ -116,6 +147,27 @@ async def read_users_me(current_user: User = Depends(get_current_user)):
 def on_startup():
     init_db()
 
+@app.on_event("startup")
+async def start_webhook_queue():
+    webhook_queue.start()
+    # Lotes que quedaron a medias en procesos que ya no estan (reinicio/deploy)
+    interrumpidos = await asyncio.to_thread(marcar_interrumpidos)
+    if interrumpidos:
+        print(f"Batch jobs interrupted by restart: {interrumpidos}")
+    batch_queue.start()
+
+@app.on_event("startup")
+async def start_process_pool():
+    # Los procesos del pool arrancan aca y no en el primer request
+    await process_pool.calentar()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await webhook_queue.stop()
+    await batch_queue.stop()
+    await close_async_http_client()
+    process_pool.cerrar()
+
 # --- Common Context ---
 # We can inject 'stores' list into templates globally or per request
 def get_user_stores(session: Session = next(get_session())):
@@ -138,7 +190,7 @@ async def view_pdf_process(request: Request):
 async def parse_csv(file: UploadFile = File(...)):
     try:
         content = await file.read()
-        results = processor.process_csv(content)
+        results = await ejecutar(tarea_process_csv, content)
         if isinstance(results, dict) and "error" in results:
             return JSONResponse(status_code=400, content=results)
         return results
@@ -152,13 +204,25 @@ async def generate_excel(data: dict):
     records = data.get("records", [])
     if not records:
         return JSONResponse(status_code=400, content={"error": "No records provided"})
+
+    filas_por_archivo = data.get("filas_por_archivo")
+    if filas_por_archivo is not None:
+        if isinstance(filas_por_archivo, bool) or not isinstance(filas_por_archivo, int) or filas_por_archivo < 1:
+            return JSONResponse(status_code=400, content={"error": "filas_por_archivo debe ser un entero mayor o igual a 1"})
     
     try:
-        output_path = processor.generate_excel(records, OUTPUT_EXCEL)
-        return FileResponse(
-            output_path, 
-            filename="EnvioMasivoExcelPaquetes_cargado.xlsx",
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        # Writer en streaming sobre la plantilla (mismas celdas que openpyxl, sin limite de filas)
+        contenido, archivos = await ejecutar(tarea_generate_excel, records, filas_por_archivo)
+        # Los grandes vuelven como ruta de un temporal que se borra al terminar de servirlo
+        temporal = contenido if isinstance(contenido, str) else None
+        output = open(temporal, "rb") if temporal else io.BytesIO(contenido)
+        if archivos > 1:
+            return archivo_response(output, "EnvioMasivoExcelPaquetes_cargado.zip", "application/zip", borrar=temporal)
+        return archivo_response(
+            output,
+            "EnvioMasivoExcelPaquetes_cargado.xlsx",
+            "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            borrar=temporal
         )
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
@@ -172,8 +236,7 @@ async def process_pdf(
         pdf_bytes = await pdf_file.read()
         csv_bytes = await csv_file.read()
         
-        skus_map = construir_mapa_skus(csv_bytes)
-        modified_pdf = process_pdf_labels(pdf_bytes, skus_map)
+        modified_pdf = await procesar_etiquetas(pdf_bytes, csv_bytes)
         
         with open(OUTPUT_PDF, "wb") as f:
             f.write(modified_pdf)
@@ -235,6 +298,15 @@ async def tiendanube_callback(request: Request, code: str, state: str, session:
                  # Set HttpOnly cookie for security
                  response.set_cookie(key="access_token", value=access_token, httponly=True)
 
+        # Webhooks de ordenes para mantener al dia la copia local (si hay URL publica configurada)
+        if WEBHOOK_URL:
+            try:
+                client = TiendaNubeClient(token_data_full.get("user_id"), token_data_full.get("access_token"))
+                added = await asyncio.to_thread(client.register_webhooks, WEBHOOK_URL, ORDER_EVENTS)
+                print(f"Registered webhooks for store {store_id}: {added}")
+            except Exception as e:
+                print(f"Webhook registration failed for store {store_id}: {e}")
+
         # Set active store cookie
         response.set_cookie(key="andreani_active_store", value=str(store_id))
         return response
@@ -275,12 +347,36 @@ async def update_tracking_codes(file: UploadFile = File(...), store: Store = Dep
         if not access_token:
             raise RuntimeError("Missing access_token")
         
-        client = TiendaNubeClient(store_id=store_id_tn, access_token=access_token)
-        result = client.process_tracking_file(content)
+        # Leer el PDF/Excel es CPU: va a un thread para no frenar el loop
+        rows, error = await asyncio.to_thread(leer_archivo_tracking, content)
+        if error:
+            return {"error": error}
+
+        client = AsyncTiendaNubeClient(store_id=store_id_tn, access_token=access_token)
+        result = await client.process_tracking_file(rows)
         return result
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
 
+@app.post("/webhooks/tiendanube")
+async def tiendanube_webhook(request: Request):
+    """Webhooks de ordenes: se verifica la firma, se encola y se responde enseguida."""
+    body = await request.body()
+    if not verificar_firma(body, request.headers.get(SIGNATURE_HEADER)):
+        return JSONResponse(status_code=401, content={"ok": False, "error": "Invalid signature"})
+
+    evento = parse_evento(body)
+    if evento is None:
+        return {"ok": True, "ignored": True}
+
+    if not webhook_queue.encolar(evento):
+        return JSONResponse(status_code=503, content={"ok": False, "error": "Queue full"})
+    return {"ok": True}
+
+@app.get("/api/webhooks/stats")
+async def webhook_stats(current_user: User = Depends(get_current_user)):
+    return {"ok": True, "stats": webhook_queue.estadisticas()}
+
 @app.get("/orders-ready", response_class=HTMLResponse)
 async def view_orders_ready(request: Request, store_id: int = Depends(get_current_store_id)):
     token_data = TiendaNubeAuth.get_valid_token(store_id)
@@ -309,14 +405,22 @@ async def api_list_orders_ready(
                  "error": "No active store or not authenticated"
              })
         
-        client = TiendaNubeClient(token_data.get("user_id"), token_data.get("access_token"))
+        client = AsyncTiendaNubeClient(token_data.get("user_id"), token_data.get("access_token"))
         statuses = ["paid"]
-        ret_data = client.list_orders_ready(page=page, per_page=per_page, q=q, payment_statuses=statuses, stage=stage, debug=debug)
+        listar = lambda: client.list_orders_ready(page=page, per_page=per_page, q=q, payment_statuses=statuses, stage=stage, debug=debug)
+        if debug:
+            ret_data = await listar()
+        else:
+            ret_data = await orders_cache.obtener(client.store_id, ("ready", page, per_page, q, stage), listar)
         
+        # page/per_page son de ordenes listas (no de paginas de la API)
         return {
             "ok": True, 
             "results": ret_data["results"], 
-            "debug": ret_data.get("debug", [])
+            "debug": ret_data.get("debug", []),
+            "page": ret_data["page"],
+            "per_page": ret_data["per_page"],
+            "has_more": ret_data["has_more"]
         }
 
     except Exception as e:
@@ -328,6 +432,50 @@ async def api_list_orders_ready(
             "traceback": tb_str
         })
 
+@app.get("/api/orders/overview")
+async def api_orders_overview(
+    page: int = 1,
+    per_page: int = 50,
+    q: str = None,
+    stage: str = None,
+    debug: bool = False,
+    store: Store = Depends(get_current_store)
+):
+    """Listado de /api/orders/ready y contadores de /api/orders/stats con un solo recorrido de ordenes."""
+    try:
+        token_data = TiendaNubeAuth.get_valid_token(store.id)
+        if not token_data:
+             return JSONResponse(status_code=401, content={
+                 "ok": False,
+                 "error": "No active store or not authenticated"
+             })
+
+        client = AsyncTiendaNubeClient(token_data.get("user_id"), token_data.get("access_token"))
+        listar = lambda: client.list_orders_with_stats(page=page, per_page=per_page, q=q, payment_statuses=["paid"], stage=stage, debug=debug)
+        if debug:
+            ret_data = await listar()
+        else:
+            ret_data = await orders_cache.obtener(client.store_id, ("overview", page, per_page, q, stage), listar)
+
+        return {
+            "ok": True,
+            "results": ret_data["results"],
+            "debug": ret_data.get("debug", []),
+            "page": ret_data["page"],
+            "per_page": ret_data["per_page"],
+            "has_more": ret_data["has_more"],
+            "stats": ret_data["stats"]
+        }
+
+    except Exception as e:
+        tb_str = traceback.format_exc()
+        print(f"CRITICAL ERROR in /orders/overview:\n{tb_str}")
+        return JSONResponse(status_code=500, content={
+            "ok": False,
+            "error": str(e),
+            "traceback": tb_str
+        })
+
 @app.get("/api/orders/stats")
 async def api_orders_stats(store_id: int = Depends(get_current_store_id)):
     token_data = TiendaNubeAuth.get_valid_token(store_id)
@@ -335,13 +483,26 @@ async def api_orders_stats(store_id: int = Depends(get_current_store_id)):
         return {"ok": False, "stats": {"unpacked": 0, "packed": 0}}
         
     try:
-        client = TiendaNubeClient(token_data.get("user_id"), token_data.get("access_token"))
-        stats = client.get_order_stats()
+        client = AsyncTiendaNubeClient(token_data.get("user_id"), token_data.get("access_token"))
+        stats = await orders_cache.obtener(client.store_id, ("stats",), client.get_order_stats)
         return {"ok": True, "stats": stats}
     except Exception as e:
         print(f"Stats Error: {e}")
         return {"ok": False, "stats": {"unpacked": 0, "packed": 0}}
 
+@app.get("/api/tiendanube/rate-limit")
+async def api_rate_limit_stats(store_id: int = Depends(get_current_store_id)):
+    """Metricas del rate limiter de la tienda activa en este worker (esperas, reintentos, 429)."""
+    token_data = TiendaNubeAuth.get_valid_token(store_id)
+    if not token_data:
+        return JSONResponse(status_code=401, content={"ok": False, "error": "Not authenticated"})
+    return {"ok": True, "stats": rate_limit_stats(token_data.get("user_id"))}
+
+@app.get("/api/orders/cache")
+async def api_orders_cache_stats(current_user: User = Depends(get_current_user)):
+    """Hits/misses del cache corto de /api/orders/ready, overview y stats en este worker."""
+    return {"ok": True, "stats": orders_cache.estadisticas()}
+
 
 @app.post("/andreani/csv")
 async def generate_andreani_csv_route(data: dict, store_id: int = Depends(get_current_store_id)):
@@ -354,19 +515,19 @@ async def generate_andreani_csv_route(data: dict, store_id: int = Depends(get_cu
          return JSONResponse(status_code=401, content={"error": "Not authenticated"})
     
     try:
-        client = TiendaNubeClient(token_data.get("user_id"), token_data.get("access_token"))
+        client = AsyncTiendaNubeClient(token_data.get("user_id"), token_data.get("access_token"))
         
         full_orders = []
         errors = []
         
-        for num in nums:
-            try:
-                real_id = client.lookup_real_order_id(num)
-                order = client.get_order(real_id)
-                full_orders.append(order)
-            except Exception as e:
-                print(f"Error preparing CSV for order {num}: {e}")
-                errors.append(f"Order {num}: {str(e)}")
+        t0 = time.perf_counter()
+        for res in await client.get_orders_bulk(nums):
+            if "error" in res:
+                print(f"Error preparing CSV for order {res['number']}: {res['error']}")
+                errors.append(f"Order {res['number']}: {res['error']}")
+            else:
+                full_orders.append(res["order"])
+        print(f"Fetched {len(full_orders)}/{len(nums)} orders in {time.perf_counter() - t0:.2f}s")
 
         if not full_orders and errors:
              return JSONResponse(status_code=400, content={"error": f"Failed to fetch orders: {'; '.join(errors)}"})
@@ -383,8 +544,32 @@ async def generate_andreani_csv_route(data: dict, store_id: int = Depends(get_cu
         traceback.print_exc()
         return JSONResponse(status_code=500, content={"error": str(e)})
 
-# Batch Process
-BATCH_STORE = {}
+# Batch Process: el trabajo corre en batch_queue y el estado/resultado queda en la tabla batchjob
+
+async def _procesar_lote(client, nums, avance):
+    full_orders = []
+    errors = []
+
+    await avance(5, f"Trayendo {len(nums)} pedidos de Tienda Nube")
+    t0 = time.perf_counter()
+    for res in await client.get_orders_bulk(nums):
+        if "error" in res:
+            print(f"Error for batch {res['number']}: {res['error']}")
+            errors.append(f"Order {res['number']}: {res['error']}")
+        else:
+            full_orders.append(res["order"])
+    print(f"Fetched {len(full_orders)}/{len(nums)} orders in {time.perf_counter() - t0:.2f}s")
+
+    if not full_orders and errors:
+        return {"error": f"Failed to fetch orders: {'; '.join(errors)}"}
+
+    await avance(60, "Armando el lote para Andreani")
+    csv_bytes = TiendaNubeCSVGenerator.generate(full_orders)
+    results = await ejecutar(tarea_process_csv, csv_bytes)
+
+    # El lote genera envios sobre estas ordenes: que el dashboard no muestre el estado de antes
+    orders_cache.invalidar(client.store_id)
+    return results
 
 @app.post("/api/orders/process-batch")
 async def process_batch_route(data: dict, store_id: int = Depends(get_current_store_id)):
@@ -397,36 +582,16 @@ async def process_batch_route(data: dict, store_id: int = Depends(get_current_st
          return JSONResponse(status_code=401, content={"error": "Not authenticated"})
     
     try:
-        client = TiendaNubeClient(token_data.get("user_id"), token_data.get("access_token"))
-        
-        full_orders = []
-        errors = []
-        
-        for num in nums:
-            try:
-                real_id = client.lookup_real_order_id(num)
-                order = client.get_order(real_id)
-                full_orders.append(order)
-            except Exception as e:
-                print(f"Error for batch {num}: {e}")
-                errors.append(f"Order {num}: {str(e)}")
+        client = AsyncTiendaNubeClient(token_data.get("user_id"), token_data.get("access_token"))
 
-        if not full_orders and errors:
-             return JSONResponse(status_code=400, content={"error": f"Failed to fetch orders: {'; '.join(errors)}"})
-
-        csv_bytes = TiendaNubeCSVGenerator.generate(full_orders)
-        
-        results = processor.process_csv(csv_bytes)
-        
-        if isinstance(results, dict) and "error" in results:
-             return JSONResponse(status_code=400, content=results)
-
-        batch_id = str(uuid.uuid4())
-        BATCH_STORE[batch_id] = results
+        batch_id = await asyncio.to_thread(crear_job, store_id)
+        if not await batch_queue.encolar(batch_id, lambda avance: _procesar_lote(client, nums, avance)):
+            return JSONResponse(status_code=503, content={"error": "Hay demasiados lotes en proceso, intenta en un rato"})
         
         return {
             "ok": True,
             "batch_id": batch_id,
+            "status_url": f"/api/batch/{batch_id}/status",
             "redirect_url": f"/excel?batch_id={batch_id}"
         }
 
@@ -434,9 +599,28 @@ async def process_batch_route(data: dict, store_id: int = Depends(get_current_st
         traceback.print_exc()
         return JSONResponse(status_code=500, content={"error": str(e)})
 
+@app.get("/api/batch/{batch_id}/status")
+async def get_batch_status(batch_id: str, store_id: int = Depends(get_current_store_id)):
+    estado = await asyncio.to_thread(obtener_job, batch_id, store_id)
+    if not estado:
+        return JSONResponse(status_code=404, content={"error": "Batch not found or expired"})
+    return {"ok": True, **estado}
+
 @app.get("/api/batch/{batch_id}")
-async def get_batch_data(batch_id: str):
-    data = BATCH_STORE.get(batch_id)
+async def get_batch_data(batch_id: str, store_id: int = Depends(get_current_store_id)):
+    estado = await asyncio.to_thread(obtener_job, batch_id, store_id)
+    if not estado:
+        return JSONResponse(status_code=404, content={"error": "Batch not found or expired"})
+    if estado["status"] == "error":
+        return JSONResponse(status_code=400, content={"error": estado["error"]})
+    if estado["status"] != "done":
+        # Todavia en proceso: el front vuelve a preguntar
+        return JSONResponse(status_code=202, content={"ok": True, **estado})
+    data = await asyncio.to_thread(resultado_job, batch_id, store_id)
     if not data:
         return JSONResponse(status_code=404, content={"error": "Batch not found or expired"})
     return data
+
+@app.get("/api/batch-jobs/stats")
+async def batch_jobs_stats(current_user: User = Depends(get_current_user)):
+    return {"ok": True, "stats": batch_queue.estadisticas()}
@@ -1,6 +1,8 @@
-from sqlmodel import SQLModel, Field, Relationship
+from sqlmodel import SQLModel, Field, Relationship, UniqueConstraint
+from sqlalchemy import BigInteger, Index, Text
 from typing import Optional, List
 from datetime import datetime
+from pydantic import NaiveDatetime
 
 class User(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
@@ -37,3 +39,61 @@ class OAuthState(SQLModel, table=True):
     user_id: int = Field(foreign_key="user.id")
     created_at: datetime = Field(default_factory=datetime.utcnow)
     used: bool = Field(default=False)
+
+class OrderIdMapping(SQLModel, table=True):
+    # Numero de orden (el que ve el cliente) -> id real en Tienda Nube. Nunca cambia una vez creada la orden.
+    __table_args__ = (UniqueConstraint("tiendanube_store_id", "order_number"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    tiendanube_store_id: int = Field(sa_type=BigInteger, index=True)
+    order_number: int = Field(sa_type=BigInteger)
+    real_order_id: int = Field(sa_type=BigInteger)
+    created_at: NaiveDatetime = Field(default_factory=datetime.utcnow)
+
+class OrderMirror(SQLModel, table=True):
+    # Copia local de las ordenes de Tienda Nube; columnas indexadas para los filtros de "listas para enviar"
+    __table_args__ = (
+        UniqueConstraint("tiendanube_store_id", "real_order_id"),
+        Index("ix_ordermirror_ready", "tiendanube_store_id", "status", "payment_status", "shipping_status", "fulfillment_status"),
+        Index("ix_ordermirror_stage", "tiendanube_store_id", "stage"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    tiendanube_store_id: int = Field(sa_type=BigInteger)
+    real_order_id: int = Field(sa_type=BigInteger)
+    order_number: Optional[int] = Field(default=None, sa_type=BigInteger)
+    status: Optional[str] = None
+    payment_status: Optional[str] = None
+    shipping_status: Optional[str] = None
+    fulfillment_status: Optional[str] = None # fulfillments[0].status en minusculas
+    fulfillments_count: int = Field(default=0)
+    stage: Optional[str] = None # 'unpacked' / 'packed' / None, segun order_rules.classify_order
+    updated_at_tn: Optional[str] = None # updated_at tal cual lo manda la API
+    payload: str = Field(sa_type=Text) # JSON completo de la orden
+    synced_at: NaiveDatetime = Field(default_factory=datetime.utcnow)
+
+class OrderSyncState(SQLModel, table=True):
+    # Estado del sync por tienda, compartido por todos los workers (UTC naive, como datetime.utcnow)
+    tiendanube_store_id: int = Field(sa_type=BigInteger, primary_key=True)
+    cursor: Optional[str] = None # mayor updated_at visto: proximo updated_at_min
+    last_synced_at: Optional[NaiveDatetime] = None # fin del ultimo sync completo
+    sync_started_at: Optional[NaiveDatetime] = None # inicio del sync en curso o del ultimo
+    sync_failed_at: Optional[NaiveDatetime] = None # ultimo fallo (backoff); None despues de un sync ok
+    dirty_at: Optional[NaiveDatetime] = None # cambio propio que la copia todavia no tiene
+    last_webhook_at: Optional[NaiveDatetime] = None
+
+class BatchJob(SQLModel, table=True):
+    # Lotes de /api/orders/process-batch: estado y resultado compartidos entre workers
+    __table_args__ = (Index("ix_batchjob_expires_at", "expires_at"),)
+
+    id: str = Field(primary_key=True) # uuid, es el batch_id que ve el front
+    store_id: int = Field(foreign_key="store.id", index=True)
+    status: str = Field(default="queued") # queued / running / done / error
+    etapa: Optional[str] = None # texto de avance para la UI
+    progress: int = Field(default=0) # 0-100
+    error: Optional[str] = None
+    owner: Optional[str] = None # "host:pid" del worker que lo tiene en su cola
+    result: Optional[str] = Field(default=None, sa_type=Text) # JSON de process_csv
+    created_at: NaiveDatetime = Field(default_factory=datetime.utcnow)
+    updated_at: NaiveDatetime = Field(default_factory=datetime.utcnow)
+    expires_at: NaiveDatetime
@@ -0,0 +1,278 @@
+"""
+Lotes en segundo plano para /api/orders/process-batch.
+
+La ruta crea el job (tabla batchjob) y lo encola; un worker del event loop hace el
+trabajo y deja estado, avance y resultado en la base, asi cualquier worker de
+gunicorn puede contestar /api/batch/{id} y el resultado sobrevive a un reinicio.
+Los jobs vencen a las BATCH_JOB_TTL segundos y se borran al crear los siguientes.
+
+La cola vive en memoria: si el worker se reinicia, sus jobs pendientes se pierden.
+Al arrancar, marcar_interrumpidos cierra con error los de procesos de esta maquina
+que ya no existen; los de otras maquinas los cierra cerrar_colgados pasado
+BATCH_JOB_STALE sin avance (al arrancar y cada tanto desde la cola). Consultar un
+job no escribe en la base.
+"""
+import os
+import json
+import uuid
+import socket
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlmodel import select, update, delete, Session
+
+from app.database import engine
+from app.models import BatchJob
+
+BATCH_JOB_TTL = int(os.getenv("BATCH_JOB_TTL", "3600"))
+BATCH_QUEUE_SIZE = int(os.getenv("BATCH_QUEUE_SIZE", "100"))
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "2"))
+# Un job queued/running que no avanza en este tiempo se da por perdido (worker reiniciado)
+BATCH_JOB_STALE = int(os.getenv("BATCH_JOB_STALE", "600"))
+# Cada cuanto la cola busca jobs colgados
+BATCH_SWEEP_INTERVAL = int(os.getenv("BATCH_SWEEP_INTERVAL", "60"))
+
+PENDIENTES = ("queued", "running")
+ERROR_INTERRUMPIDO = "El lote se interrumpio, volve a procesarlo"
+
+
+def _owner() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _proceso_vivo(pid: int) -> bool:
+    if pid == os.getpid():
+        # Mismo pid que el proceso que arranca: el anterior ya no esta
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _colgado(job: BatchJob, ahora: datetime) -> bool:
+    return job.status in PENDIENTES and job.updated_at < ahora - timedelta(seconds=BATCH_JOB_STALE)
+
+
+def cerrar_colgados() -> int:
+    """Pasa a error los jobs queued/running que no avanzan hace BATCH_JOB_STALE. Devuelve cuantos."""
+    with Session(engine) as session:
+        ahora = datetime.utcnow()
+        resultado = session.exec(
+            update(BatchJob)
+            .where(
+                BatchJob.status.in_(PENDIENTES),
+                BatchJob.updated_at < ahora - timedelta(seconds=BATCH_JOB_STALE),
+            )
+            .values(status="error", error=ERROR_INTERRUMPIDO, updated_at=ahora)
+        )
+        session.commit()
+        return resultado.rowcount
+
+
+def marcar_interrumpidos() -> int:
+    """
+    Al arrancar el worker: los jobs queued/running de procesos de esta maquina que ya
+    no existen (o sin owner) pasan a error, asi el front no espera BATCH_JOB_STALE;
+    de paso se cierran los colgados de cualquier maquina. Devuelve cuantos se marcaron.
+    """
+    host = socket.gethostname()
+    with Session(engine) as session:
+        perdidos = []
+        for job_id, owner in session.exec(select(BatchJob.id, BatchJob.owner).where(BatchJob.status.in_(PENDIENTES))):
+            if owner is None:
+                perdidos.append(job_id)
+                continue
+            owner_host, _, pid = owner.rpartition(":")
+            if owner_host == host and pid.isdigit() and not _proceso_vivo(int(pid)):
+                perdidos.append(job_id)
+        if perdidos:
+            session.exec(
+                update(BatchJob)
+                .where(BatchJob.id.in_(perdidos), BatchJob.status.in_(PENDIENTES))
+                .values(status="error", error=ERROR_INTERRUMPIDO, updated_at=datetime.utcnow())
+            )
+            session.commit()
+    return len(perdidos) + cerrar_colgados()
+
+
+def purgar_vencidos():
+    with Session(engine) as session:
+        session.exec(delete(BatchJob).where(BatchJob.expires_at < datetime.utcnow()))
+        session.commit()
+
+
+def crear_job(store_id: int, etapa: str = "En cola") -> str:
+    purgar_vencidos()
+    ahora = datetime.utcnow()
+    job = BatchJob(
+        id=str(uuid.uuid4()),
+        store_id=store_id,
+        etapa=etapa,
+        owner=_owner(),
+        created_at=ahora,
+        updated_at=ahora,
+        expires_at=ahora + timedelta(seconds=BATCH_JOB_TTL),
+    )
+    with Session(engine) as session:
+        session.add(job)
+        session.commit()
+        return job.id
+
+
+def actualizar_job(job_id: str, **campos):
+    """Actualiza status/etapa/progress/error/result; result se guarda como JSON."""
+    if "result" in campos and campos["result"] is not None:
+        campos["result"] = json.dumps(campos["result"], default=str)
+    with Session(engine) as session:
+        job = session.get(BatchJob, job_id)
+        if job is None:
+            return
+        for campo, valor in campos.items():
+            setattr(job, campo, valor)
+        job.updated_at = datetime.utcnow()
+        session.add(job)
+        session.commit()
+
+
+def _buscar_job(session, job_id: str, store_id: int = None):
+    stmt = select(BatchJob).where(BatchJob.id == job_id, BatchJob.expires_at >= datetime.utcnow())
+    if store_id is not None:
+        stmt = stmt.where(BatchJob.store_id == store_id)
+    return session.exec(stmt).first()
+
+
+def obtener_job(job_id: str, store_id: int = None):
+    """
+    Estado del job como dict (sin el resultado), o None si no existe, vencio o es
+    de otra tienda. Solo lee: un job colgado se informa como error aunque
+    cerrar_colgados todavia no lo haya cerrado.
+    """
+    with Session(engine) as session:
+        job = _buscar_job(session, job_id, store_id)
+        if job is None:
+            return None
+        colgado = _colgado(job, datetime.utcnow())
+        return {
+            "batch_id": job.id,
+            "status": "error" if colgado else job.status,
+            "etapa": job.etapa,
+            "progress": job.progress,
+            "error": ERROR_INTERRUMPIDO if colgado else job.error,
+            "created_at": job.created_at.isoformat(),
+            "updated_at": job.updated_at.isoformat(),
+        }
+
+
+def resultado_job(job_id: str, store_id: int = None):
+    """Resultado de un job terminado (dict de process_csv) o None."""
+    with Session(engine) as session:
+        job = _buscar_job(session, job_id, store_id)
+        if job is None or job.status != "done" or job.result is None:
+            return None
+        return json.loads(job.result)
+
+
+class BatchJobQueue:
+    """
+    Cola interna de lotes. Cada item es (job_id, trabajo): `trabajo(avance)` es una
+    corutina que devuelve el resultado; `avance(progress, etapa)` lo va registrando.
+    Si el resultado trae "error" o la corutina falla, el job queda en error.
+    """
+
+    def __init__(self, workers: int = BATCH_WORKERS, maxsize: int = BATCH_QUEUE_SIZE):
+        self.workers = workers
+        self.maxsize = maxsize
+        self.queue = None
+        self.tasks = []
+        self.encolados = 0
+        self.terminados = 0
+        self.errores = 0
+        self.rechazados = 0
+
+    def _corriendo(self) -> bool:
+        return bool(self.tasks) and not all(t.done() for t in self.tasks)
+
+    def start(self):
+        if self._corriendo():
+            return
+        self.queue = asyncio.Queue(maxsize=self.maxsize)
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(max(1, self.workers))]
+        self.tasks.append(asyncio.create_task(self._barrer()))
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def encolar(self, job_id: str, trabajo) -> bool:
+        """False si la cola esta llena; el job queda marcado con error (desde un thread)."""
+        self.start()
+        try:
+            self.queue.put_nowait((job_id, trabajo))
+            self.encolados += 1
+            return True
+        except asyncio.QueueFull:
+            self.rechazados += 1
+            await asyncio.to_thread(actualizar_job, job_id, status="error", error="Hay demasiados lotes en proceso, intenta en un rato")
+            return False
+
+    async def join(self):
+        if self.queue is not None:
+            await self.queue.join()
+
+    async def _worker(self):
+        while True:
+            job_id, trabajo = await self.queue.get()
+            try:
+                await self._correr(job_id, trabajo)
+            finally:
+                self.queue.task_done()
+
+    async def _barrer(self):
+        # Jobs de workers que murieron sin que nadie los vuelva a consultar
+        while True:
+            await asyncio.sleep(BATCH_SWEEP_INTERVAL)
+            try:
+                cerrados = await asyncio.to_thread(cerrar_colgados)
+                if cerrados:
+                    print(f"Batch jobs: closed {cerrados} stale job(s)")
+            except Exception as e:
+                print(f"Batch jobs: stale sweep failed: {e}")
+
+    async def _correr(self, job_id: str, trabajo):
+        async def avance(progress: int, etapa: str = None):
+            await asyncio.to_thread(actualizar_job, job_id, progress=progress, etapa=etapa)
+
+        try:
+            await asyncio.to_thread(actualizar_job, job_id, status="running", etapa="Procesando")
+            resultado = await trabajo(avance)
+            if isinstance(resultado, dict) and "error" in resultado:
+                await asyncio.to_thread(actualizar_job, job_id, status="error", error=str(resultado["error"]))
+                self.errores += 1
+                return
+            await asyncio.to_thread(actualizar_job, job_id, status="done", progress=100, etapa="Listo", result=resultado)
+            self.terminados += 1
+        except Exception as e:
+            self.errores += 1
+            print(f"Batch job {job_id} failed: {e}")
+            try:
+                await asyncio.to_thread(actualizar_job, job_id, status="error", error=str(e))
+            except Exception as e2:
+                print(f"Batch job {job_id}: could not save error: {e2}")
+
+    def estadisticas(self) -> dict:
+        return {
+            "pendientes": self.queue.qsize() if self.queue is not None else 0,
+            "encolados": self.encolados,
+            "terminados": self.terminados,
+            "errores": self.errores,
+            "rechazados": self.rechazados,
+        }
+
+
+batch_queue = BatchJobQueue()
@@ -1,10 +1,16 @@
 # -*- coding: utf-8 -*-
 import pandas as pd
+import numpy as np
 import unicodedata
 import re
 from openpyxl import load_workbook
+from app.services.excel_stream import PlantillaXlsx
 import io
 import os
+import zipfile
+from functools import lru_cache
+from collections import OrderedDict
+import threading
 
 # ========= CONFIGURACIÓN (Defaults) =========
 PESO_POR_DEFECTO_GR = 30
@@ -17,7 +23,6 @@ HOJA_DOMICILIO = "A domicilio"
 HOJA_SUCURSAL  = "A sucursal"
 HOJA_CONFIG    = "Configuracion"
 FILA_INICIO = 3
-ULTIMA_FILA = 400
 
 # ========= FUNCIONES AUXILIARES =========
 
@@ -66,9 +71,7 @@ def formatear_id(val):
         s = s[:-2]
     return s
 
-def normalizar_texto(s: str) -> str:
-    if not isinstance(s, str):
-        s = str(s)
+def _normalizar_texto(s: str) -> str:
     s = s.upper()
     s = "".join(
         c for c in unicodedata.normalize("NFD", s)
@@ -78,6 +81,11 @@ def normalizar_texto(s: str) -> str:
     s = re.sub(r"\s+", " ", s).strip()
     return s
 
+def normalizar_texto(s: str) -> str:
+    if not isinstance(s, str):
+        s = str(s)
+    return _normalizar_texto_cache(s)
+
 def sanitizar_texto(val):
     if val is None or (isinstance(val, float) and pd.isna(val)):
         return ""
@@ -102,6 +110,145 @@ def sanitizar_piso(val):
         
     return s.strip()
 
+# ---------- Versiones vectorizadas (columnas completas) ----------
+# Mismo resultado que las funciones de arriba, aplicadas a una pd.Series entera.
+
+def _tabla_quitar(col, quitar):
+    # Tabla de str.translate que borra los caracteres para los que quitar(ch) es True;
+    # solo se miran los que aparecen en la columna (son pocos distintos).
+    presentes = set("".join(col.dropna().unique().tolist()))
+    return {ord(ch): None for ch in presentes if quitar(ch)}
+
+def _es_marca(ch):
+    # Marcas diacriticas, como en _normalizar_texto
+    return unicodedata.category(ch) == "Mn"
+
+def _columna(df, nombre, default=""):
+    if nombre in df.columns:
+        return df[nombre]
+    return pd.Series(default, index=df.index, dtype=object)
+
+def _texto(col):
+    # str(v) por celda, igual que las funciones escalares (NaN -> "nan"); el
+    # storage "python" mantiene la semantica de regex de re.
+    txt = col.astype(str).astype("string[python]")
+    # astype(str) deja los faltantes como NA: se completan como str(None) / str(nan)
+    faltantes = col.isna().to_numpy()
+    if faltantes.any():
+        valores = col.to_numpy(dtype=object)
+        txt[faltantes] = np.where(valores[faltantes] == None, "None", "nan")  # noqa: E711 (comparacion elemento a elemento)
+    return txt
+
+def _es_texto(col):
+    # .str deja NaN en lo que no es string (numeros, None, NaN)
+    if col.dtype != object:
+        if pd.api.types.is_string_dtype(col.dtype):
+            return col.notna()
+        return pd.Series(False, index=col.index)
+    try:
+        return col.str.len().notna()
+    except AttributeError:
+        return pd.Series(False, index=col.index)
+
+def _solo_digitos(col):
+    # Mismos caracteres que str.isdigit() en las funciones escalares
+    return col.str.translate(_tabla_quitar(col, lambda ch: not ch.isdigit()))
+
+_TABLA_SANITIZAR = str.maketrans({'"': None, "'": None, '\n': ' ', '\r': ' '})
+
+def sanitizar_columna(col):
+    s = _texto(col).str.translate(_TABLA_SANITIZAR)
+    return s.str.strip().where(col.notna(), "")
+
+def sanitizar_piso_columna(col):
+    s = _texto(col).str.strip()
+    for char in ['-', '/']:
+        s = s.str.replace(char, '', regex=False)
+    return s.str.strip().where(col.notna(), "")
+
+def normalizar_columna(col):
+    # Provincias y ciudades se repiten mucho: se normaliza cada valor distinto una vez
+    codigos, unicos = pd.factorize(col, use_na_sentinel=False)
+    s = _texto(pd.Series(unicos, dtype=object)).str.upper().str.normalize("NFD")
+    s = s.str.translate(_tabla_quitar(s, _es_marca))
+    s = s.str.replace(".", " ", regex=False).str.replace(",", " ", regex=False)
+    s = s.str.replace(r"\s+", " ", regex=True).str.strip()
+    return pd.Series(s.to_numpy(dtype=object)[codigos], index=col.index, dtype="string[python]")
+
+def formatear_id_columna(col):
+    s = _texto(col).str.strip().str.replace(r"\.0$", "", regex=True)
+    return s.where(col.notna(), "")
+
+def limpiar_numero_calle_columna(col):
+    dig = _solo_digitos(_texto(col).str.strip().str.upper())
+    return dig.where(dig != "", "0")
+
+def limpiar_telefono_columna(col):
+    txt = _texto(col).str.strip()
+    digits = _solo_digitos(txt)
+    validos = _es_texto(col) & (txt != "") & ~txt.str.lower().str.contains("no informado", regex=False) & (digits != "")
+    numero = digits.where(~digits.str.startswith("54"), digits.str[2:])
+    sin_cero = numero.str.startswith("0") & (numero.str.len() > 8)
+    numero = numero.where(~sin_cero, numero.str[1:])
+    codigo = pd.Series("54", index=col.index, dtype=object)
+    return codigo.where(validos, ""), numero.where(validos, "")
+
+def split_nombre_apellido_columna(col):
+    validos = _es_texto(col)
+    partes = _texto(col.where(validos, "")).str.split()
+    validos &= partes.str.len() > 0
+    nombre = partes.str[0].where(validos, "")
+    apellido = partes.str[1:].str.join(" ").where(validos, "")
+    return nombre, apellido
+
+def preparar_columnas(ventas):
+    """
+    Etapa de limpieza vectorizada de process_csv: devuelve un DataFrame con los
+    campos del registro ya sanitizados, mas las columnas crudas de direccion que
+    usan los buscadores.
+    """
+    prep = pd.DataFrame(index=ventas.index)
+
+    es_sucursal = _texto(ventas["Medio de envío"]).str.contains("Punto de retiro", regex=False)
+    prep["tipo_envio"] = es_sucursal.map({True: "SUCURSAL", False: "DOMICILIO"})
+
+    nombre_envio = _columna(ventas, "Nombre para el envío", None)
+    usar_envio = _es_texto(nombre_envio) & (_texto(nombre_envio).str.strip() != "")
+    nombre_envio = nombre_envio.where(usar_envio, _columna(ventas, "Nombre del comprador"))
+    nombre, apellido = split_nombre_apellido_columna(nombre_envio)
+
+    tel_envio = _columna(ventas, "Teléfono para el envío", None)
+    tel_txt = _texto(tel_envio)
+    usar_tel = _es_texto(tel_envio) & (tel_txt.str.strip() != "") & ~tel_txt.str.lower().str.contains("no informado", regex=False)
+    tel_envio = tel_envio.where(usar_tel, _texto(_columna(ventas, "Teléfono")))
+    cod_cel, num_cel = limpiar_telefono_columna(tel_envio)
+
+    prep["nro_orden"] = _texto(ventas["Número de orden"])
+    prep["nombre"] = sanitizar_columna(nombre)
+    prep["apellido"] = sanitizar_columna(apellido)
+    prep["dni"] = sanitizar_columna(formatear_id_columna(_columna(ventas, "DNI / CUIT")))
+    prep["email"] = sanitizar_columna(_columna(ventas, "Email"))
+    prep["cod_cel"] = cod_cel
+    prep["num_cel"] = num_cel
+    prep["calle"] = sanitizar_columna(_columna(ventas, "Dirección"))
+    prep["numero"] = limpiar_numero_calle_columna(_columna(ventas, "Número"))
+    prep["piso"] = sanitizar_piso_columna(_columna(ventas, "Piso"))
+    prep["observaciones"] = sanitizar_columna(_columna(ventas, "Notas del comprador")).str[:150]
+
+    provincia = _columna(ventas, "Provincia o estado")
+    prep["raw_provincia"] = sanitizar_columna(provincia)
+    prep["raw_localidad"] = sanitizar_columna(_columna(ventas, "Localidad"))
+    prep["raw_ciudad"] = sanitizar_columna(_columna(ventas, "Ciudad"))
+    prep["raw_cp"] = sanitizar_columna(_columna(ventas, "Código postal"))
+    prep["provincia_norm"] = normalizar_columna(provincia)
+
+    # Valores originales (pueden ser NaN / numericos) para el matching
+    prep["_provincia"] = provincia
+    prep["_localidad"] = _columna(ventas, "Localidad")
+    prep["_ciudad"] = _columna(ventas, "Ciudad")
+    prep["_cp"] = _columna(ventas, "Código postal")
+    return prep
+
 # ---------- Índices desde hoja Configuracion ----------
 
 def construir_indice_sucursales(ws_conf):
@@ -163,7 +310,93 @@ def construir_indice_localidades(ws_conf):
 
 # ---------- Matching ----------
 
-def buscar_sucursal_por_direccion(indice_sucursales, calle, numero, localidad=None, ciudad=None, provincia=None):
+def es_caba(prov_norm: str) -> bool:
+    return "CAPITAL FEDERAL" in prov_norm or "CABA" in prov_norm or "AUTONOMA" in prov_norm
+
+def provincia_compatible(prov_input_norm: str, p_idx: str) -> bool:
+    # If we have an input province, we MUST match it roughly
+    if not prov_input_norm:
+        # No input province -> Consider all
+        return True
+    is_caba_input = es_caba(prov_input_norm)
+    is_caba_idx = es_caba(p_idx)
+    if is_caba_input and is_caba_idx:
+        return True
+    elif is_caba_input != is_caba_idx:
+        # One is CABA, the other is not -> Skip
+        return False
+    # General substring match (e.g. "SANTA FE" in "SANTA FE")
+    # Or "BUENOS AIRES" in "PROVINCIA DE BUENOS AIRES"
+    return prov_input_norm in p_idx or p_idx in prov_input_norm
+
+def _gramas(texto: str) -> set:
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+def construir_indice_tokens_sucursales(indice_sucursales):
+    """
+    Indice invertido de sucursales, particionado por provincia normalizada
+    (todas las variantes de CABA comparten un bucket).
+
+    Cada bucket mapea trigramas del texto "nombre + direccion" a las
+    posiciones de las sucursales que los contienen, asi la busqueda por
+    calle solo verifica un punado de candidatos en vez de toda la lista.
+    Los numeros de cada sucursal quedan precalculados.
+    """
+    entradas = []
+    provincias = {}
+    for pos, (name, name_norm, addr_norm, prov_norm_idx) in enumerate(indice_sucursales):
+        combinado = f"{name_norm} {addr_norm}".strip()
+        entradas.append((name, name_norm, addr_norm, re.findall(r"\b\d+\b", combinado), combinado))
+
+        clave = "CABA" if es_caba(prov_norm_idx) else prov_norm_idx
+        bucket = provincias.setdefault(clave, {"provincias": set(), "posiciones": [], "gramas": {}})
+        bucket["provincias"].add(prov_norm_idx)
+        bucket["posiciones"].append(pos)
+        for grama in _gramas(combinado):
+            bucket["gramas"].setdefault(grama, set()).add(pos)
+
+    return {"entradas": entradas, "provincias": provincias, "buckets_por_provincia": {}}
+
+def _buckets_para_provincia(indice_tokens, prov_input_norm):
+    cache = indice_tokens["buckets_por_provincia"]
+    buckets = cache.get(prov_input_norm)
+    if buckets is None:
+        # Un bucket agrupa una sola provincia, salvo el de CABA: ahi todas las
+        # variantes son CABA y la compatibilidad es la misma para todas.
+        buckets = [
+            bucket for bucket in indice_tokens["provincias"].values()
+            if any(provincia_compatible(prov_input_norm, p) for p in bucket["provincias"])
+        ]
+        cache[prov_input_norm] = buckets
+    return buckets
+
+def buscar_candidatos_indexados(indice_tokens, prov_input_norm, frase_calle):
+    """
+    Equivalente indexado del filtro provincia + frase de buscar_sucursal_por_direccion.
+    Devuelve tuplas (name, name_norm, addr_norm, numeros) en el orden original del indice.
+    """
+    gramas = _gramas(frase_calle)
+    entradas = indice_tokens["entradas"]
+    posiciones = []
+    for bucket in _buckets_para_provincia(indice_tokens, prov_input_norm):
+        if gramas:
+            postings = sorted((bucket["gramas"].get(g, ()) for g in gramas), key=len)
+            candidatas = set(postings[0])
+            for p in postings[1:]:
+                if not candidatas:
+                    break
+                candidatas &= p
+        else:
+            candidatas = bucket["posiciones"]
+
+        for pos in candidatas:
+            if frase_calle in entradas[pos][4]:
+                posiciones.append(pos)
+
+    posiciones.sort()
+    return [entradas[pos][:4] for pos in posiciones]
+
+def buscar_sucursal_por_direccion(indice_sucursales, calle, numero, localidad=None, ciudad=None, provincia=None, indice_tokens=None):
     if not isinstance(calle, str) or not calle.strip():
         return "", []
     calle_norm = normalizar_texto(calle)
@@ -172,51 +405,29 @@ def buscar_sucursal_por_direccion(indice_sucursales, calle, numero, localidad=No
         return "", []
 
     # --- FILTRO POR PROVINCIA (ROBUST PROVINCE CHECK) ---
-    candidatos_validos = []
     
     # Normalize input province
     prov_input_norm = ""
     if isinstance(provincia, str) and provincia.strip():
         prov_input_norm = normalizar_texto(provincia)
-    
-    # Handle CABA/Capital special case
-    is_caba_input = "CAPITAL FEDERAL" in prov_input_norm or "CABA" in prov_input_norm or "AUTONOMA" in prov_input_norm
-
-    for item in indice_sucursales:
-        # item is now (name, name_norm, addr_norm, prov_norm_idx)
-        p_idx = item[3]
-        
-        # If we have an input province, we MUST match it roughly
-        if prov_input_norm:
-            # Check CABA special match
-            is_caba_idx = "CAPITAL FEDERAL" in p_idx or "CABA" in p_idx or "AUTONOMA" in p_idx
-            
-            if is_caba_input and is_caba_idx:
-                candidatos_validos.append(item)
-                continue
-            elif is_caba_input != is_caba_idx:
-                # One is CABA, the other is not -> Skip
-                continue
-                
-            # General substring match (e.g. "SANTA FE" in "SANTA FE")
-            # Or "BUENOS AIRES" in "PROVINCIA DE BUENOS AIRES"
-            if prov_input_norm in p_idx or p_idx in prov_input_norm:
-                candidatos_validos.append(item)
-            else:
-                # Mismatch province -> Skip
-                continue
-        else:
-            # No input province -> Consider all
-            candidatos_validos.append(item)
 
     # --- STREET MATCHING ON VALID CANDIDATES ONLY ---
     
     frase_calle = calle_norm
-    candidatos_frase = []
-    for name, name_norm, addr_norm, prov_norm_idx in candidatos_validos:
-        combinado = f"{name_norm} {addr_norm}".strip()
-        if frase_calle in combinado:
-            candidatos_frase.append((name, name_norm, addr_norm))
+    if indice_tokens is not None:
+        candidatos_frase = buscar_candidatos_indexados(indice_tokens, prov_input_norm, frase_calle)
+    else:
+        candidatos_frase = []
+        compatibles = {}
+        for name, name_norm, addr_norm, prov_norm_idx in indice_sucursales:
+            ok = compatibles.get(prov_norm_idx)
+            if ok is None:
+                ok = compatibles[prov_norm_idx] = provincia_compatible(prov_input_norm, prov_norm_idx)
+            if not ok:
+                continue
+            combinado = f"{name_norm} {addr_norm}".strip()
+            if frase_calle in combinado:
+                candidatos_frase.append((name, name_norm, addr_norm, re.findall(r"\b\d+\b", combinado)))
 
     if len(candidatos_frase) == 1:
         return candidatos_frase[0][0], []
@@ -233,10 +444,10 @@ def buscar_sucursal_por_direccion(indice_sucursales, calle, numero, localidad=No
     candidatos = candidatos_base
     if loc_tokens:
         candidatos_loc = []
-        for name, name_norm, addr_norm in candidatos:
-            combined = f"{name_norm} {addr_norm}"
+        for cand in candidatos:
+            combined = f"{cand[1]} {cand[2]}"
             if any(tok in combined for tok in loc_tokens):
-                candidatos_loc.append((name, name_norm, addr_norm))
+                candidatos_loc.append(cand)
         if len(candidatos_loc) == 1:
             return candidatos_loc[0][0], []
         elif len(candidatos_loc) > 1:
@@ -247,9 +458,7 @@ def buscar_sucursal_por_direccion(indice_sucursales, calle, numero, localidad=No
         return "", []
 
     refinados = []
-    for name, name_norm, addr_norm in candidatos:
-        combinado = f"{name_norm} {addr_norm}"
-        nums_conf = re.findall(r"\b\d+\b", combinado)
+    for name, name_norm, addr_norm, nums_conf in candidatos:
         for t in nums_conf:
             if num_digits == t or num_digits.startswith(t) or t.startswith(num_digits):
                 refinados.append(name)
@@ -270,27 +479,141 @@ def buscar_sucursal_por_direccion(indice_sucursales, calle, numero, localidad=No
 
     return "", []
 
-def extraer_base_localidad(valor):
-    if not isinstance(valor, str) or not valor.strip():
-        return ""
+def _extraer_base_localidad(valor):
     norm = normalizar_texto(valor)
     tokens = norm.split()
     stop_tokens = {"CAPITAL", "CENTRO", "CIUDAD", "BARRIO", "NOROESTE", "NORESTE", "SUDOESTE", "SUDESTE", "NORTE", "SUR", "ESTE", "OESTE", "N", "S", "E", "O"}
     base_tokens = [t for t in tokens if t not in stop_tokens]
     return " ".join(base_tokens).strip()
 
-def buscar_localidad_para_envio(indice_localidades, provincia, localidad, ciudad, cp):
-    candidatos = indice_localidades
-    cp_digits = ""
-    if pd.notna(cp):
-        s = str(cp)
-        if s.endswith(".0"):s = s[:-2]
-        cp_digits = "".join(ch for ch in s if ch.isdigit())
+def extraer_base_localidad(valor):
+    if not isinstance(valor, str) or not valor.strip():
+        return ""
+    return _extraer_base_localidad_cache(valor)
+
+# ---------- Cache de normalizacion ----------
+# Provincias, ciudades y localidades se repiten miles de veces entre la hoja
+# Configuracion y los CSV, asi que los helpers de texto pasan por un LRU acotado.
+
+NORMALIZACION_CACHE_SIZE = int(os.getenv("NORMALIZACION_CACHE_SIZE", "50000"))
+
+def configurar_cache_normalizacion(maxsize: int = NORMALIZACION_CACHE_SIZE):
+    """(Re)crea los caches de normalizar_texto y extraer_base_localidad con el tamaño dado."""
+    global _normalizar_texto_cache, _extraer_base_localidad_cache
+    _normalizar_texto_cache = lru_cache(maxsize=maxsize)(_normalizar_texto)
+    _extraer_base_localidad_cache = lru_cache(maxsize=maxsize)(_extraer_base_localidad)
+
+def estadisticas_cache_normalizacion() -> dict:
+    stats = {}
+    for nombre, fn in (("normalizar_texto", _normalizar_texto_cache), ("extraer_base_localidad", _extraer_base_localidad_cache)):
+        info = fn.cache_info()
+        stats[nombre] = {"hits": info.hits, "misses": info.misses, "size": info.currsize, "maxsize": info.maxsize}
+    return stats
+
+configurar_cache_normalizacion()
+
+def construir_hash_localidades(indice_localidades):
+    """
+    Indices hash sobre indice_localidades: CP, localidad normalizada y provincia
+    a posiciones, mas las palabras de cada entrada para el filtro por tokens.
+    Las posiciones respetan el orden de la hoja, que define el orden de las sugerencias.
+    """
+    por_cp = {}
+    por_localidad = {}
+    por_provincia = {}
+    por_palabra = {}
+    caba = set()
+    for pos, (orig, norm, prov_norm_idx, loc_norm_idx, cp_idx) in enumerate(indice_localidades):
+        por_cp.setdefault(cp_idx, []).append(pos)
+        por_localidad.setdefault(loc_norm_idx, []).append(pos)
+        por_provincia.setdefault(prov_norm_idx, []).append(pos)
+        combined = " ".join([norm, prov_norm_idx, loc_norm_idx])
+        for palabra in set(combined.split()):
+            por_palabra.setdefault(palabra, set()).add(pos)
+        if "CIUDAD AUTONOMA BUENOS AIRES" in loc_norm_idx:
+            caba.add(pos)
+
+    return {
+        "entradas": indice_localidades,
+        "por_cp": por_cp,
+        "por_localidad": por_localidad,
+        "por_provincia": por_provincia,
+        "por_palabra": por_palabra,
+        "caba": caba,
+        "memo_tokens": {},
+        "memo_provincias": {},
+    }
+
+MAX_MEMO_LOCALIDADES = 4096
+
+def _memo_localidades(memo, clave, calcular):
+    res = memo.get(clave)
+    if res is None:
+        if len(memo) >= MAX_MEMO_LOCALIDADES:
+            memo.clear()
+        res = memo[clave] = calcular()
+    return res
+
+def _posiciones_token(indice_hash, tok):
+    # tok no tiene espacios: "tok in combined" equivale a ser substring de alguna palabra
+    def calcular():
+        res = set()
+        for palabra, posiciones in indice_hash["por_palabra"].items():
+            if tok in palabra:
+                res |= posiciones
+        return res
+    return _memo_localidades(indice_hash["memo_tokens"], tok, calcular)
+
+def _posiciones_provincia(indice_hash, prov_norm_q):
+    def calcular():
+        res = set()
+        for prov_norm_idx, posiciones in indice_hash["por_provincia"].items():
+            if prov_norm_q in prov_norm_idx:
+                res.update(posiciones)
+        for pos, item in enumerate(indice_hash["entradas"]):
+            if prov_norm_q in item[1]:
+                res.add(pos)
+        return res
+    return _memo_localidades(indice_hash["memo_provincias"], prov_norm_q, calcular)
+
+def _filtrar_posiciones(candidatos, posiciones):
+    # candidatos None = todo el indice
+    if candidatos is None:
+        return sorted(posiciones)
+    return sorted(posiciones.intersection(candidatos))
+
+def cp_a_digitos(cp) -> str:
+    if not pd.notna(cp):
+        return ""
+    s = str(cp)
+    if s.endswith(".0"):s = s[:-2]
+    return "".join(ch for ch in s if ch.isdigit())
+
+# (indice_localidades, su hash) del ultimo llamado sin indice_hash: se reusa mientras sea la misma lista
+_ultimo_hash_localidades = (None, None)
+
+def hash_localidades(indice_localidades):
+    """construir_hash_localidades memoizado por identidad de la lista."""
+    global _ultimo_hash_localidades
+    indice, indice_hash = _ultimo_hash_localidades
+    if indice is not indice_localidades:
+        indice_hash = construir_hash_localidades(indice_localidades)
+        _ultimo_hash_localidades = (indice_localidades, indice_hash)
+    return indice_hash
+
+def buscar_localidad_para_envio(indice_localidades, provincia, localidad, ciudad, cp, indice_hash=None):
+    if indice_hash is None:
+        indice_hash = hash_localidades(indice_localidades)
+    entradas = indice_hash["entradas"]
+
+    # Lista de posiciones en el indice; None = todas
+    candidatos = None if entradas else []
+    cp_digits = cp_a_digitos(cp)
 
     if cp_digits:
-        c_cp = [item for item in indice_localidades if item[4] == cp_digits]
+        c_cp = indice_hash["por_cp"].get(cp_digits, [])
         if len(c_cp) == 1:
-            return c_cp[0][0], []
+            return entradas[c_cp[0]][0], []
         elif len(c_cp) > 1:
             candidatos = c_cp
 
@@ -298,74 +621,203 @@ def buscar_localidad_para_envio(indice_localidades, provincia, localidad, ciudad
     loc_norm = normalizar_texto(loc_text) if loc_text else ""
     loc_tokens = [t for t in loc_norm.split() if len(t) > 3]
 
-    if loc_tokens and candidatos:
-        c_loc = []
-        for orig, norm, prov_norm_idx, loc_norm_idx, cp_idx in candidatos:
-            combined = " ".join([norm, prov_norm_idx, loc_norm_idx])
-            if any(tok in combined for tok in loc_tokens):
-                c_loc.append((orig, norm, prov_norm_idx, loc_norm_idx, cp_idx))
+    if loc_tokens and candidatos != []:
+        posiciones = set()
+        for tok in loc_tokens:
+            posiciones |= _posiciones_token(indice_hash, tok)
+        c_loc = _filtrar_posiciones(candidatos, posiciones)
         if len(c_loc) == 1:
-            return c_loc[0][0], []
+            return entradas[c_loc[0]][0], []
         elif len(c_loc) > 1:
             candidatos = c_loc
 
     loc_base_localidad = extraer_base_localidad(localidad)
     loc_base_ciudad    = extraer_base_localidad(ciudad)
 
-    if (loc_base_localidad or loc_base_ciudad) and candidatos:
-        exact = []
-        for orig, norm, prov_norm_idx, loc_norm_idx, cp_idx in candidatos:
-            if (loc_base_localidad and loc_norm_idx == loc_base_localidad) or (loc_base_ciudad and loc_norm_idx == loc_base_ciudad):
-                exact.append((orig, norm, prov_norm_idx, loc_norm_idx, cp_idx))
+    if (loc_base_localidad or loc_base_ciudad) and candidatos != []:
+        posiciones = set()
+        for base in (loc_base_localidad, loc_base_ciudad):
+            if base:
+                posiciones.update(indice_hash["por_localidad"].get(base, []))
+        exact = _filtrar_posiciones(candidatos, posiciones)
         if len(exact) == 1:
-            return exact[0][0], []
+            return entradas[exact[0]][0], []
         elif len(exact) > 1:
             candidatos = exact
 
     prov_norm_q = ""
     if isinstance(provincia, str) and provincia.strip():
         prov_norm_q = normalizar_texto(provincia)
-    if prov_norm_q and candidatos:
-        c_prov = []
-        for orig, norm, prov_norm_idx, loc_norm_idx, cp_idx in candidatos:
-            if prov_norm_q in prov_norm_idx or prov_norm_q in norm:
-                c_prov.append((orig, norm, prov_norm_idx, loc_norm_idx, cp_idx))
+    if prov_norm_q and candidatos != []:
+        c_prov = _filtrar_posiciones(candidatos, _posiciones_provincia(indice_hash, prov_norm_q))
         if len(c_prov) == 1:
-            return c_prov[0][0], []
+            return entradas[c_prov[0]][0], []
         elif len(c_prov) > 1:
             candidatos = c_prov
 
+    if candidatos is None:
+        candidatos = range(len(entradas))
+
     if prov_norm_q.find("CAPITAL FEDERAL") != -1 and candidatos:
-        prioridad = []
-        for orig, norm, prov_norm_idx, loc_norm_idx, cp_idx in candidatos:
-            if "CIUDAD AUTONOMA BUENOS AIRES" in loc_norm_idx:
-                prioridad.append((orig, norm, prov_norm_idx, loc_norm_idx, cp_idx))
+        prioridad = _filtrar_posiciones(candidatos, indice_hash["caba"])
         if prioridad:
-            return prioridad[0][0], []
+            return entradas[prioridad[0]][0], []
 
     if len(candidatos) == 1:
-        return candidatos[0][0], []
+        return entradas[candidatos[0]][0], []
     
     # Retornar sugerencias si hay candidatos que no filtraron a 1
     if candidatos:
-        # candidatos es lista de tuplas
-        sugs = [c[0] for c in candidatos]
-        return "", sugs[:5]
+        sugs = [entradas[pos][0] for pos in candidatos[:5]]
+        return "", sugs
 
     return "", []
 
 # ========= API LOGIC =========
 
+def fila_excel(item):
+    """Celdas (columna 1-based, valor) de un registro verificado en su hoja de destino."""
+    is_sucursal = item["tipo_envio"] == "SUCURSAL"
+    # 1: Paquete (None)
+    celdas = [
+        (2, PESO_POR_DEFECTO_GR),
+        (3, ALTO_DEF),
+        (4, ANCHO_DEF),
+        (5, PROF_DEF),
+        (6, VALOR_DECLARADO),
+        (7, str(item["nro_orden"])),
+        (8, item["nombre"]),
+        (9, item["apellido"]),
+        (10, item["dni"]),
+        (11, item["email"]),
+        (12, item["cod_cel"]),
+        (13, item["num_cel"]),
+    ]
+    if is_sucursal:
+        celdas.append((14, item["match_value"]))
+    else:
+        celdas += [
+            (14, item["calle"]),
+            (15, item["numero"]),
+            (16, item["piso"]),
+            (17, ""), # Dpto
+            (18, item["match_value"]),
+            (19, item["observaciones"]),
+        ]
+    return celdas
+
+def _partir_por_hoja(verified_data, filas_por_archivo):
+    """Agrupa registros en lotes con a lo sumo filas_por_archivo filas por hoja."""
+    lote = []
+    conteo = {"SUCURSAL": 0, "DOMICILIO": 0}
+    for item in verified_data:
+        tipo = "SUCURSAL" if item["tipo_envio"] == "SUCURSAL" else "DOMICILIO"
+        if conteo[tipo] >= filas_por_archivo:
+            yield lote
+            lote = []
+            conteo = {"SUCURSAL": 0, "DOMICILIO": 0}
+        lote.append(item)
+        conteo[tipo] += 1
+    if lote:
+        yield lote
+
+MATCH_CACHE_SIZE = int(os.getenv("MATCH_CACHE_SIZE", "20000"))
+
+def _norm_opcional(valor):
+    # Los buscadores ignoran los valores que no son texto
+    return normalizar_texto(valor) if isinstance(valor, str) else None
+
 class AndreaniProcessor:
-    def __init__(self, plantilla_path):
+    def __init__(self, plantilla_path, match_cache_size: int = MATCH_CACHE_SIZE):
         self.plantilla_path = plantilla_path
-        self.wb = load_workbook(plantilla_path, data_only=False)
+        # LRU de resultados de matching por direccion normalizada, compartido entre llamadas
+        self.match_cache = OrderedDict()
+        self.match_cache_size = match_cache_size
+        self.match_cache_hits = 0
+        self.match_cache_misses = 0
+        self._match_cache_lock = threading.Lock()
+        self._cargar_plantilla()
+
+    def _firma_plantilla(self):
+        st = os.stat(self.plantilla_path)
+        return (st.st_mtime_ns, st.st_size)
+
+    def _cargar_plantilla(self):
+        self.firma_plantilla = self._firma_plantilla()
+        with open(self.plantilla_path, "rb") as f:
+            self.plantilla_xlsx = PlantillaXlsx(f.read(), [HOJA_DOMICILIO, HOJA_SUCURSAL], FILA_INICIO)
+        self.wb = load_workbook(self.plantilla_path, data_only=False)
         self.ws_conf = self.wb[HOJA_CONFIG]
         self.indice_sucursales, self.nombres_sucursales = construir_indice_sucursales(self.ws_conf)
         self.indice_localidades, self.nombres_localidades = construir_indice_localidades(self.ws_conf)
-        # No guardamos cambios en self.wb aún, solo leemos config
+        self.indice_tokens_sucursales = construir_indice_tokens_sucursales(self.indice_sucursales)
+        self.indice_hash_localidades = construir_hash_localidades(self.indice_localidades)
+        # No guardamos cambios en self.wb, solo leemos config
+        with self._match_cache_lock:
+            self.match_cache.clear()
+
+    def verificar_plantilla(self):
+        """Recarga indices y vacia el cache de matches si la plantilla cambio en disco."""
+        if self._firma_plantilla() != self.firma_plantilla:
+            print(f"Plantilla modificada, recargando {self.plantilla_path}")
+            self._cargar_plantilla()
+
+    def buscar_match(self, item, provincia, localidad, ciudad, cp):
+        """
+        Match + sugerencias para un registro ya sanitizado, pasando por el cache.
+        Devuelve (match, suggestions, hit).
+        """
+        if item["tipo_envio"] == "SUCURSAL":
+            clave = (
+                "SUCURSAL", normalizar_texto(item["calle"]), "".join(ch for ch in str(item["numero"]) if ch.isdigit()),
+                _norm_opcional(localidad), _norm_opcional(ciudad), _norm_opcional(provincia), None,
+            )
+        else:
+            clave = (
+                "DOMICILIO", None, None,
+                _norm_opcional(localidad), _norm_opcional(ciudad), _norm_opcional(provincia), cp_a_digitos(cp),
+            )
+
+        with self._match_cache_lock:
+            cached = self.match_cache.get(clave)
+            if cached is not None:
+                self.match_cache.move_to_end(clave)
+                self.match_cache_hits += 1
+                return cached[0], list(cached[1]), True
+            self.match_cache_misses += 1
+
+        if item["tipo_envio"] == "SUCURSAL":
+            match, suggestions = buscar_sucursal_por_direccion(
+                self.indice_sucursales,
+                item["calle"], item["numero"], localidad, ciudad, provincia,
+                indice_tokens=self.indice_tokens_sucursales
+            )
+        else:
+            match, suggestions = buscar_localidad_para_envio(
+                self.indice_localidades,
+                provincia, localidad, ciudad, cp,
+                indice_hash=self.indice_hash_localidades
+            )
+
+        with self._match_cache_lock:
+            self.match_cache[clave] = (match, tuple(suggestions))
+            self.match_cache.move_to_end(clave)
+            while len(self.match_cache) > self.match_cache_size:
+                self.match_cache.popitem(last=False)
+        return match, suggestions, False
+
+    def estadisticas_cache(self) -> dict:
+        total = self.match_cache_hits + self.match_cache_misses
+        return {
+            "hits": self.match_cache_hits,
+            "misses": self.match_cache_misses,
+            "size": len(self.match_cache),
+            "maxsize": self.match_cache_size,
+            "hit_rate": round(self.match_cache_hits / total, 4) if total else 0.0,
+        }
 
     def process_csv(self, csv_content: bytes):
+        self.verificar_plantilla()
         ventas = pd.read_csv(io.BytesIO(csv_content), encoding="latin1", sep=";")
         
         if "Estado del envío" not in ventas.columns:
@@ -386,71 +838,23 @@ class AndreaniProcessor:
         # Actually sorting the DF by "Número de orden" is good for ID order, but user wants Domicilio first.
         # We will sort the 'records' list at the end.
         
+        prep = preparar_columnas(ventas_filtrado)
+        campos = [
+            "nro_orden", "nombre", "apellido", "dni", "email", "cod_cel", "num_cel",
+            "calle", "numero", "piso", "observaciones",
+            "raw_provincia", "raw_localidad", "raw_ciudad", "raw_cp", "provincia_norm", "tipo_envio",
+        ]
+        direcciones = zip(prep["_provincia"].tolist(), prep["_localidad"].tolist(), prep["_ciudad"].tolist(), prep["_cp"].tolist())
+
         records = []
+        cache_hits = 0
         
-        for _, r in ventas_filtrado.iterrows():
-            item = {}
-            medio = str(r["Medio de envío"] or "")
-            is_sucursal = "Punto de retiro" in medio
-            
-            # Datos comunes
-            nombre_envio = r.get("Nombre para el envío")
-            if not isinstance(nombre_envio, str) or not nombre_envio.strip():
-                nombre_envio = r.get("Nombre del comprador", "")
-            nombre, apellido = split_nombre_apellido(nombre_envio)
-            
-            tel_envio = r.get("Teléfono para el envío")
-            if (not isinstance(tel_envio, str) or not tel_envio.strip() or "no informado" in tel_envio.lower()):
-                tel_envio = str(r.get("Teléfono", ""))
-            cod_cel, num_cel = limpiar_telefono(tel_envio)
-            
-            item["nro_orden"] = str(r["Número de orden"])
-            item["nombre"] = sanitizar_texto(nombre)
-            item["apellido"] = sanitizar_texto(apellido)
-            item["dni"] = sanitizar_texto(formatear_id(r.get("DNI / CUIT", "")))
-            item["email"] = sanitizar_texto(r.get("Email", ""))
-            item["cod_cel"] = cod_cel
-            item["num_cel"] = num_cel
-            item["calle"] = sanitizar_texto(r.get("Dirección", ""))
-            item["numero"] = sanitizar_texto(limpiar_numero_calle(r.get("Número", "")))
-            item["piso"] = sanitizar_piso(r.get("Piso", ""))
-            
-            obs = sanitizar_texto(r.get("Notas del comprador", ""))
-            if len(obs) > 150:
-                obs = obs[:150]
-            item["observaciones"] = obs
-            
-            # Datos de direccion
-            provincia = r.get("Provincia o estado", "")
-            localidad = r.get("Localidad", "")
-            ciudad    = r.get("Ciudad", "")
-            cp        = r.get("Código postal", "")
-            
-            item["raw_provincia"] = sanitizar_texto(provincia)
-            item["raw_localidad"] = sanitizar_texto(localidad)
-            item["raw_ciudad"] = sanitizar_texto(ciudad)
-            item["raw_cp"] = sanitizar_texto(cp)
-            
-            item["provincia_norm"] = normalizar_texto(provincia)
-            
-            item["tipo_envio"] = "SUCURSAL" if is_sucursal else "DOMICILIO"
-            
-            if is_sucursal:
-                match, suggestions = buscar_sucursal_por_direccion(
-                    self.indice_sucursales,
-                    item["calle"], item["numero"], localidad, ciudad, provincia
-                )
-                item["match_value"] = match
-                item["suggestions"] = suggestions
-                item["status"] = "OK" if match else "MISSING"
-            else:
-                match, suggestions = buscar_localidad_para_envio(
-                    self.indice_localidades,
-                    provincia, localidad, ciudad, cp
-                )
-                item["match_value"] = match
-                item["suggestions"] = suggestions
-                item["status"] = "OK" if match else "MISSING"
+        for item, (provincia, localidad, ciudad, cp) in zip(prep[campos].to_dict("records"), direcciones):
+            match, suggestions, hit = self.buscar_match(item, provincia, localidad, ciudad, cp)
+            cache_hits += int(hit)
+            item["match_value"] = match
+            item["suggestions"] = suggestions
+            item["status"] = "OK" if match else "MISSING"
             
             records.append(item)
             
@@ -469,59 +873,57 @@ class AndreaniProcessor:
                 "total": len(records),
                 "sucursal": sum(1 for r in records if r["tipo_envio"] == "SUCURSAL"),
                 "domicilio": sum(1 for r in records if r["tipo_envio"] == "DOMICILIO"),
-                "revisar": sum(1 for r in records if r["status"] == "MISSING")
+                "revisar": sum(1 for r in records if r["status"] == "MISSING"),
+                "cache_hits": cache_hits,
+                "cache_hit_rate": round(cache_hits / len(records), 4) if records else 0.0
             }
         }
 
-    def generate_excel(self, verified_data, output_path):
-        # Recargar plantilla limpia
-        wb = load_workbook(self.plantilla_path, data_only=False)
-        ws_dom = wb[HOJA_DOMICILIO]
-        ws_suc = wb[HOJA_SUCURSAL]
-        
-        # Limpiar
-        for ws in [ws_dom, ws_suc]:
-            for row in range(FILA_INICIO, ULTIMA_FILA + 1):
-                for col in range(1, 19 + 1):
-                    ws.cell(row=row, column=col).value = None
-
-        r_dom = FILA_INICIO
-        r_suc = FILA_INICIO
-        
-        for item in verified_data:
-            is_sucursal = item["tipo_envio"] == "SUCURSAL"
-            ws = ws_suc if is_sucursal else ws_dom
-            row = r_suc if is_sucursal else r_dom
-            
-            # Mapeo de columnas (1-based)
-            # 1: Paquete (None)
-            ws.cell(row=row, column=2).value = PESO_POR_DEFECTO_GR
-            ws.cell(row=row, column=3).value = ALTO_DEF
-            ws.cell(row=row, column=4).value = ANCHO_DEF
-            ws.cell(row=row, column=5).value = PROF_DEF
-            ws.cell(row=row, column=6).value = VALOR_DECLARADO
-            ws.cell(row=row, column=7).value = str(item["nro_orden"])
-            ws.cell(row=row, column=8).value = item["nombre"]
-            ws.cell(row=row, column=9).value = item["apellido"]
-            ws.cell(row=row, column=10).value = item["dni"]
-            ws.cell(row=row, column=11).value = item["email"]
-            ws.cell(row=row, column=12).value = item["cod_cel"]
-            ws.cell(row=row, column=13).value = item["num_cel"]
-            
-            if is_sucursal:
-                ws.cell(row=row, column=14).value = item["match_value"]
-            else:
-                ws.cell(row=row, column=14).value = item["calle"]
-                ws.cell(row=row, column=15).value = item["numero"]
-                ws.cell(row=row, column=16).value = item["piso"]
-                ws.cell(row=row, column=17).value = "" # Dpto
-                ws.cell(row=row, column=18).value = item["match_value"] 
-                ws.cell(row=row, column=19).value = item["observaciones"]
-            
-            if is_sucursal:
-                r_suc += 1
-            else:
-                r_dom += 1
-                
-        wb.save(output_path)
-        return output_path
+    def generate_excel(self, verified_data, output):
+        """
+        Carga los registros verificados en la plantilla y la guarda en `output`
+        (ruta o file-like). Devuelve `output`. Es generate_excel_stream sin partir en
+        varios archivos: escribe solo las filas que hay, sin recargar ni limpiar la plantilla.
+        """
+        self.generate_excel_stream(verified_data, output)
+        return output
+
+    def generate_excel_stream(self, verified_data, output, filas_por_archivo: int = None) -> int:
+        """
+        Genera la planilla escribiendo las hojas fila por fila sobre la plantilla
+        (sin openpyxl), sin limite de filas y con memoria constante.
+
+        Si filas_por_archivo esta definido y alguna hoja lo supera, `output` recibe
+        un .zip con varios .xlsx numerados. Devuelve la cantidad de archivos generados
+        (1 = `output` es directamente el .xlsx).
+        """
+        if filas_por_archivo is not None and filas_por_archivo < 1:
+            raise ValueError(f"filas_por_archivo debe ser >= 1 (vino {filas_por_archivo})")
+        self.verificar_plantilla()
+
+        def filas(registros, tipo):
+            for item in registros:
+                if (item["tipo_envio"] == "SUCURSAL") == (tipo == "SUCURSAL"):
+                    yield fila_excel(item)
+
+        def escribir(destino, registros):
+            self.plantilla_xlsx.escribir(destino, {
+                HOJA_DOMICILIO: filas(registros, "DOMICILIO"),
+                HOJA_SUCURSAL: filas(registros, "SUCURSAL"),
+            })
+
+        lotes = [verified_data]
+        if filas_por_archivo is not None:
+            # Los lotes solo guardan referencias a los registros ya en memoria
+            lotes = list(_partir_por_hoja(verified_data, filas_por_archivo)) or [[]]
+
+        if len(lotes) == 1:
+            escribir(output, lotes[0])
+            return 1
+
+        base = os.path.splitext(os.path.basename(self.plantilla_path))[0]
+        with zipfile.ZipFile(output, "w", zipfile.ZIP_STORED) as zout:
+            for nro, lote in enumerate(lotes, start=1):
+                with zout.open(f"{base}_cargado_{nro}.xlsx", "w") as destino:
+                    escribir(destino, lote)
+        return len(lotes)
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Escritura en streaming de planillas basadas en la plantilla de Andreani.
+
+En vez de cargar el workbook con openpyxl, se copia el .xlsx de la plantilla
+miembro por miembro y solo se reescribe el <sheetData> de las hojas de envio,
+fila por fila. La hoja Configuracion, estilos y validaciones pasan tal cual, asi
+que la memoria no crece con la cantidad de registros ni con el tamaño de la plantilla.
+"""
+import io
+import re
+import shutil
+import zipfile
+import posixpath
+from xml.sax.saxutils import escape
+
+_RE_SHEET = re.compile(r'<(?:\w+:)?sheet\b[^>]*?\bname="([^"]+)"[^>]*?\b(?:\w+:)?id="([^"]+)"')
+_RE_REL = re.compile(r'<Relationship\b[^>]*>')
+_RE_ATTR = re.compile(r'(\w+)="([^"]*)"')
+_RE_SHEETDATA = re.compile(r'<(\w+:)?sheetData\s*/>|<(\w+:)?sheetData>(.*?)</(?:\w+:)?sheetData>', re.DOTALL)
+_RE_ROW = re.compile(r'<(?:\w+:)?row\b[^>]*?\br="(\d+)"[^>]*?(?:/>|>.*?</(?:\w+:)?row>)', re.DOTALL)
+_RE_DIMENSION = re.compile(r'<(?:\w+:)?dimension\b[^>]*?/>')
+# Caracteres de control que XML 1.0 no admite
+_RE_ILEGALES = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def letra_columna(col: int) -> str:
+    letras = ""
+    while col > 0:
+        col, resto = divmod(col - 1, 26)
+        letras = chr(65 + resto) + letras
+    return letras
+
+
+def _rutas_hojas(zin: zipfile.ZipFile) -> dict:
+    """Nombre de hoja -> ruta del XML dentro del zip."""
+    workbook = zin.read("xl/workbook.xml").decode("utf-8-sig")
+    rels_xml = zin.read("xl/_rels/workbook.xml.rels").decode("utf-8-sig")
+    rels = {}
+    for tag in _RE_REL.findall(rels_xml):
+        attrs = dict(_RE_ATTR.findall(tag))
+        if "Id" in attrs and "Target" in attrs:
+            target = attrs["Target"]
+            if target.startswith("/"):
+                target = target[1:]
+            else:
+                target = posixpath.normpath(posixpath.join("xl", target))
+            rels[attrs["Id"]] = target
+    return {name: rels[rid] for name, rid in _RE_SHEET.findall(workbook) if rid in rels}
+
+
+class PlantillaXlsx:
+    """
+    Plantilla .xlsx preparada para escribir filas en streaming sobre algunas hojas.
+
+    Para cada hoja se guarda el XML partido en: cabecera (hasta <sheetData>),
+    filas fijas anteriores a fila_inicio y cola (desde </sheetData>).
+    """
+
+    def __init__(self, contenido: bytes, hojas: list, fila_inicio: int):
+        self.contenido = contenido
+        self.fila_inicio = fila_inicio
+        self.partes = {}
+        with zipfile.ZipFile(io.BytesIO(contenido)) as zin:
+            rutas = _rutas_hojas(zin)
+            for hoja in hojas:
+                if hoja not in rutas:
+                    raise ValueError(f"La plantilla no tiene la hoja '{hoja}'")
+                xml = zin.read(rutas[hoja]).decode("utf-8-sig")
+                m = _RE_SHEETDATA.search(xml)
+                if not m:
+                    raise ValueError(f"La hoja '{hoja}' no tiene <sheetData>")
+                prefijo = m.group(1) or m.group(2) or ""
+                filas_fijas = "".join(
+                    fila.group(0) for fila in _RE_ROW.finditer(m.group(3) or "")
+                    if int(fila.group(1)) < fila_inicio
+                )
+                self.partes[rutas[hoja]] = {
+                    "hoja": hoja,
+                    "prefijo": prefijo,
+                    # <dimension> es opcional y quedaria desactualizado: se descarta
+                    "cabecera": _RE_DIMENSION.sub("", xml[:m.start()], count=1),
+                    "filas_fijas": filas_fijas,
+                    "cola": xml[m.end():],
+                }
+
+    def _celda(self, prefijo: str, ref: str, valor) -> str:
+        if isinstance(valor, bool) or not isinstance(valor, (int, float)):
+            texto = _RE_ILEGALES.sub("", str(valor))
+            espacio = ' xml:space="preserve"' if texto != texto.strip() else ""
+            return (
+                f'<{prefijo}c r="{ref}" t="inlineStr"><{prefijo}is>'
+                f'<{prefijo}t{espacio}>{escape(texto)}</{prefijo}t></{prefijo}is></{prefijo}c>'
+            )
+        return f'<{prefijo}c r="{ref}"><{prefijo}v>{valor}</{prefijo}v></{prefijo}c>'
+
+    def _escribir_hoja(self, destino, partes: dict, filas):
+        p = partes["prefijo"]
+        destino.write(partes["cabecera"].encode("utf-8"))
+        destino.write(f"<{p}sheetData>".encode("utf-8"))
+        destino.write(partes["filas_fijas"].encode("utf-8"))
+
+        nro = self.fila_inicio
+        for celdas in filas:
+            xml = [f'<{p}row r="{nro}">']
+            for col, valor in celdas:
+                if valor is None or valor == "":
+                    continue
+                xml.append(self._celda(p, f"{letra_columna(col)}{nro}", valor))
+            xml.append(f"</{p}row>")
+            destino.write("".join(xml).encode("utf-8"))
+            nro += 1
+
+        destino.write(f"</{p}sheetData>".encode("utf-8"))
+        destino.write(partes["cola"].encode("utf-8"))
+        return nro - self.fila_inicio
+
+    def escribir(self, salida, filas_por_hoja: dict):
+        """
+        Escribe un .xlsx en `salida` (ruta o file-like, no necesita seek).
+        filas_por_hoja: nombre de hoja -> iterable de filas, cada fila una lista de (columna, valor).
+        """
+        with zipfile.ZipFile(io.BytesIO(self.contenido)) as zin, \
+                zipfile.ZipFile(salida, "w", zipfile.ZIP_DEFLATED) as zout:
+            for info in zin.infolist():
+                partes = self.partes.get(info.filename)
+                if partes is None:
+                    with zin.open(info) as src, zout.open(info, "w") as dst:
+                        shutil.copyfileobj(src, dst)
+                    continue
+
+                with zout.open(info.filename, "w") as dst:
+                    self._escribir_hoja(dst, partes, filas_por_hoja.get(partes["hoja"], ()))
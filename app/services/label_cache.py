@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Cache en disco de los datos extraidos de PDFs de etiquetas Andreani.
+
+extract_text de PyPDF2 es lo mas caro de estampar SKUs y de cargar trackings, y el
+mismo PDF pasa por los dos flujos (y a veces se vuelve a subir). La clave es el
+sha256 del archivo; el valor, por pagina: N° interno, orden y tracking ya parseados
+y el tamaño de la pagina. Un JSON por PDF en LABEL_CACHE_DIR, compartido entre
+procesos; al superar LABEL_CACHE_MAX_BYTES se borran los menos usados.
+"""
+import os
+import json
+import hashlib
+import tempfile
+import threading
+
+LABEL_CACHE_ENABLED = os.getenv("LABEL_CACHE_ENABLED", "1") == "1"
+LABEL_CACHE_DIR = os.getenv("LABEL_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "shipflow_label_cache")
+LABEL_CACHE_MAX_BYTES = int(os.getenv("LABEL_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Cambiar si cambia lo que se guarda por pagina (o las regex): invalida lo anterior
+LABEL_CACHE_VERSION = "1"
+
+
+class LabelCache:
+
+    def __init__(self, directorio: str = LABEL_CACHE_DIR, max_bytes: int = LABEL_CACHE_MAX_BYTES, enabled: bool = LABEL_CACHE_ENABLED):
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def clave(pdf_bytes: bytes) -> str:
+        return hashlib.sha256(pdf_bytes).hexdigest()
+
+    def _ruta(self, clave: str) -> str:
+        return os.path.join(self.directorio, f"{clave}.v{LABEL_CACHE_VERSION}.json")
+
+    def get(self, clave: str):
+        """Lista de datos por pagina, o None si no esta."""
+        if not self.enabled:
+            return None
+        ruta = self._ruta(clave)
+        try:
+            with open(ruta, encoding="utf-8") as f:
+                paginas = json.load(f)
+        except (OSError, ValueError):
+            with self.lock:
+                self.misses += 1
+            return None
+        try:
+            # mtime = ultimo uso, para desalojar los menos usados
+            os.utime(ruta)
+        except OSError:
+            pass
+        with self.lock:
+            self.hits += 1
+        return paginas
+
+    def guardar(self, clave: str, paginas: list):
+        if not self.enabled:
+            return
+        try:
+            os.makedirs(self.directorio, exist_ok=True)
+            # Escritura atomica: otro proceso nunca lee un JSON a medias
+            fd, temporal = tempfile.mkstemp(dir=self.directorio, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(paginas, f)
+            os.replace(temporal, self._ruta(clave))
+            self._podar()
+        except OSError as e:
+            print(f"Label cache write failed: {e}")
+
+    def _archivos(self):
+        archivos = []
+        for nombre in os.listdir(self.directorio):
+            if not nombre.endswith(".json"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directorio, nombre))
+            except OSError:
+                continue
+            archivos.append((st.st_mtime, st.st_size, nombre))
+        return archivos
+
+    def _podar(self):
+        archivos = self._archivos()
+        total = sum(tamano for _, tamano, _ in archivos)
+        for _, tamano, nombre in sorted(archivos):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directorio, nombre))
+            except OSError:
+                pass
+            total -= tamano
+
+    def estadisticas(self) -> dict:
+        archivos = self._archivos() if os.path.isdir(self.directorio) else []
+        total = self.hits + self.misses
+        return {
+            "archivos": len(archivos),
+            "bytes": sum(tamano for _, tamano, _ in archivos),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+label_cache = LabelCache()
@@ -0,0 +1,299 @@
+"""
+Copia local de las ordenes de Tienda Nube (tablas ordermirror / ordersyncstate).
+
+El listado de ordenes listas y los contadores se resuelven con consultas sobre
+columnas indexadas; la sincronizacion la hacen los clientes (iter_open_orders)
+pidiendo solo lo modificado desde el ultimo cursor (updated_at_min).
+
+La sincronizacion corre en segundo plano (AsyncTiendaNubeClient.programar_sync):
+mientras la tienda no tiene copia, o la copia quedo vieja por un cambio propio,
+las lecturas van a la API. Ese estado (inicio y fin del ultimo sync, fallo, cambio
+propio pendiente, ultimo webhook) vive en ordersyncstate, asi lo ven todos los
+workers de gunicorn. Si falla, no se reintenta hasta ORDER_SYNC_RETRY_BACKOFF.
+Un sync que no llega al final (mas de ORDER_SYNC_MAX_PAGES paginas) cuenta como
+fallido: no mueve el cursor, asi el siguiente vuelve a pedir desde el anterior.
+"""
+import os
+import json
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import select, Session
+
+from app.database import engine
+from app.models import OrderMirror, OrderSyncState
+from app.services.order_rules import classify_order, READY_SHIPPING_STATUSES
+
+ORDER_MIRROR_ENABLED = os.getenv("ORDER_MIRROR_ENABLED", "1") == "1"
+# Segundos minimos entre sincronizaciones de una misma tienda
+ORDER_SYNC_INTERVAL = float(os.getenv("ORDER_SYNC_INTERVAL", "30"))
+# Con webhooks llegando, la sincronizacion por polling queda solo como red de seguridad
+WEBHOOK_SYNC_INTERVAL = float(os.getenv("WEBHOOK_SYNC_INTERVAL", "600"))
+# Despues de una sincronizacion fallida (API caida, token vencido) se espera esto antes de reintentar
+ORDER_SYNC_RETRY_BACKOFF = float(os.getenv("ORDER_SYNC_RETRY_BACKOFF", "120"))
+# Tope de paginas de /orders por sincronizacion (200 ordenes c/u); si no alcanza, el sync cuenta como fallido
+ORDER_SYNC_MAX_PAGES = int(os.getenv("ORDER_SYNC_MAX_PAGES", "500"))
+# Un sync sin terminar (worker caido) deja de bloquear la tienda pasado este tiempo
+ORDER_SYNC_LEASE = float(os.getenv("ORDER_SYNC_LEASE", "600"))
+
+
+
+def _fecha(texto):
+    if not texto:
+        return None
+    try:
+        return datetime.strptime(texto, "%Y-%m-%dT%H:%M:%S%z")
+    except ValueError:
+        try:
+            return datetime.fromisoformat(texto)
+        except ValueError:
+            return None
+
+
+def cursor_mayor(a, b):
+    """El mas reciente de dos updated_at (strings de la API)."""
+    fa, fb = _fecha(a), _fecha(b)
+    if fa is None:
+        return b if fb is not None else a
+    if fb is None:
+        return a
+    return b if fb > fa else a
+
+
+def es_anterior(updated_at, guardado) -> bool:
+    """True si `updated_at` es estrictamente mas viejo que `guardado` (ambos de la API)."""
+    nuevo, actual = _fecha(updated_at), _fecha(guardado)
+    return nuevo is not None and actual is not None and nuevo < actual
+
+
+def columnas_orden(order: dict) -> dict:
+    info = classify_order(order)
+    f_status = info["f_status"]
+    return {
+        "order_number": info["number"],
+        "status": info["status"],
+        "payment_status": info["payment_status"],
+        "shipping_status": info["shipping_status"],
+        "fulfillment_status": str(f_status).lower() if f_status is not None else None,
+        "fulfillments_count": info["fulfillments_count"],
+        "stage": info["stage"],
+        "updated_at_tn": order.get("updated_at"),
+        "payload": json.dumps(order),
+        "synced_at": datetime.utcnow(),
+    }
+
+
+def guardar_ordenes(store_id, orders: list):
+    """
+    Upsert de una pagina de ordenes. Las que dejaron de estar abiertas se borran:
+    el espejo solo se usa para ordenes 'open'. Una orden con updated_at anterior al
+    guardado no pisa la fila. Devuelve el mayor updated_at de la pagina.
+    """
+    store_id = int(store_id)
+    por_id = {int(o["id"]): o for o in orders if o.get("id")}
+    cursor = None
+    for order in por_id.values():
+        cursor = cursor_mayor(cursor, order.get("updated_at"))
+    if not por_id:
+        return cursor
+
+    with Session(engine) as session:
+        existentes = {
+            fila.real_order_id: fila
+            for fila in session.exec(
+                select(OrderMirror).where(
+                    OrderMirror.tiendanube_store_id == store_id,
+                    OrderMirror.real_order_id.in_(list(por_id)),
+                )
+            )
+        }
+        for real_id, order in por_id.items():
+            fila = existentes.get(real_id)
+            if fila is not None and es_anterior(order.get("updated_at"), fila.updated_at_tn):
+                # Llego tarde (webhook reintentado, pagina vieja): la copia ya tiene algo mas nuevo
+                continue
+            if order.get("status") != "open":
+                if fila is not None:
+                    session.delete(fila)
+                continue
+            valores = columnas_orden(order)
+            if fila is None:
+                fila = OrderMirror(tiendanube_store_id=store_id, real_order_id=real_id, **valores)
+            else:
+                for campo, valor in valores.items():
+                    setattr(fila, campo, valor)
+            session.add(fila)
+        session.commit()
+    return cursor
+
+
+def estado_sync(store_id):
+    """Fila de ordersyncstate de la tienda como dict, o None si no hay."""
+    with Session(engine) as session:
+        estado = session.get(OrderSyncState, int(store_id))
+        return estado.model_dump() if estado is not None else None
+
+
+def copia_lista(estado) -> bool:
+    """True si las lecturas pueden salir de la copia: hubo un sync completo y no hay cambios propios pendientes."""
+    return bool(estado) and estado["last_synced_at"] is not None and estado["dirty_at"] is None
+
+
+def _actualizar_estado(store_id, **valores):
+    # Upsert de columnas de ordersyncstate; si otro worker creo la fila en el medio, se reintenta sobre la suya
+    for intento in range(2):
+        with Session(engine) as session:
+            estado = session.get(OrderSyncState, int(store_id)) or OrderSyncState(tiendanube_store_id=int(store_id))
+            for campo, valor in valores.items():
+                setattr(estado, campo, valor)
+            session.add(estado)
+            try:
+                session.commit()
+                return
+            except IntegrityError:
+                if intento:
+                    raise
+
+
+def registrar_sync(store_id, cursor):
+    with Session(engine) as session:
+        estado = session.get(OrderSyncState, int(store_id))
+        if estado is None:
+            estado = OrderSyncState(tiendanube_store_id=int(store_id))
+        estado.cursor = cursor_mayor(estado.cursor, cursor)
+        estado.last_synced_at = datetime.utcnow()
+        session.add(estado)
+        session.commit()
+
+
+def registrar_webhook(store_id):
+    """Llego un webhook de la tienda: el espejo se mantiene solo, se espacia el polling."""
+    _actualizar_estado(store_id, last_webhook_at=datetime.utcnow())
+
+
+def marcar_desactualizado(store_id):
+    """
+    Cambio propio (p.ej. despues de un PATCH): se sincroniza sin esperar el intervalo y
+    hasta que termine un sync posterior las lecturas no usan la copia.
+    """
+    _actualizar_estado(store_id, dirty_at=datetime.utcnow())
+
+
+def intervalo_sync(estado) -> float:
+    ultimo_webhook = estado["last_webhook_at"] if estado else None
+    if ultimo_webhook is not None and datetime.utcnow() - ultimo_webhook < timedelta(seconds=WEBHOOK_SYNC_INTERVAL):
+        return WEBHOOK_SYNC_INTERVAL
+    return ORDER_SYNC_INTERVAL
+
+
+def _sync_en_curso(estado: OrderSyncState, ahora: datetime) -> bool:
+    inicio = estado.sync_started_at
+    if inicio is None:
+        return False
+    if any(fin is not None and fin >= inicio for fin in (estado.last_synced_at, estado.sync_failed_at)):
+        return False
+    # Un worker que murio a mitad de un sync no bloquea la tienda mas alla de ORDER_SYNC_LEASE
+    return ahora - inicio < timedelta(seconds=ORDER_SYNC_LEASE)
+
+
+def _toca_sync(estado: OrderSyncState, ahora: datetime) -> bool:
+    if estado.sync_failed_at is not None and ahora - estado.sync_failed_at < timedelta(seconds=ORDER_SYNC_RETRY_BACKOFF):
+        return False
+    if estado.dirty_at is not None or estado.last_synced_at is None:
+        return True
+    return ahora - estado.last_synced_at >= timedelta(seconds=intervalo_sync(estado.model_dump()))
+
+
+def reservar_sync(store_id, force: bool = False) -> bool:
+    """
+    True si este llamador tiene que sincronizar ahora: paso el intervalo desde la
+    ultima vez (y el backoff desde el ultimo fallo) y nadie mas la esta haciendo, en
+    ningun worker: sync_started_at se toma con un compare-and-set sobre la fila.
+    Liberar con liberar_sync.
+    """
+    store_id = int(store_id)
+    ahora = datetime.utcnow()
+    with Session(engine) as session:
+        estado = session.get(OrderSyncState, store_id)
+        if estado is None:
+            session.add(OrderSyncState(tiendanube_store_id=store_id, sync_started_at=ahora))
+            try:
+                session.commit()
+            except IntegrityError:
+                # Otro worker creo la fila (y tomo el sync) primero
+                return False
+            return True
+        if _sync_en_curso(estado, ahora) or (not force and not _toca_sync(estado, ahora)):
+            return False
+        previo = estado.sync_started_at
+        mismo_inicio = OrderSyncState.sync_started_at.is_(None) if previo is None else OrderSyncState.sync_started_at == previo
+        resultado = session.exec(
+            update(OrderSyncState)
+            .where(OrderSyncState.tiendanube_store_id == store_id, mismo_inicio)
+            .values(sync_started_at=ahora)
+        )
+        session.commit()
+        return resultado.rowcount == 1
+
+
+def liberar_sync(store_id, ok: bool):
+    store_id = int(store_id)
+    de_la_tienda = OrderSyncState.tiendanube_store_id == store_id
+    with Session(engine) as session:
+        if ok:
+            session.exec(update(OrderSyncState).where(de_la_tienda).values(sync_failed_at=None))
+            # Solo un sync que arranco despues del cambio propio lo trae
+            session.exec(
+                update(OrderSyncState)
+                .where(de_la_tienda, OrderSyncState.dirty_at <= OrderSyncState.sync_started_at)
+                .values(dirty_at=None)
+            )
+        else:
+            session.exec(update(OrderSyncState).where(de_la_tienda).values(sync_failed_at=datetime.utcnow()))
+        session.commit()
+
+
+def sync_filtros(estado) -> dict:
+    """Params de /orders para la proxima sincronizacion."""
+    if estado and estado.get("cursor"):
+        # Incremental: cualquier estado, asi se enteran las que se cerraron/cancelaron
+        return {"status": "any", "updated_at_min": estado["cursor"]}
+    return {"status": "open"}
+
+
+def _filtro_listas(stmt, store_id, payment_statuses: list = None, stage: str = None):
+    # status/pago/envio por columna; la etapa ya viene calculada por classify_order al guardar
+    stmt = stmt.where(
+        OrderMirror.tiendanube_store_id == int(store_id),
+        OrderMirror.status == "open",
+        OrderMirror.payment_status.in_(payment_statuses or ["paid"]),
+        OrderMirror.shipping_status.in_(READY_SHIPPING_STATUSES),
+    )
+    if stage in ("unpacked", "packed"):
+        stmt = stmt.where(OrderMirror.stage == stage)
+    return stmt
+
+
+def ready_order_payloads(store_id, page: int = 1, per_page: int = 50, payment_statuses: list = None, stage: str = None):
+    """
+    (ordenes, has_more): JSON de la API de la pagina pedida de ordenes listas, mas
+    nuevas primero, y si hay pagina siguiente.
+    """
+    stmt = _filtro_listas(select(OrderMirror.payload), store_id, payment_statuses, stage)
+    # Una fila de mas para saber si hay pagina siguiente
+    stmt = stmt.order_by(OrderMirror.order_number.desc()).offset(max(0, page - 1) * per_page).limit(per_page + 1)
+    with Session(engine) as session:
+        payloads = [json.loads(payload) for payload in session.exec(stmt)]
+    return payloads[:per_page], len(payloads) > per_page
+
+
+def order_stats(store_id, payment_statuses: list = None) -> dict:
+    """Cantidad de ordenes listas por etapa, en una consulta agrupada."""
+    stmt = _filtro_listas(select(OrderMirror.stage, func.count(OrderMirror.id)), store_id, payment_statuses)
+    stmt = stmt.where(OrderMirror.stage.in_(["unpacked", "packed"])).group_by(OrderMirror.stage)
+    stats = {"unpacked": 0, "packed": 0}
+    with Session(engine) as session:
+        for stage, cantidad in session.exec(stmt):
+            stats[stage] = cantidad
+    return stats
@@ -0,0 +1,174 @@
+"""
+Reglas de 'ordenes listas para enviar' (Por Empaquetar / Por Enviar).
+
+Un solo clasificador para el listado, los contadores y la copia local: cada orden
+se evalua una vez y de ahi salen su etapa, el motivo de exclusion y la fila del listado.
+"""
+
+READY_SHIPPING_STATUSES = ["unshipped", "unpacked"]
+
+
+def classify_order(order: dict, payment_statuses: list = None) -> dict:
+    """
+    Unica fuente de las reglas de 'listas para enviar'. Devuelve los datos de la orden
+    que usan el listado y el debug, `base_reason` (por que no esta lista, sin mirar
+    la etapa: `order_reason` o `shipping_reason`) y `stage`: 'unpacked' (Por Empaquetar), 'packed' (Por Enviar) o None.
+    """
+    if payment_statuses is None:
+        payment_statuses = ["paid"]
+
+    ofulls = order.get("fulfillments") or []
+    # fulfillments puede venir como lista de ids (strings) en vez de objetos
+    f_status = ofulls[0].get("status") if ofulls and isinstance(ofulls[0], dict) else None
+    info = {
+        "id": order.get("id"),
+        "number": order.get("number"),
+        "status": order.get("status"),
+        "payment_status": order.get("payment_status"),
+        "shipping_status": order.get("shipping_status"),
+        "next_action": order.get("next_action"),
+        "fulfillments_count": len(ofulls),
+        "f_status": f_status,
+    }
+
+    # 1. Status 'open' / 2. Payment Status Check
+    if info["status"] != "open":
+        info["order_reason"] = f"status '{info['status']}' != 'open'"
+    elif info["payment_status"] not in payment_statuses:
+        info["order_reason"] = f"payment_status != 'paid' ({info['payment_status']})"
+    else:
+        info["order_reason"] = None
+
+    # 4. Shipping 'unshipped' or 'unpacked'
+    # FIX: Accept "unpacked" as valid for ready orders (User Request)
+    if info["shipping_status"] not in READY_SHIPPING_STATUSES:
+        info["shipping_reason"] = f"shipping_status '{info['shipping_status']}' not in ['unshipped', 'unpacked']"
+    else:
+        info["shipping_reason"] = None
+    info["base_reason"] = info["order_reason"] or info["shipping_reason"]
+
+    # 3. Fulfillment Stage
+    # 'Por Empaquetar': fulfillments[0].status 'unpacked', o sin fulfillments todavia
+    # (esperando creacion, con o sin next_action 'waiting_packing')
+    # 'Por Enviar': fulfillments[0].status 'packed'
+    if ofulls:
+        f_lower = str(f_status).lower()
+        info["stage"] = f_lower if f_lower in ("unpacked", "packed") else None
+    else:
+        info["stage"] = "unpacked"
+    return info
+
+
+def stage_exclusion(info: dict, stage: str = None):
+    """
+    Motivo por el que la orden no entra en la etapa pedida (None si entra), con la
+    misma prioridad de siempre: status, pago, etapa y por ultimo envio.
+    """
+    if info["order_reason"]:
+        return info["order_reason"]
+    if stage == "unpacked" and info["fulfillments_count"] and info["stage"] != "unpacked":
+        return f"stage='unpacked' but fulfillments[0].status='{info['f_status']}'"
+    if stage == "packed":
+        if not info["fulfillments_count"]:
+            return "stage='packed' but no fulfillments"
+        if info["stage"] != "packed":
+            return f"stage='packed' but fulfillments[0].status='{info['f_status']}'"
+    return info["shipping_reason"]
+
+
+def _fulfillment_status_mostrado(info: dict, stage: str = None):
+    # En 'unpacked' las ordenes sin fulfillments muestran de donde sale la etapa
+    if stage == "unpacked" and not info["order_reason"] and not info["fulfillments_count"]:
+        return "unpacked (next_action)" if info["next_action"] == "waiting_packing" else "pending_creation"
+    return info["f_status"]
+
+
+def order_result(order: dict, info: dict, f_status) -> dict:
+    shipping_address = order.get("shipping_address") or {}
+    if not isinstance(shipping_address, dict): shipping_address = {}
+
+    c_name = order.get("contact_name")
+    if not c_name: c_name = order.get("contact_email")
+
+    products_list = []
+    for p in order.get("products", []):
+        products_list.append({
+            "name": p.get("name"),
+            "sku": p.get("sku"),
+            "quantity": p.get("quantity"),
+            "variant": p.get("variant_name")
+        })
+
+    return {
+        "number": info["number"],
+        "id": info["id"],
+        "created_at": order.get("created_at"),
+        "customer_name": c_name,
+        "zipcode": shipping_address.get("zipcode"),
+        "province": shipping_address.get("province"),
+        "city": shipping_address.get("city"),
+        "shipping_option": order.get("shipping_option"),
+        "payment_status": info["payment_status"],
+        "shipping_status": info["shipping_status"],
+        "fulfillment_status": f_status,
+        "address": shipping_address.get("address"),
+        "products": products_list
+    }
+
+
+def classify_orders(data: list, payment_statuses: list = None, stage: str = None, debug: bool = False) -> dict:
+    """
+    Una sola pasada sobre una pagina de /orders: las ordenes de la etapa pedida
+    (results/debug, como filter_orders_ready) y los contadores de cada etapa
+    (stats, como compute_order_stats, con los mismos payment_statuses).
+    """
+    results = []
+    debug_log = []
+    stats = {"unpacked": 0, "packed": 0}
+
+    for order in data:
+        info = classify_order(order, payment_statuses)
+        if info["base_reason"] is None and info["stage"]:
+            stats[info["stage"]] += 1
+
+        try:
+            excluded_reason = stage_exclusion(info, stage if stage in ("unpacked", "packed") else None)
+        except Exception as e:
+            excluded_reason = f"EXCEPTION: {str(e)}"
+        included = excluded_reason is None
+        f_status = _fulfillment_status_mostrado(info, stage)
+
+        if debug:
+            debug_log.append({
+                "number": info["number"],
+                "id": info["id"],
+                "status": info["status"],
+                "payment_status": info["payment_status"],
+                "shipping_status": info["shipping_status"],
+                "next_action": info["next_action"],
+                "fulfillments_count": info["fulfillments_count"],
+                "fulfillment_status_0": f_status,
+                "stage_requested": stage,
+                "included": included,
+                "excluded_reason": excluded_reason
+            })
+
+        if included:
+            try:
+                results.append(order_result(order, info, f_status))
+            except Exception as e:
+                print(f"ERROR building result for {info['number']}: {e}")
+                if debug: debug_log[-1]["excluded_reason"] = f"BUILD ERROR: {e}"
+
+    return {"results": results, "debug": debug_log, "stats": stats}
+
+
+def filter_orders_ready(data: list, payment_statuses: list = None, stage: str = None, debug: bool = False) -> dict:
+    """Filtra una pagina de /orders con las reglas de 'listas para enviar'."""
+    clasificadas = classify_orders(data, payment_statuses, stage, debug)
+    return {"results": clasificadas["results"], "debug": clasificadas["debug"]}
+
+
+def compute_order_stats(data: list) -> dict:
+    """Cuenta 'unpacked' y 'packed' sobre una pagina de /orders (filtro estricto, como filter_orders_ready)."""
+    return classify_orders(data, ["paid"])["stats"]
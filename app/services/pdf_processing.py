@@ -1,16 +1,21 @@
 # -*- coding: utf-8 -*-
 import pandas as pd
 import io
+import os
 import re
 import PyPDF2
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
 
+from app.services.label_cache import label_cache
+
 FONT_NAME = "Helvetica"
 FONT_SIZE = 6
 MARGEN_X  = 8
 MARGEN_Y  = 8
 MAX_ANCHO_TEXTO = 180
+# Un solo documento ReportLab con todos los overlays (0 = un canvas por pagina, como antes)
+PDF_OVERLAY_UNICO = os.getenv("PDF_OVERLAY_UNICO", "1") == "1"
 
 def construir_mapa_skus(csv_content: bytes) -> dict:
     ventas = pd.read_csv(io.BytesIO(csv_content), encoding="latin1", sep=";")
@@ -47,6 +52,59 @@ def extraer_nro_interno(texto_pagina: str) -> str | None:
         return m.group(1)
     return None
 
+def extraer_tracking(texto_pagina: str):
+    """(orden, tracking) de la etiqueta, como los lee la carga de trackings; None si falta alguno."""
+    if not texto_pagina:
+        return None, None
+
+    # Normalize text for regex
+    clean_text = texto_pagina.replace("N°", "").replace("Nº", "").replace("\n", " ")
+
+    # 1. Find Order ID
+    order_match = re.search(r"Interno\s*:\s*#?\s*([0-9]+)", clean_text, re.IGNORECASE)
+    order_id = None
+    if order_match:
+        order_id = order_match.group(1)
+
+    # 2. Find Tracking Number
+    tracking_number = None
+    tracking_match = re.search(r"de seguimiento\s*:\s*([0-9]+)", clean_text, re.IGNORECASE)
+    if tracking_match:
+        tracking_number = tracking_match.group(1)
+    else:
+        fallback_match = re.search(r"(?:Envío|Seguimiento)\s*(?:Andreani)?\s*:?\s*([A-Z0-9]+)", clean_text, re.IGNORECASE)
+        if fallback_match:
+            tracking_number = fallback_match.group(1)
+
+    return order_id, tracking_number
+
+def datos_pagina(page) -> dict:
+    """Lo que usan los dos flujos de etiquetas de una pagina, con un solo extract_text."""
+    texto = page.extract_text()
+    order, track = extraer_tracking(texto)
+    return {
+        "interno": extraer_nro_interno(texto),
+        "order": order,
+        "track": track,
+        "ancho": float(page.mediabox.width),
+        "alto": float(page.mediabox.height),
+    }
+
+def datos_etiquetas(pdf_bytes: bytes, reader=None, desde: int = 0, hasta: int = None) -> list:
+    """
+    datos_pagina de cada pagina (o del rango desde/hasta), desde el cache en disco si
+    este PDF ya se leyo. Solo se guarda en el cache cuando se leyo el archivo entero.
+    """
+    paginas = label_cache.get(label_cache.clave(pdf_bytes))
+    if paginas is not None:
+        return paginas[desde:hasta]
+    if reader is None:
+        reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
+    datos = [datos_pagina(page) for page in reader.pages[desde:hasta]]
+    if desde == 0 and hasta is None:
+        label_cache.guardar(label_cache.clave(pdf_bytes), datos)
+    return datos
+
 def wrap_text(texto: str, max_width: float, font_name: str, font_size: int, canvas_obj) -> list:
     if not texto: return []
     palabras = texto.split(" ")
@@ -63,39 +121,130 @@ def wrap_text(texto: str, max_width: float, font_name: str, font_size: int, canv
     if linea_actual: lineas.append(linea_actual)
     return lineas
 
-def process_pdf_labels(pdf_bytes: bytes, skus_map: dict) -> bytes:
-    reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
-    writer = PyPDF2.PdfWriter()
+def skus_de_pagina(datos: dict, skus_map: dict) -> str | None:
+    """Texto de SKUs para la etiqueta, o None si no tiene N° interno o la orden no tiene SKUs."""
+    nro_interno = datos.get("interno")
+    if not nro_interno:
+        return None
+    return skus_map.get(str(int(nro_interno))) or None
+
+def dibujar_skus(c, skus_texto: str):
+    c.setFont(FONT_NAME, FONT_SIZE)
     
-    for idx, page in enumerate(reader.pages):
-        texto = page.extract_text()
-        nro_interno = extraer_nro_interno(texto)
-        
-        if nro_interno:
-            skus_texto = skus_map.get(str(int(nro_interno)))
-            if skus_texto:
-                packet = io.BytesIO()
-                width = float(page.mediabox.width)
-                height = float(page.mediabox.height)
-                c = canvas.Canvas(packet, pagesize=(width, height))
-                c.setFont(FONT_NAME, FONT_SIZE)
-                
-                texto_mostrar = f"SKU: {skus_texto}"
-                lineas = wrap_text(texto_mostrar, MAX_ANCHO_TEXTO, FONT_NAME, FONT_SIZE, c)
-                
-                y = MARGEN_Y
-                for linea in lineas:
-                    c.drawString(MARGEN_X, y, linea)
-                    y += FONT_SIZE + 1
-                
-                c.save()
-                packet.seek(0)
-                overlay_pdf = PyPDF2.PdfReader(packet)
-                page.merge_page(overlay_pdf.pages[0])
-        
-        writer.add_page(page)
-        
+    texto_mostrar = f"SKU: {skus_texto}"
+    lineas = wrap_text(texto_mostrar, MAX_ANCHO_TEXTO, FONT_NAME, FONT_SIZE, c)
+    
+    y = MARGEN_Y
+    for linea in lineas:
+        c.drawString(MARGEN_X, y, linea)
+        y += FONT_SIZE + 1
+
+def estampar_pagina(page, skus_map: dict, datos: dict = None):
+    """Agrega el texto de SKUs al pie de la etiqueta, con un canvas propio para la pagina."""
+    datos = datos or datos_pagina(page)
+    skus_texto = skus_de_pagina(datos, skus_map)
+    if skus_texto:
+        packet = io.BytesIO()
+        c = canvas.Canvas(packet, pagesize=(datos["ancho"], datos["alto"]))
+        dibujar_skus(c, skus_texto)
+        c.save()
+        packet.seek(0)
+        overlay_pdf = PyPDF2.PdfReader(packet)
+        page.merge_page(overlay_pdf.pages[0])
+    return page
+
+def estampar_paginas(pages, skus_map: dict, datos: list = None) -> list:
+    """
+    Igual que estampar_pagina para una lista de paginas, pero todos los overlays van
+    en un unico documento ReportLab que se lee una sola vez. Las etiquetas con el
+    mismo tamaño y el mismo texto de SKUs comparten la pagina de overlay.
+    """
+    pages = list(pages)
+    if datos is None:
+        datos = [datos_pagina(page) for page in pages]
+    overlays = {}  # (ancho, alto, skus) -> nro de pagina en el documento de overlays
+    asignadas = []
+    for pagina in datos:
+        skus_texto = skus_de_pagina(pagina, skus_map)
+        clave = None
+        if skus_texto:
+            clave = (pagina["ancho"], pagina["alto"], skus_texto)
+            overlays.setdefault(clave, len(overlays))
+        asignadas.append(clave)
+
+    if not overlays:
+        return pages
+
+    packet = io.BytesIO()
+    c = canvas.Canvas(packet)
+    for width, height, skus_texto in overlays:
+        c.setPageSize((width, height))
+        dibujar_skus(c, skus_texto)
+        c.showPage()
+    c.save()
+    packet.seek(0)
+    overlay_pages = PyPDF2.PdfReader(packet).pages
+
+    for page, clave in zip(pages, asignadas):
+        if clave is not None:
+            page.merge_page(overlay_pages[overlays[clave]])
+    return pages
+
+def _escribir(writer) -> bytes:
     output = io.BytesIO()
     writer.write(output)
     output.seek(0)
     return output.read()
+
+def estampar_rango(pdf_bytes: bytes, skus_map: dict, desde: int = 0, hasta: int = None):
+    """(PDF estampado del rango, datos_pagina de esas paginas)."""
+    reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
+    writer = PyPDF2.PdfWriter()
+    
+    pages = reader.pages[desde:hasta]
+    datos = datos_etiquetas(pdf_bytes, reader, desde, hasta)
+    if PDF_OVERLAY_UNICO:
+        paginas = estampar_paginas(pages, skus_map, datos)
+    else:
+        paginas = [estampar_pagina(page, skus_map, d) for page, d in zip(pages, datos)]
+    for page in paginas:
+        writer.add_page(page)
+        
+    return _escribir(writer), datos
+
+def process_pdf_labels(pdf_bytes: bytes, skus_map: dict, desde: int = 0, hasta: int = None) -> bytes:
+    """
+    Etiquetas con los SKUs estampados. Con desde/hasta procesa solo ese rango de
+    paginas (el PDF devuelto tiene solo esas), para repartir un archivo grande
+    entre procesos y despues unir las partes con unir_pdfs.
+    """
+    return estampar_rango(pdf_bytes, skus_map, desde, hasta)[0]
+
+def contar_paginas(pdf_bytes: bytes) -> int:
+    return len(PyPDF2.PdfReader(io.BytesIO(pdf_bytes)).pages)
+
+def rangos_paginas(total: int, partes: int) -> list:
+    """[(desde, hasta), ...] contiguos y en orden, de tamaños parejos."""
+    partes = max(1, min(partes, total))
+    base, resto = divmod(total, partes)
+    rangos = []
+    desde = 0
+    for i in range(partes):
+        hasta = desde + base + (1 if i < resto else 0)
+        rangos.append((desde, hasta))
+        desde = hasta
+    return rangos
+
+def unir_pdfs(partes: list) -> bytes:
+    """
+    Une PDFs (bytes) respetando el orden de la lista. El resultado tiene las mismas
+    paginas y contenido, pero no es byte a byte el de una pasada unica (PyPDF2
+    renombra fuentes y recursos al copiar las paginas).
+    """
+    if len(partes) == 1:
+        return partes[0]
+    writer = PyPDF2.PdfWriter()
+    for parte in partes:
+        for page in PyPDF2.PdfReader(io.BytesIO(parte)).pages:
+            writer.add_page(page)
+    return _escribir(writer)
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+Pool de procesos para el trabajo pesado de CPU (CSV -> registros, Excel, etiquetas PDF).
+
+Las rutas son async: si process_csv o process_pdf_labels corren inline, el event loop
+queda tomado y el resto de los usuarios del worker espera. Las rutas hacen
+`await ejecutar(tarea, ...)` y la tarea corre en un proceso del pool.
+
+El AndreaniProcessor (plantilla + indices, ~130 MB y unos segundos de carga) se arma
+al levantar cada proceso, asi el primer CSV/Excel no paga la carga. Con
+PROCESS_POOL_PRELOAD=0 se arma recien en la primera tarea que lo usa (para
+despliegues que solo estampan PDFs y no quieren esa memoria). Cada proceso tiene su
+propio cache de matches.
+
+Ojo con la cuenta: cada worker de gunicorn tiene su pool, asi que hay
+(workers de gunicorn) x PROCESS_POOL_WORKERS procesos, y hasta un processor por cada uno.
+
+PROCESS_POOL_WORKERS=0 desactiva el pool: las tareas corren en un thread del proceso
+con un unico processor local (util en desarrollo o en maquinas de un solo core).
+"""
+import os
+import time
+import shutil
+import tempfile
+import asyncio
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from app.services.data_processing import AndreaniProcessor
+from app.services.pdf_processing import process_pdf_labels, construir_mapa_skus, contar_paginas, rangos_paginas, unir_pdfs, estampar_rango
+from app.services.label_cache import label_cache
+
+# Por worker de gunicorn (ver arriba): por defecto conservador
+PROCESS_POOL_WORKERS = int(os.getenv("PROCESS_POOL_WORKERS", "2"))
+# spawn: los workers no heredan threads ni el event loop del servidor
+PROCESS_POOL_START = os.getenv("PROCESS_POOL_START", "spawn")
+# Armar el AndreaniProcessor al levantar cada proceso (0: a demanda, ahorra memoria si solo hay PDFs)
+PROCESS_POOL_PRELOAD = os.getenv("PROCESS_POOL_PRELOAD", "1") == "1"
+# Rondas de calentar esperando que respondan todos los procesos (~0.2 s cada una)
+CALENTAR_MAX_RONDAS = int(os.getenv("PROCESS_POOL_WARM_ROUNDS", "150"))
+# Los Excel vuelven del worker en memoria; por encima de este tamaño se pasan por un archivo temporal
+EXCEL_SPOOL_MAX_BYTES = int(os.getenv("EXCEL_SPOOL_MAX_BYTES", str(16 * 1024 * 1024)))
+# Etiquetas: desde esta cantidad de paginas el PDF se reparte en partes entre los workers
+PDF_PARALLEL_ENABLED = os.getenv("PDF_PARALLEL_ENABLED", "1") == "1"
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "60"))
+# Con menos paginas por parte no compensa releer el PDF en otro proceso
+PDF_MIN_PAGES_PER_CHUNK = int(os.getenv("PDF_MIN_PAGES_PER_CHUNK", "20"))
+
+_pool = None
+_pool_lock = threading.Lock()
+_plantilla_path = None
+
+# Processor del proceso actual (worker del pool, o el principal sin pool); se arma a demanda
+_processor = None
+_processor_lock = threading.Lock()
+
+
+def _processor_local():
+    global _processor
+    with _processor_lock:
+        if _processor is None:
+            _processor = AndreaniProcessor(_plantilla_path)
+        return _processor
+
+
+def configurar(plantilla_path):
+    """Plantilla con la que los procesos arman su AndreaniProcessor."""
+    global _plantilla_path
+    _plantilla_path = plantilla_path
+
+
+def _iniciar_worker(plantilla_path, preload):
+    configurar(plantilla_path)
+    if preload:
+        try:
+            _processor_local()
+        except Exception as e:
+            # Un initializer que falla rompe el pool entero (tambien los PDFs): queda a demanda
+            print(f"Processor preload failed in {os.getpid()}: {e}")
+
+
+def get_process_pool():
+    global _pool
+    if PROCESS_POOL_WORKERS <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=PROCESS_POOL_WORKERS,
+                mp_context=multiprocessing.get_context(PROCESS_POOL_START),
+                initializer=_iniciar_worker,
+                initargs=(_plantilla_path, PROCESS_POOL_PRELOAD),
+            )
+        return _pool
+
+
+def _listo(espera=0.0):
+    # La espera evita que un proceso ya listo se lleve todas las tareas de calentar
+    time.sleep(espera)
+    return os.getpid()
+
+
+async def calentar():
+    """
+    Levanta los procesos del pool antes del primer request; con PROCESS_POOL_PRELOAD
+    cada uno arma su processor en el initializer. Sin pool, arma el processor local.
+    """
+    pool = get_process_pool()
+    if pool is None:
+        if PROCESS_POOL_PRELOAD:
+            await asyncio.to_thread(_processor_local)
+        return []
+    loop = asyncio.get_running_loop()
+    # Un proceso solo toma tareas despues del initializer: cuando respondieron todos, estan calientes
+    pids = set()
+    for _ in range(CALENTAR_MAX_RONDAS):
+        pids.update(await asyncio.gather(*[loop.run_in_executor(pool, _listo, 0.2) for _ in range(PROCESS_POOL_WORKERS)]))
+        if len(pids) >= PROCESS_POOL_WORKERS:
+            break
+    return sorted(pids)
+
+
+def cerrar():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def ejecutar(tarea, *args):
+    """Corre `tarea(*args)` en el pool (o en un thread si esta desactivado)."""
+    global _pool
+    pool = get_process_pool()
+    if pool is None:
+        return await asyncio.to_thread(tarea, *args)
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(pool, tarea, *args)
+    except BrokenProcessPool:
+        # Se murio un worker (p.ej. OOM): pool nuevo y un reintento
+        print("Process pool broken, restarting")
+        with _pool_lock:
+            if _pool is pool:
+                _pool = None
+        return await loop.run_in_executor(get_process_pool(), tarea, *args)
+
+
+# --- Tareas (funciones de modulo para que se puedan mandar a los workers) ---
+
+def tarea_process_csv(csv_content: bytes):
+    return _processor_local().process_csv(csv_content)
+
+
+def tarea_generate_excel(records: list, filas_por_archivo: int = None):
+    """
+    Devuelve (contenido, cantidad de archivos); con mas de uno es un .zip. `contenido`
+    son los bytes, o la ruta de un archivo temporal si supera EXCEL_SPOOL_MAX_BYTES
+    (la borra quien lo sirve).
+    """
+    processor = _processor_local()
+    # En memoria; SpooledTemporaryFile pasa a disco solo si crece de mas
+    with tempfile.SpooledTemporaryFile(max_size=EXCEL_SPOOL_MAX_BYTES) as output:
+        archivos = processor.generate_excel_stream(records, output, filas_por_archivo=filas_por_archivo)
+        if output.seek(0, os.SEEK_END) <= EXCEL_SPOOL_MAX_BYTES:
+            output.seek(0)
+            return output.read(), archivos
+
+        # Grande: se copia a un archivo con nombre para que el proceso principal lo sirva
+        output.seek(0)
+        with tempfile.NamedTemporaryFile(suffix=".xlsx", delete=False) as destino:
+            try:
+                shutil.copyfileobj(output, destino)
+            except BaseException:
+                destino.close()
+                os.remove(destino.name)
+                raise
+        return destino.name, archivos
+
+
+def tarea_pdf_labels(pdf_bytes: bytes, csv_bytes: bytes) -> bytes:
+    return process_pdf_labels(pdf_bytes, construir_mapa_skus(csv_bytes))
+
+
+def tarea_preparar_etiquetas(pdf_bytes: bytes, csv_bytes: bytes):
+    # La ultima: si el texto de las paginas ya esta en el cache de etiquetas
+    return construir_mapa_skus(csv_bytes), contar_paginas(pdf_bytes), label_cache.get(label_cache.clave(pdf_bytes)) is not None
+
+
+async def procesar_etiquetas(pdf_bytes: bytes, csv_bytes: bytes) -> bytes:
+    """
+    process_pdf_labels por el pool. Los PDF chicos (o sin pool) devuelven la pasada
+    unica de process_pdf_labels. Los grandes se parten en rangos de paginas contiguos,
+    cada worker estampa el suyo y las partes se unen en el orden original: mismas
+    paginas y mismo contenido (tamaño, contenido de cada pagina y texto), pero no el
+    mismo archivo byte a byte, porque PyPDF2 renombra los recursos al unir.
+    """
+    if not PDF_PARALLEL_ENABLED or PROCESS_POOL_WORKERS < 2:
+        return await ejecutar(tarea_pdf_labels, pdf_bytes, csv_bytes)
+
+    skus_map, paginas, en_cache = await ejecutar(tarea_preparar_etiquetas, pdf_bytes, csv_bytes)
+    partes = min(PROCESS_POOL_WORKERS, paginas // max(1, PDF_MIN_PAGES_PER_CHUNK))
+    if paginas < PDF_PARALLEL_MIN_PAGES or partes < 2:
+        return await ejecutar(process_pdf_labels, pdf_bytes, skus_map)
+
+    estampadas = await asyncio.gather(*[
+        ejecutar(estampar_rango, pdf_bytes, skus_map, desde, hasta)
+        for desde, hasta in rangos_paginas(paginas, partes)
+    ])
+    if not en_cache:
+        # Cada parte leyo solo su rango: el archivo entero se guarda aca, para la carga de trackings
+        datos = [pagina for _, datos_parte in estampadas for pagina in datos_parte]
+        await asyncio.to_thread(label_cache.guardar, label_cache.clave(pdf_bytes), datos)
+    return await ejecutar(unir_pdfs, [estampado for estampado, _ in estampadas])
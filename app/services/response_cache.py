@@ -0,0 +1,119 @@
+"""
+Cache corto de respuestas por tienda para los endpoints de ordenes del dashboard.
+
+Las pantallas consultan /api/orders/stats y /api/orders/ready a cada rato (polling, cambio
+de pestaña); con un TTL de segundos alcanza para no pegarle a Tienda Nube en cada vuelta.
+Requests identicas concurrentes comparten una sola llamada (single-flight) y cualquier
+escritura sobre ordenes de la tienda invalida lo cacheado (ver invalidar).
+
+El cache y la invalidacion son del proceso: con varios workers de gunicorn, un PATCH
+o un webhook que atiende un worker solo limpia el cache de ese worker, y los demas
+pueden seguir devolviendo la respuesta anterior hasta ORDERS_CACHE_TTL segundos.
+Por eso el TTL es corto; con un solo worker (el default del Procfile) no hay ventana.
+"""
+import os
+import time
+import asyncio
+import threading
+
+# Tambien es lo maximo que otro worker puede servir datos viejos despues de una escritura
+ORDERS_CACHE_TTL = float(os.getenv("ORDERS_CACHE_TTL", "5"))
+ORDERS_CACHE_SIZE = int(os.getenv("ORDERS_CACHE_SIZE", "1000"))
+
+
+class ResponseCache:
+
+    def __init__(self, ttl: float = ORDERS_CACHE_TTL, maxsize: int = ORDERS_CACHE_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._datos = {}  # clave -> (vence, valor)
+        self._en_vuelo = {}  # clave -> Future compartido
+        self._generacion = {}  # tienda -> int, sube con cada invalidacion
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.compartidas = 0
+
+    def _podar(self, ahora: float):
+        for clave in [c for c, (vence, _) in self._datos.items() if vence <= ahora]:
+            del self._datos[clave]
+        while len(self._datos) >= self.maxsize:
+            # dict conserva el orden de insercion: sale la mas vieja
+            del self._datos[next(iter(self._datos))]
+
+    async def obtener(self, store_id, clave: tuple, productor):
+        """
+        Valor cacheado para (tienda, *clave) o el resultado de `await productor()`.
+        Los errores no se cachean y les llegan a todos los que esperaban esa llamada.
+        """
+        if self.ttl <= 0:
+            return await productor()
+
+        tienda = str(store_id)
+        key = (tienda,) + tuple(clave)
+        with self.lock:
+            entrada = self._datos.get(key)
+            if entrada is not None and entrada[0] > time.monotonic():
+                self.hits += 1
+                return entrada[1]
+            en_vuelo = self._en_vuelo.get(key)
+            if en_vuelo is None:
+                self.misses += 1
+                generacion = self._generacion.get(tienda, 0)
+                futuro = asyncio.get_running_loop().create_future()
+                self._en_vuelo[key] = futuro
+            else:
+                self.compartidas += 1
+
+        if en_vuelo is not None:
+            return await asyncio.shield(en_vuelo)
+
+        try:
+            valor = await productor()
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                futuro.cancel()
+            else:
+                futuro.set_exception(e)
+                # Que no quede "exception was never retrieved" si nadie mas esperaba
+                futuro.exception()
+            raise
+        else:
+            futuro.set_result(valor)
+            with self.lock:
+                # Si hubo una escritura mientras se calculaba, el valor ya nacio viejo
+                if self._generacion.get(tienda, 0) == generacion:
+                    ahora = time.monotonic()
+                    self._podar(ahora)
+                    self._datos[key] = (ahora + self.ttl, valor)
+            return valor
+        finally:
+            with self.lock:
+                if self._en_vuelo.get(key) is futuro:
+                    del self._en_vuelo[key]
+
+    def invalidar(self, store_id):
+        """
+        Descarta lo cacheado de la tienda en este proceso (llamar despues de cambiar
+        ordenes); en los otros workers vence solo, por TTL.
+        """
+        tienda = str(store_id)
+        with self.lock:
+            self._generacion[tienda] = self._generacion.get(tienda, 0) + 1
+            for clave in [c for c in self._datos if c[0] == tienda]:
+                del self._datos[clave]
+
+    def estadisticas(self) -> dict:
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "ttl": self.ttl,
+                "size": len(self._datos),
+                "hits": self.hits,
+                "misses": self.misses,
+                "compartidas": self.compartidas,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+orders_cache = ResponseCache()
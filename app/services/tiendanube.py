@@ -1,10 +1,13 @@
 import os
 import json
+import time
+import random
+import asyncio
 import requests
-import pandas as pd
-import io
-import re
-import PyPDF2
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -12,11 +15,43 @@ load_dotenv()
 CLIENT_ID = os.getenv("CLIENT_ID")
 CLIENT_SECRET = os.getenv("CLIENT_SECRET")
 REDIRECT_URI = os.getenv("REDIRECT_URI")
-from sqlmodel import select
+# Ordenes que se piden en paralelo en los procesos por lote
+FETCH_CONCURRENCY = int(os.getenv("TIENDANUBE_FETCH_CONCURRENCY", "8"))
+# Pool HTTP compartido por todos los TiendaNubeClient del proceso
+HTTP_POOL_SIZE = int(os.getenv("TIENDANUBE_HTTP_POOL_SIZE", "20"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("TIENDANUBE_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("TIENDANUBE_READ_TIMEOUT", "30"))
+# Ordenes que se procesan en paralelo al subir codigos de seguimiento
+TRACKING_CONCURRENCY = int(os.getenv("TIENDANUBE_TRACKING_CONCURRENCY", "4"))
+# Cuota de la API de Tienda Nube: bucket de 40 requests que se vacia a 2 req/s (0 = sin limite)
+API_RATE_LIMIT = float(os.getenv("TIENDANUBE_RATE_LIMIT", "2"))
+API_RATE_BURST = int(os.getenv("TIENDANUBE_RATE_BURST", "40"))
+# Reintentos con backoff exponencial + jitter: 429 en cualquier metodo (la API no lo proceso);
+# 5xx solo en metodos idempotentes (un POST/PATCH pudo haberse aplicado y se duplicaria)
+MAX_RETRIES = int(os.getenv("TIENDANUBE_MAX_RETRIES", "4"))
+RETRY_BASE_DELAY = float(os.getenv("TIENDANUBE_RETRY_BASE_DELAY", "0.5"))
+RETRY_MAX_DELAY = float(os.getenv("TIENDANUBE_RETRY_MAX_DELAY", "10"))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+# Numero de orden -> id real: entradas en memoria (delante de la tabla orderidmapping)
+ORDER_ID_CACHE_SIZE = int(os.getenv("ORDER_ID_CACHE_SIZE", "50000"))
+# Busqueda masiva: paginas de /orders (max 200 por pagina en la API) antes de caer a GETs individuales
+BULK_PER_PAGE = int(os.getenv("TIENDANUBE_BULK_PER_PAGE", "200"))
+BULK_MAX_PAGES = int(os.getenv("TIENDANUBE_BULK_MAX_PAGES", "10"))
+# Tope de paginas al recorrer todas las ordenes abiertas (listado y contadores)
+OPEN_ORDERS_MAX_PAGES = int(os.getenv("TIENDANUBE_OPEN_ORDERS_MAX_PAGES", "50"))
+from sqlmodel import select, Session
 from app.database import engine, get_session
-from app.models import TiendaNubeToken, Store, User, OAuthState
+from app.models import TiendaNubeToken, Store, User, OAuthState, OrderIdMapping
 from app.security import encrypt_token, decrypt_token
 import uuid
+from app.services import order_mirror
+from app.services.response_cache import orders_cache
+from app.services.order_rules import (
+    classify_orders,
+    filter_orders_ready,
+    compute_order_stats,
+)
 
 class TiendaNubeAuth:
     @staticmethod
@@ -175,320 +210,762 @@ class TiendaNubeAuth:
                 "store_id": token_db.store_id
             }
 
+# --- Logica de ordenes (helpers puros que usan los clientes) ---
+
+def fulfillment_id_from_order(order: dict, order_number, real_id) -> str:
+    fulfillments = order.get("fulfillments", [])
+    if not isinstance(fulfillments, list) or len(fulfillments) == 0:
+        # Check fallback to fulfillment_orders just in case
+        fulfillments = order.get("fulfillment_orders", [])
+        if not isinstance(fulfillments, list) or len(fulfillments) == 0:
+             raise RuntimeError(f"Order {order_number} (real {real_id}) has no fulfillments. Keys={list(order.keys())}")
+
+    # 3) tomar el primero (si manejás multi-bulto, acá tendrías que matchear cuál)
+    f0 = fulfillments[0]
+
+    # Robust handling: f0 can be a dict (object) or str (id)
+    if isinstance(f0, dict):
+        fulfillment_id = f0.get("id")
+        if not fulfillment_id:
+            raise RuntimeError(f"Missing fulfillment id in fulfillments[0] dict. value={f0}")
+    elif isinstance(f0, str):
+        fulfillment_id = f0
+    else:
+         raise RuntimeError(f"Unexpected fulfillments[0] type: {type(f0)} value={f0}")
+    return fulfillment_id
+
+
+def andreani_tracking_url(track_code: str) -> str:
+    return f"https://seguimiento.andreani.com/envio/{track_code}"
+
+
+def skipped_tracking_result(order_number) -> dict:
+    return {"order": order_number, "status": "SKIPPED", "reason": "Empty data"}
+
+
+def tracking_result(order_number, result_data: dict) -> dict:
+    """Fila de resultado para una orden a partir de send_tracking_for_order_number."""
+    status_code = result_data.get("http_status")
+    if status_code in [200, 201]:
+        return {
+            "order": order_number,
+            "status": "SUCCESS",
+            "details": f"Updated. Real ID: {result_data.get('real_order_id')}"
+        }
+    details = f"Endpoint: {result_data.get('endpoint')} | Status: {status_code} | Body: {result_data.get('body')}"
+    return {"order": order_number, "status": "ERROR", "details": details}
+
+def _header_num(headers, name: str):
+    try:
+        value = headers.get(name)
+        return float(value) if value not in (None, "") else None
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """
+    Leaky bucket del lado cliente, uno por tienda (ver get_rate_limiter): hasta `burst`
+    requests de golpe y despues `rate` por segundo. Se sincroniza con los headers
+    x-rate-limit-* de cada respuesta y decide los reintentos de 429/5xx.
+    Thread-safe; cada llamada reserva su turno y espera lo que le toca.
+    """
+
+    def __init__(self, rate: float = API_RATE_LIMIT, burst: int = API_RATE_BURST):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        # Metricas
+        self.requests = 0
+        self.waits = 0
+        self.throttled_seconds = 0.0
+        self.backoff_seconds = 0.0
+        self.retries = 0
+        self.rate_limited = 0
+        self.server_errors = 0
+
+    def _recargar(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _reservar(self) -> float:
+        with self.lock:
+            self.requests += 1
+            if self.rate <= 0:
+                return 0.0
+            self._recargar(time.monotonic())
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            espera = -self.tokens / self.rate
+            self.waits += 1
+            self.throttled_seconds += espera
+            return espera
+
+    def acquire(self) -> float:
+        espera = self._reservar()
+        if espera:
+            time.sleep(espera)
+        return espera
+
+    async def acquire_async(self) -> float:
+        espera = self._reservar()
+        if espera:
+            await asyncio.sleep(espera)
+        return espera
+
+    def actualizar(self, headers):
+        """
+        Ajusta el bucket con lo que informa la API: x-rate-limit-limit (tamaño),
+        x-rate-limit-remaining (lugar libre) y x-rate-limit-reset (ms hasta vaciarse).
+        """
+        limit = _header_num(headers, "x-rate-limit-limit")
+        remaining = _header_num(headers, "x-rate-limit-remaining")
+        reset_ms = _header_num(headers, "x-rate-limit-reset")
+        if limit is None and remaining is None:
+            return
+        with self.lock:
+            if self.rate <= 0:
+                return
+            self._recargar(time.monotonic())
+            if limit:
+                self.capacity = max(1, int(limit))
+                self.tokens = min(self.tokens, self.capacity)
+            if remaining is not None:
+                # Si el servidor ve menos lugar del que creemos (otros procesos, otra app), manda el servidor
+                self.tokens = min(self.tokens, remaining)
+                if limit and reset_ms and limit > remaining:
+                    # Lo ocupado se vacia en reset_ms: de ahi sale la tasa real del plan de la tienda
+                    self.rate = (limit - remaining) / (reset_ms / 1000.0)
+
+    def espera_reintento(self, status_code: int, headers, intento: int, idempotente: bool = True):
+        """
+        Segundos a esperar antes de reintentar, o None si la respuesta no se reintenta.
+        Los 5xx solo se reintentan si `idempotente` (ver IDEMPOTENT_METHODS).
+        Backoff exponencial con jitter; en 429 ademas respeta Retry-After y vacia el bucket
+        para que el resto de los requests de la tienda esperen su turno.
+        """
+        if status_code not in RETRY_STATUSES or intento >= MAX_RETRIES:
+            return None
+        if status_code != 429 and not idempotente:
+            return None
+        espera = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** intento))
+        with self.lock:
+            self.retries += 1
+            if status_code == 429:
+                self.rate_limited += 1
+                retry_after = _header_num(headers, "retry-after") or 0
+                espera = max(espera, retry_after, 1 / self.rate if self.rate > 0 else 0)
+                self._recargar(time.monotonic())
+                self.tokens = min(self.tokens, 0)
+            else:
+                self.server_errors += 1
+            self.backoff_seconds += espera
+        return espera
+
+    def estadisticas(self) -> dict:
+        with self.lock:
+            return {
+                "rate": round(self.rate, 3),
+                "capacity": self.capacity,
+                "requests": self.requests,
+                "waits": self.waits,
+                "throttled_seconds": round(self.throttled_seconds, 3),
+                "backoff_seconds": round(self.backoff_seconds, 3),
+                "retries": self.retries,
+                "rate_limited": self.rate_limited,
+                "server_errors": self.server_errors,
+            }
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+def get_rate_limiter(store_id) -> RateLimiter:
+    """Limiter de la tienda, compartido por todos los clientes (sync y async) del worker."""
+    key = str(store_id)
+    limiter = _rate_limiters.get(key)
+    if limiter is None:
+        with _rate_limiters_lock:
+            limiter = _rate_limiters.setdefault(key, RateLimiter())
+    return limiter
+
+def rate_limit_stats(store_id=None) -> dict:
+    """Metricas de throttling por tienda (o de una sola)."""
+    if store_id is not None:
+        limiter = _rate_limiters.get(str(store_id))
+        return limiter.estadisticas() if limiter else RateLimiter().estadisticas()
+    return {key: limiter.estadisticas() for key, limiter in list(_rate_limiters.items())}
+
+def _numero_orden(order_number):
+    """Numero de orden como int ('#1234', '1234', 1234.0 -> 1234), o None si no es numerico."""
+    texto = str(order_number).strip().lstrip("#")
+    if texto.endswith(".0"):
+        texto = texto[:-2]
+    return int(texto) if texto.isdigit() else None
+
+
+class OrderIdCache:
+    """
+    Numero de orden -> id real, por tienda. Un numero de orden nunca cambia de id,
+    asi que no hay expiracion: LRU en memoria y, detras, la tabla orderidmapping
+    (sobrevive reinicios y se comparte entre workers).
+    La base es best-effort: si falla se loguea y se sigue con la API.
+    """
+
+    def __init__(self, maxsize: int = ORDER_ID_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._lru = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    def _recordar(self, key, real_id: int):
+        with self.lock:
+            self._lru[key] = real_id
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.maxsize:
+                self._lru.popitem(last=False)
+
+    def get_memoria(self, store_id, order_number):
+        numero = _numero_orden(order_number)
+        if numero is None:
+            return None
+        key = (int(store_id), numero)
+        with self.lock:
+            real_id = self._lru.get(key)
+            if real_id is not None:
+                self._lru.move_to_end(key)
+                self.hits += 1
+        return real_id
+
+    def get(self, store_id, order_number):
+        """Id real cacheado (memoria o base) o None."""
+        real_id = self.get_memoria(store_id, order_number)
+        numero = _numero_orden(order_number)
+        if real_id is not None or numero is None:
+            return real_id
+        try:
+            with Session(engine) as session:
+                fila = session.exec(
+                    select(OrderIdMapping).where(
+                        OrderIdMapping.tiendanube_store_id == int(store_id),
+                        OrderIdMapping.order_number == numero,
+                    )
+                ).first()
+        except Exception as e:
+            print(f"OrderIdCache read error: {e}")
+            fila = None
+        if fila is None:
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.db_hits += 1
+        self._recordar((int(store_id), numero), fila.real_order_id)
+        return fila.real_order_id
+
+    def guardar(self, store_id, pares):
+        """Registra pares (numero, id real); a la base solo van los que no estaban en memoria."""
+        nuevos = {}
+        for order_number, real_id in pares:
+            numero = _numero_orden(order_number)
+            if numero is None or not real_id:
+                continue
+            key = (int(store_id), numero)
+            with self.lock:
+                conocido = self._lru.get(key)
+            if conocido != int(real_id):
+                nuevos[numero] = int(real_id)
+            self._recordar(key, int(real_id))
+        if not nuevos:
+            return 0
+        try:
+            with Session(engine) as session:
+                existentes = {
+                    fila.order_number: fila
+                    for fila in session.exec(
+                        select(OrderIdMapping).where(
+                            OrderIdMapping.tiendanube_store_id == int(store_id),
+                            OrderIdMapping.order_number.in_(list(nuevos)),
+                        )
+                    )
+                }
+                for numero, real_id in nuevos.items():
+                    fila = existentes.get(numero)
+                    if fila is None:
+                        session.add(OrderIdMapping(tiendanube_store_id=int(store_id), order_number=numero, real_order_id=real_id))
+                    elif fila.real_order_id != real_id:
+                        fila.real_order_id = real_id
+                        session.add(fila)
+                session.commit()
+        except Exception as e:
+            # p.ej. otro worker inserto el mismo numero en paralelo: queda en memoria igual
+            print(f"OrderIdCache write error: {e}")
+        return len(nuevos)
+
+    def estadisticas(self) -> dict:
+        with self.lock:
+            return {
+                "size": len(self._lru),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "db_hits": self.db_hits,
+                "misses": self.misses,
+            }
+
+order_id_cache = OrderIdCache()
+
+
+def orders_query(per_page: int = BULK_PER_PAGE, status: str = "open", **filtros) -> dict:
+    """Params de /orders (sin 'page'); los filtros en None no se mandan."""
+    params = {"status": status, "per_page": per_page}
+    params.update({k: v for k, v in filtros.items() if v is not None})
+    return params
+
+
+def parse_orders_page(r, page: int) -> list:
+    """Lista de ordenes de una respuesta de /orders; [] si ya no hay mas paginas."""
+    if r.status_code == 404:
+        # La API responde 404 al pedir una pagina despues de la ultima
+        return []
+    if r.status_code != 200:
+        raise TiendaNubeAPIError(f"LIST ORDERS FAILED {r.status_code}: {r.text}", r.status_code)
+    data = r.json()
+    if not isinstance(data, list):
+        print(f"DEBUG: Unexpected response (not list) on page {page}: {data}")
+        return []
+    return data
+
+
+def es_ultima_pagina(data: list, page: int, per_page: int, max_pages: int) -> bool:
+    return not data or len(data) < per_page or page >= max_pages
+
+
+class PaginadoTruncado(RuntimeError):
+    """iter_open_orders llego a max_pages y la API todavia tenia paginas."""
+
+
+def fin_de_paginado(data: list, page: int, per_page: int, max_pages: int, estricto: bool):
+    """
+    Se llama en la ultima pagina. Si se corto por max_pages con la pagina llena
+    (quedaban ordenes): PaginadoTruncado con estricto, si no solo se avisa.
+    """
+    if data and len(data) >= per_page and page >= max_pages:
+        mensaje = f"Orders paging stopped at max_pages={max_pages}; more pages were available"
+        if estricto:
+            raise PaginadoTruncado(mensaje)
+        print(mensaje)
+
+
+class ReadyOrdersCollector:
+    """
+    Arma una pagina de 'ordenes listas' a partir de las paginas crudas de /orders.
+    `page`/`per_page` paginan las ordenes listas (ya filtradas), no las paginas de la
+    API: se saltean las (page - 1) * per_page primeras incluidas, igual que OFFSET en
+    la copia local. Avisa cuando ya junto per_page y vio una mas (has_more), para
+    cortar la paginacion.
+    """
+
+    def __init__(self, page: int = 1, per_page: int = 50, payment_statuses: list = None, stage: str = None, debug: bool = False):
+        self.page = page
+        self.saltear = max(0, page - 1) * per_page
+        self.per_page = per_page
+        self.has_more = False
+        self.payment_statuses = payment_statuses
+        self.stage = stage
+        self.debug = debug
+        self.results = []
+        self.debug_log = []
+        # Contadores por etapa de todas las paginas vistas (completos solo si se recorrio todo)
+        self.stats = {"unpacked": 0, "packed": 0}
+
+    def agregar(self, data: list) -> bool:
+        """Procesa una pagina cruda; True si ya alcanza y no hace falta pedir mas."""
+        parcial = classify_orders(data, payment_statuses=self.payment_statuses, stage=self.stage, debug=self.debug)
+        self.stats = {k: self.stats.get(k, 0) + v for k, v in parcial["stats"].items()}
+        self.debug_log.extend(parcial["debug"])
+        for res in parcial["results"]:
+            if self.saltear:
+                self.saltear -= 1
+            elif len(self.results) < self.per_page:
+                self.results.append(res)
+            else:
+                self.has_more = True
+        return self.has_more
+
+    def resultado(self) -> dict:
+        return pagina_listas(self.results, self.debug_log, self.page, self.per_page, self.has_more)
+
+
+def pagina_listas(results: list, debug: list, page: int, per_page: int, has_more: bool) -> dict:
+    """Respuesta de listado: `page` es de ordenes listas; has_more = hay pagina siguiente."""
+    return {"results": results, "debug": debug, "page": page, "per_page": per_page, "has_more": has_more}
+
+
+def sumar_stats(total: dict, data: list) -> dict:
+    parcial = compute_order_stats(data)
+    return {k: total.get(k, 0) + v for k, v in parcial.items()}
+
+
+def pick_orders(data: list, pendientes: dict, encontradas: dict):
+    """Pasa de `pendientes` (numero -> numero pedido) a `encontradas` las ordenes de la pagina."""
+    for order in data:
+        numero = _numero_orden(order.get("number"))
+        if numero in pendientes:
+            encontradas[pendientes.pop(numero)] = order
+
+
+def merge_bulk_results(order_numbers: list, encontradas: dict, individuales: list) -> list:
+    """Resultado en el orden pedido: lo encontrado en paginas + lo traido de a una orden."""
+    por_numero = {res["number"]: res for res in individuales}
+    return [
+        {"number": num, "order": encontradas[num]} if num in encontradas else por_numero[num]
+        for num in order_numbers
+    ]
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+def get_http_session() -> requests.Session:
+    """
+    Session con keep-alive compartida por el proceso: main.py crea un cliente por
+    request, pero las conexiones TCP+TLS a api.tiendanube.com se reutilizan.
+    """
+    global _http_session
+    if _http_session is None:
+        with _http_session_lock:
+            if _http_session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                _http_session = session
+    return _http_session
+
+class TiendaNubeAPIError(RuntimeError):
+    """Respuesta no exitosa de la API; `status_code` es el HTTP status."""
+
+    def __init__(self, mensaje: str, status_code: int):
+        super().__init__(mensaje)
+        self.status_code = status_code
+
+
+def auth_headers(access_token: str) -> dict:
+    return {
+        "Authentication": f"bearer {access_token}",
+        "Content-Type": "application/json",
+        "User-Agent": "Antigravity-App/1.0"
+    }
+
+
+def real_id_from_lookup(r, order_number) -> int:
+    """Id real de la respuesta de GET /orders?q=<numero>; RuntimeError si no esta."""
+    if r.status_code != 200:
+        raise TiendaNubeAPIError(f"LOOKUP FAILED {r.status_code}: {r.text}", r.status_code)
+
+    data = r.json()
+    if not isinstance(data, list) or not data:
+        raise RuntimeError(f"ORDER NOT FOUND for number={order_number}. Body={r.text}")
+
+    # debería venir 1 sola
+    real_id = data[0].get("id")
+    if not real_id:
+        raise RuntimeError(f"LOOKUP OK but missing id. Body={r.text}")
+    return int(real_id)
+
+
+def order_from_response(r) -> dict:
+    if r.status_code != 200:
+        raise TiendaNubeAPIError(f"GET ORDER FAILED {r.status_code}: {r.text}", r.status_code)
+    return r.json()
+
+
+def pendientes_por_numero(order_numbers: list) -> dict:
+    """numero normalizado -> numero tal cual se pidio (los no numericos quedan afuera)."""
+    pendientes = {}
+    for num in order_numbers:
+        numero = _numero_orden(num)
+        if numero is not None:
+            pendientes.setdefault(numero, num)
+    return pendientes
+
+
+def tracking_patch_payload(tracking_code: str, tracking_url: str | None) -> dict:
+    # Endpoint: PATCH /orders/{id}/fulfillment-orders/{fulfillment_id}, status DISPATCHED
+    return {
+        "tracking_info": {
+            "code": tracking_code,
+            "url": tracking_url,
+            "notify_customer": True
+        },
+        "status": "DISPATCHED"
+    }
+
+
+def despues_de_patch(store_id, status_code: int):
+    if status_code in (200, 201):
+        # La orden cambio de estado: fuera lo cacheado y la copia local se resincroniza en la proxima lectura
+        orders_cache.invalidar(store_id)
+        try:
+            order_mirror.marcar_desactualizado(store_id)
+        except Exception as e:
+            # El PATCH ya se aplico: no se reporta como fallido por esto
+            print(f"Could not mark order mirror stale for store {store_id}: {e}")
+
+
 class TiendaNubeClient:
-    def __init__(self, store_id: str, access_token: str):
+    """
+    Cliente sync (threads, scripts, registro de webhooks al conectar una tienda).
+    Las rutas usan AsyncTiendaNubeClient; los dos comparten los helpers de este modulo.
+    """
+
+    def __init__(self, store_id: str, access_token: str, rate_limiter: RateLimiter = None):
         if not access_token:
             raise ValueError("Missing access_token (None/empty). Reconnect and regenerate tokens.json.")
         
         self.store_id = str(store_id)
         self.access_token = str(access_token).strip()
         self.base = f"https://api.tiendanube.com/v1/{self.store_id}"
-        self.headers = {
-            "Authentication": f"bearer {self.access_token}",
-            "Content-Type": "application/json",
-            "User-Agent": "Antigravity-App/1.0"
-        }
-
-    def _req(self, method: str, url: str, **kwargs):
-        r = requests.request(method, url, headers=self.headers, timeout=30, **kwargs)
-        return r
+        self.headers = auth_headers(self.access_token)
+        self.rate_limiter = rate_limiter or get_rate_limiter(self.store_id)
+
+    def _req(self, method: str, url: str, idempotente: bool = None, **kwargs):
+        kwargs.setdefault("timeout", (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+        if idempotente is None:
+            idempotente = method.upper() in IDEMPOTENT_METHODS
+        intento = 0
+        while True:
+            self.rate_limiter.acquire()
+            r = get_http_session().request(method, url, headers=self.headers, **kwargs)
+            self.rate_limiter.actualizar(r.headers)
+            espera = self.rate_limiter.espera_reintento(r.status_code, r.headers, intento, idempotente)
+            if espera is None:
+                return r
+            print(f"TiendaNube {method} {url} -> {r.status_code}, retry {intento + 1} in {espera:.2f}s")
+            time.sleep(espera)
+            intento += 1
 
     def lookup_real_order_id(self, order_number: int) -> int:
+        cached = order_id_cache.get(self.store_id, order_number)
+        if cached is not None:
+            return cached
+
+        r = self._req("GET", f"{self.base}/orders", params={"q": str(order_number)})
+        real_id = real_id_from_lookup(r, order_number)
+        order_id_cache.guardar(self.store_id, [(r.json()[0].get("number"), real_id)])
+        return real_id
+
+    def get_order(self, real_order_id: int) -> dict:
+        r = self._req("GET", f"{self.base}/orders/{real_order_id}", params={"aggregates": "fulfillment_orders"})
+        return order_from_response(r)
+
+    def _fetch_order_by_number(self, order_number) -> dict:
+        real_id = self.lookup_real_order_id(order_number)
+        return self.get_order(real_id)
+
+    def get_orders_by_numbers(self, order_numbers: list, concurrency: int = FETCH_CONCURRENCY) -> list:
+        """
+        Lookup + GET de varias ordenes en paralelo (a lo sumo `concurrency` a la vez).
+        Devuelve una lista en el mismo orden que `order_numbers`, con un dict por orden:
+        {"number", "order"} si salio bien o {"number", "error"} si fallo.
+        """
+        def fetch(num):
+            try:
+                return {"number": num, "order": self._fetch_order_by_number(num)}
+            except Exception as e:
+                return {"number": num, "error": str(e)}
+
+        if not order_numbers:
+            return []
+        workers = max(1, min(concurrency, len(order_numbers)))
+        if workers == 1:
+            return [fetch(num) for num in order_numbers]
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # map conserva el orden de entrada
+            return list(pool.map(fetch, order_numbers))
+
+    def iter_open_orders(self, per_page: int = BULK_PER_PAGE, max_pages: int = OPEN_ORDERS_MAX_PAGES,
+                         prefetch: bool = True, estricto: bool = False, **filtros):
+        """
+        Generador de paginas de /orders (por defecto status=open), una lista por pagina.
+        Con prefetch pide la pagina siguiente en otro thread mientras el que consume
+        procesa la actual. Si el consumidor corta (break), no se piden mas paginas.
+        Si corta por max_pages quedando paginas, lo avisa; con `estricto` lanza
+        PaginadoTruncado despues de entregar la ultima (ver fin_de_paginado).
+        filtros: q, status, created_at_min, aggregates, ... (params de la API).
+        """
         url = f"{self.base}/orders"
-        r = self._req("GET", url, params={"q": str(order_number)})
-        if r.status_code != 200:
-            raise RuntimeError(f"LOOKUP FAILED {r.status_code}: {r.text}")
+        params = orders_query(per_page=per_page, **filtros)
 
-        data = r.json()
-        if not isinstance(data, list) or not data:
-            raise RuntimeError(f"ORDER NOT FOUND for number={order_number}. Body={r.text}")
+        def fetch(page):
+            data = parse_orders_page(self._req("GET", url, params={**params, "page": page}), page)
+            # Cada pagina trae numero e id de cada orden: calienta el cache de lookups
+            order_id_cache.guardar(self.store_id, [(o.get("number"), o.get("id")) for o in data])
+            return data
 
-        # debería venir 1 sola
-        real_id = data[0].get("id")
-        if not real_id:
-            raise RuntimeError(f"LOOKUP OK but missing id. Body={r.text}")
+        pool = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        try:
+            siguiente = pool.submit(fetch, 1) if pool else None
+            page = 1
+            while True:
+                data = siguiente.result() if pool else fetch(page)
+                if es_ultima_pagina(data, page, per_page, max_pages):
+                    if data:
+                        yield data
+                    fin_de_paginado(data, page, per_page, max_pages, estricto)
+                    return
+                if pool:
+                    siguiente = pool.submit(fetch, page + 1)
+                yield data
+                page += 1
+        finally:
+            if pool:
+                pool.shutdown(wait=False, cancel_futures=True)
+
+    def get_orders_bulk(self, order_numbers: list, status: str = "open", created_at_min: str = None,
+                        max_pages: int = BULK_MAX_PAGES, concurrency: int = FETCH_CONCURRENCY) -> list:
+        """
+        Igual que get_orders_by_numbers pero recorriendo /orders de a BULK_PER_PAGE:
+        N ordenes cuestan ~N/200 requests. Lo que no aparece en las primeras `max_pages`
+        paginas (o con `created_at_min`, en esa ventana) se trae con lookup + GET.
+        """
+        pendientes = pendientes_por_numero(order_numbers)
+        encontradas = {}
 
-        return int(real_id)
+        paginas = 0
+        if pendientes:
+            try:
+                for data in self.iter_open_orders(max_pages=max_pages, status=status, created_at_min=created_at_min,
+                                                  aggregates="fulfillment_orders"):
+                    paginas += 1
+                    pick_orders(data, pendientes, encontradas)
+                    if not pendientes:
+                        break
+            except Exception as e:
+                # Se sigue con los GETs individuales
+                print(f"Bulk orders paging failed: {e}")
 
-    def get_order(self, real_order_id: int) -> dict:
-        url = f"{self.base}/orders/{real_order_id}"
-        # Solicitamos aggregates para intentar obtener objetos completos en 'fulfillments'
-        # aunque igual soportaremos si devuelve solo IDs (strings)
-        r = self._req("GET", url, params={"aggregates": "fulfillment_orders"})
+        faltantes = [num for num in order_numbers if num not in encontradas]
+        individuales = self.get_orders_by_numbers(faltantes, concurrency=concurrency) if faltantes else []
+        print(f"Bulk fetch: {len(encontradas)} from {paginas} page(s), {len(faltantes)} individual")
+        return merge_bulk_results(order_numbers, encontradas, individuales)
+
+    def register_webhooks(self, url: str, events: list) -> list:
+        """Suscribe `url` a los eventos que todavia no lo estan. Devuelve los eventos agregados."""
+        r = self._req("GET", f"{self.base}/webhooks")
         if r.status_code != 200:
-            raise RuntimeError(f"GET ORDER FAILED {r.status_code}: {r.text}")
-        return r.json()
+            raise RuntimeError(f"LIST WEBHOOKS FAILED {r.status_code}: {r.text}")
+        existentes = {(w.get("event"), w.get("url")) for w in r.json() if isinstance(w, dict)}
+        agregados = []
+        for event in events:
+            if (event, url) in existentes:
+                continue
+            r = self._req("POST", f"{self.base}/webhooks", json={"event": event, "url": url})
+            if r.status_code not in (200, 201):
+                raise RuntimeError(f"CREATE WEBHOOK {event} FAILED {r.status_code}: {r.text}")
+            agregados.append(event)
+        return agregados
 
     def patch_fulfillment_tracking(self, real_order_id: int, fulfillment_id: str, tracking_code: str, tracking_url: str | None):
-        # Endpoint correcto según docs
         endpoint = f"{self.base}/orders/{real_order_id}/fulfillment-orders/{fulfillment_id}"
+        r = self._req("PATCH", endpoint, json=tracking_patch_payload(tracking_code, tracking_url))
+        despues_de_patch(self.store_id, r.status_code)
+        return endpoint, r.status_code, r.text
 
-        payload = {
-            "tracking_info": {
-                "code": tracking_code,
-                "url": tracking_url,
-                "notify_customer": True
-            }
-            # Si querés forzar estado, se puede probar agregando:
-            # ,"status": "DISPATCHED"
-        }
-        
-        # User requested status DISPATCHED in previous turn, let's include it if payload supports it
-        # Step 183: "status": "DISPATCHED"
-        payload["status"] = "DISPATCHED"
+    def sync_order_mirror(self, force: bool = False) -> bool:
+        """
+        Trae a la copia local (order_mirror) las ordenes modificadas desde el ultimo cursor;
+        la primera vez, todas las abiertas. No hace nada si se sincronizo hace menos de
+        ORDER_SYNC_INTERVAL o si otra request ya esta sincronizando esta tienda.
+        """
+        if not order_mirror.reservar_sync(self.store_id, force):
+            return False
+        ok = False
+        try:
+            estado = order_mirror.estado_sync(self.store_id)
+            cursor = estado["cursor"] if estado else None
+            # Si queda cortado no se registra: el cursor no avanza y el proximo sync repite desde el anterior
+            for data in self.iter_open_orders(max_pages=order_mirror.ORDER_SYNC_MAX_PAGES, estricto=True,
+                                              **order_mirror.sync_filtros(estado)):
+                cursor = order_mirror.cursor_mayor(cursor, order_mirror.guardar_ordenes(self.store_id, data))
+            order_mirror.registrar_sync(self.store_id, cursor)
+            ok = True
+        finally:
+            order_mirror.liberar_sync(self.store_id, ok)
+        return ok
+
+    def _mirror_listo(self) -> bool:
+        """Sincroniza si toca; True si la lectura puede salir de la copia local."""
+        if not order_mirror.ORDER_MIRROR_ENABLED:
+            return False
+        try:
+            self.sync_order_mirror()
+        except Exception as e:
+            print(f"Order mirror sync failed for store {self.store_id}: {e}")
+        try:
+            return order_mirror.copia_lista(order_mirror.estado_sync(self.store_id))
+        except Exception as e:
+            print(f"Order mirror unavailable: {e}")
+            return False
 
-        r = self._req("PATCH", endpoint, json=payload)
-        return endpoint, r.status_code, r.text
+    def _pagina_mirror(self, page, per_page, payment_statuses, stage) -> dict:
+        data, has_more = order_mirror.ready_order_payloads(self.store_id, page, per_page, payment_statuses, stage)
+        listado = filter_orders_ready(data, payment_statuses=payment_statuses, stage=stage)
+        return pagina_listas(listado["results"], listado["debug"], page, per_page, has_more)
 
     def list_orders_ready(self, page: int = 1, per_page: int = 50, q: str = None, payment_statuses: list = None, stage: str = None, debug: bool = False) -> dict:
-        url = f"{self.base}/orders"
-        params = {
-            "page": page,
-            "per_page": per_page,
-            "status": "open"
-        }
-        if q:
-            params["q"] = str(q)
+        """
+        Una pagina de ordenes listas. `page`/`per_page` cuentan ordenes listas (no paginas
+        de /orders); has_more indica si hay pagina siguiente.
+        """
+        if not q and not debug and self._mirror_listo():
+            return self._pagina_mirror(page, per_page, payment_statuses, stage)
 
         if debug:
-            print(f"DEBUG: Requesting orders {url} with params {params}") 
-            
-        r = self._req("GET", url, params=params)
-        
-        if r.status_code != 200:
-            raise RuntimeError(f"LIST ORDERS FAILED {r.status_code}: {r.text}")
-        
-        data = r.json()
-        if not isinstance(data, list):
-            print(f"DEBUG: Unexpected response (not list): {data}")
-            return {"results": [], "debug": []}
-
-        if payment_statuses is None:
-            payment_statuses = ["paid"]
-
-        results = []
-        debug_log = []
+            print(f"DEBUG: Requesting orders {self.base}/orders page={page} per_page={per_page} q={q} stage={stage}")
 
-        for order in data:
-            excluded_reason = None
-            included = False
-            
-            # Extract basic info for debug
-            oid = order.get("id")
-            onum = order.get("number")
-            ostatus = order.get("status")
-            opay = order.get("payment_status")
-            oship = order.get("shipping_status")
-            onext = order.get("next_action")
-            ofulls = order.get("fulfillments") or []
-            
-            f_status = None
-            if ofulls:
-                f_status = ofulls[0].get("status")
-
-            # Evaluation Logic
-            try:
-                # 1. Status 'open'
-                if ostatus != "open": 
-                    excluded_reason = f"status '{ostatus}' != 'open'"
-                
-                # 2. Payment Status Check
-                elif opay not in payment_statuses:
-                    excluded_reason = f"payment_status != 'paid' ({opay})"
-                
-                # 3. Fulfillment Stage Logic
-                elif stage:
-                    if stage == 'unpacked':
-                        # Criteria for 'Por Empaquetar':
-                        # - fulfillments exists AND status is 'unpacked'
-                        # - OR fulfillments empty (waiting to be created)
-                        # - OR next_action is 'waiting_packing'
-                        is_unpacked_candidate = False
-                        
-                        if ofulls:
-                            if str(f_status).lower() == 'unpacked':
-                                is_unpacked_candidate = True
-                            else:
-                                excluded_reason = f"stage='unpacked' but fulfillments[0].status='{f_status}'"
-                        elif onext == 'waiting_packing':
-                            is_unpacked_candidate = True
-                            f_status = "unpacked (next_action)"
-                        else:
-                            # Fallback: validation for empty fulfillments without explicit next_action?
-                            # Previous logic allowed empty fulfillments.
-                            # We keep it permissive for 'unpacked' if no contradictory info exists.
-                            is_unpacked_candidate = True 
-                            f_status = "pending_creation"
-                        
-                        if not is_unpacked_candidate and not excluded_reason:
-                            excluded_reason = "stage='unpacked' criteria not met"
-                    
-                    elif stage == 'packed':
-                        # Criteria for 'Por Enviar':
-                        # - Must have fulfillments
-                        # - Status must be 'packed'
-                        if not ofulls:
-                            excluded_reason = "stage='packed' but no fulfillments"
-                        elif str(f_status).lower() != 'packed':
-                             excluded_reason = f"stage='packed' but fulfillments[0].status='{f_status}'"
-                
-                # 4. Shipping 'unshipped' or 'unpacked'
-                if not excluded_reason:
-                     # FIX: Accept "unpacked" as valid for ready orders (User Request)
-                     if oship not in ["unshipped", "unpacked"]:
-                         excluded_reason = f"shipping_status '{oship}' not in ['unshipped', 'unpacked']"
+        collector = ReadyOrdersCollector(page, per_page, payment_statuses, stage, debug)
+        for data in self.iter_open_orders(q=str(q) if q else None):
+            if collector.agregar(data):
+                break
+        return collector.resultado()
 
-                # Final Decision
-                if not excluded_reason:
-                    included = True
+    def list_orders_with_stats(self, page: int = 1, per_page: int = 50, q: str = None, payment_statuses: list = None, stage: str = None, debug: bool = False) -> dict:
+        """
+        list_orders_ready + contadores por etapa en una sola pasada: cada pagina de /orders
+        se baja y se clasifica una vez (sin corte temprano, los contadores necesitan todas).
+        Con copia local son dos consultas a la base. Con `q`, los contadores son de la busqueda.
+        """
+        if not q and not debug and self._mirror_listo():
+            listado = self._pagina_mirror(page, per_page, payment_statuses, stage)
+            listado["stats"] = order_mirror.order_stats(self.store_id, payment_statuses)
+            return listado
 
-            except Exception as e:
-                excluded_reason = f"EXCEPTION: {str(e)}"
-            
-            # DEBUG ENTRY construction
-            if debug:
-                debug_entry = {
-                    "number": onum,
-                    "id": oid,
-                    "status": ostatus,
-                    "payment_status": opay,
-                    "shipping_status": oship,
-                    "next_action": onext,
-                    "fulfillments_count": len(ofulls),
-                    "fulfillment_status_0": f_status,
-                    "stage_requested": stage,
-                    "included": included,
-                    "excluded_reason": excluded_reason
-                }
-                debug_log.append(debug_entry)
-            
-            if included:
-                try:
-                     # Extract logic for result
-                    shipping_address = order.get("shipping_address") or {}
-                    if not isinstance(shipping_address, dict): shipping_address = {}
-                    
-                    c_name = order.get("contact_name")
-                    if not c_name: c_name = order.get("contact_email")
-                    
-                    products_raw = order.get("products", [])
-                    products_list = []
-                    for p in products_raw:
-                        products_list.append({
-                            "name": p.get("name"),
-                            "sku": p.get("sku"),
-                            "quantity": p.get("quantity"),
-                            "variant": p.get("variant_name")
-                        })
-                        
-                    results.append({
-                        "number": onum,
-                        "id": oid,
-                        "created_at": order.get("created_at"),
-                        "customer_name": c_name,
-                        "zipcode": shipping_address.get("zipcode"),
-                        "province": shipping_address.get("province"),
-                        "city": shipping_address.get("city"),
-                        "shipping_option": order.get("shipping_option"),
-                        "payment_status": opay,
-                        "shipping_status": oship,
-                        "fulfillment_status": f_status,
-                        "address": shipping_address.get("address"),
-                        "products": products_list
-                    })
-                except Exception as e:
-                    print(f"ERROR building result for {onum}: {e}")
-                    if debug: debug_log[-1]["excluded_reason"] = f"BUILD ERROR: {e}"
-                    
-        return {"results": results, "debug": debug_log}
+        collector = ReadyOrdersCollector(page, per_page, payment_statuses, stage, debug)
+        for data in self.iter_open_orders(q=str(q) if q else None):
+            collector.agregar(data)
+        return {**collector.resultado(), "stats": collector.stats}
 
     def get_order_stats(self) -> dict:
-        """
-        Calculates counts for 'unpacked' and 'packed' based on recent open orders.
-        Applies STRICT filtering matching list_orders_ready.
-        """
-        url = f"{self.base}/orders"
-        # Fetch a reasonable batch to get stats
-        params = {"page": 1, "per_page": 100, "status": "open"}
-        
+        if self._mirror_listo():
+            return order_mirror.order_stats(self.store_id)
+
+        stats = {"unpacked": 0, "packed": 0}
         try:
-            r = self._req("GET", url, params=params)
-            if r.status_code != 200: return {"unpacked": 0, "packed": 0}
-            data = r.json()
-            if not isinstance(data, list): return {"unpacked": 0, "packed": 0}
-        except:
+            for data in self.iter_open_orders():
+                stats = sumar_stats(stats, data)
+        except Exception as e:
+            print(f"Stats paging failed: {e}")
             return {"unpacked": 0, "packed": 0}
-
-        unpacked_count = 0
-        packed_count = 0
-        
-        for order in data:
-            # 1. Status 'open'
-            if order.get("status") != "open": continue
-            
-            # 2. Payment Status Check (STRICT PAID)
-            if order.get("payment_status") != "paid": continue
-            
-            # 3. Shipping Status Check
-            oship = order.get("shipping_status")
-            if oship not in ["unshipped", "unpacked"]: continue
-            
-            # Fulfillment Info
-            fulfillments = order.get("fulfillments") or []
-            f_status = fulfillments[0].get("status") if fulfillments else None
-            onext = order.get("next_action")
-
-            # Check UNPACKED Criteria
-            is_unpacked = False
-            if fulfillments:
-                if str(f_status).lower() == 'unpacked': is_unpacked = True
-            elif onext == 'waiting_packing':
-                is_unpacked = True
-            else:
-                # Fallback for empty fulfillments (pending creation)
-                is_unpacked = True
-            
-            if is_unpacked:
-                unpacked_count += 1
-            
-            # Check PACKED Criteria (Independent check, though usually mutually exclusive)
-            is_packed = False
-            if fulfillments and str(f_status).lower() == 'packed':
-                is_packed = True
-            
-            if is_packed:
-                packed_count += 1
-
-        return {"unpacked": unpacked_count, "packed": packed_count}
+        return stats
 
     def send_tracking_for_order_number(self, order_number: int, tracking_code: str, tracking_url: str | None = None) -> dict:
-        # 1) buscar ID real
         real_id = self.lookup_real_order_id(order_number)
-
-        # 2) traer orden (acá viene 'fulfillments')
         order = self.get_order(real_id)
-
-        fulfillments = order.get("fulfillments", [])
-        if not isinstance(fulfillments, list) or len(fulfillments) == 0:
-            # Check fallback to fulfillment_orders just in case
-            fulfillments = order.get("fulfillment_orders", [])
-            if not isinstance(fulfillments, list) or len(fulfillments) == 0:
-                 raise RuntimeError(f"Order {order_number} (real {real_id}) has no fulfillments. Keys={list(order.keys())}")
-
-        # 3) tomar el primero (si manejás multi-bulto, acá tendrías que matchear cuál)
-        f0 = fulfillments[0]
-        
-        # Robust handling: f0 can be a dict (object) or str (id)
-        if isinstance(f0, dict):
-            fulfillment_id = f0.get("id")
-            if not fulfillment_id:
-                raise RuntimeError(f"Missing fulfillment id in fulfillments[0] dict. value={f0}")
-        elif isinstance(f0, str):
-            fulfillment_id = f0
-        else:
-             raise RuntimeError(f"Unexpected fulfillments[0] type: {type(f0)} value={f0}")
-
-        # 4) patch tracking
+        fulfillment_id = fulfillment_id_from_order(order, order_number, real_id)
         endpoint, status, body = self.patch_fulfillment_tracking(real_id, fulfillment_id, tracking_code, tracking_url)
 
         return {
@@ -499,99 +976,29 @@ class TiendaNubeClient:
             "http_status": status,
             "body": body
         }
-        
-    def _extract_from_pdf(self, file_content):
-        """
-        Extracts (order_id, tracking_number) tuples from an Andreani PDF.
-        """
-        results = []
-        try:
-            reader = PyPDF2.PdfReader(io.BytesIO(file_content))
-            for page in reader.pages:
-                text = page.extract_text()
-                if not text:
-                    continue
-                
-                # Normalize text for regex
-                clean_text = text.replace("N°", "").replace("Nº", "").replace("\n", " ")
-                
-                # 1. Find Order ID
-                order_match = re.search(r"Interno\s*:\s*#?\s*([0-9]+)", clean_text, re.IGNORECASE)
-                order_id = None
-                if order_match:
-                    order_id = order_match.group(1)
-                
-                # 2. Find Tracking Number
-                tracking_number = None
-                tracking_match = re.search(r"de seguimiento\s*:\s*([0-9]+)", clean_text, re.IGNORECASE)
-                if tracking_match:
-                    tracking_number = tracking_match.group(1)
-                else:
-                    fallback_match = re.search(r"(?:Envío|Seguimiento)\s*(?:Andreani)?\s*:?\s*([A-Z0-9]+)", clean_text, re.IGNORECASE)
-                    if fallback_match:
-                        tracking_number = fallback_match.group(1)
-                
-                if order_id and tracking_number:
-                    results.append({"order": order_id, "track": tracking_number})
-                    
-        except Exception as e:
-            print(f"Error parsing PDF: {e}")
-            raise e
-            
-        return pd.DataFrame(results)
 
-    def process_tracking_file(self, file_content):
-        # Determine file type
+    def _tracking_row_result(self, order_number, track_code) -> dict:
+        if track_code is None:
+            return skipped_tracking_result(order_number)
         try:
-            if file_content.startswith(b"%PDF"):
-                 df = self._extract_from_pdf(file_content)
-                 if df.empty:
-                     return {"error": "No valid labels found in PDF. Could not identify 'Interno.'"}
-            else:
-                try:
-                    df = pd.read_excel(io.BytesIO(file_content))
-                except:
-                    df = pd.read_csv(io.BytesIO(file_content), sep=None, engine='python')
+            track_url = andreani_tracking_url(track_code)
+            result_data = self.send_tracking_for_order_number(order_number, track_code, track_url)
+            return tracking_result(order_number, result_data)
         except Exception as e:
-             return {"error": f"Could not read file: {str(e)}"}
+            return {"order": order_number, "status": "EXCEPTION", "details": str(e)}
 
-        if not 'order' in df.columns:
-            df.columns = [str(c).lower().strip() for c in df.columns]
-            col_order = next((c for c in df.columns if "orden" in c or "numero" in c or "id" in c), None)
-            col_track = next((c for c in df.columns if "seguimiento" in c or "track" in c or "codigo" in c), None)
-            
-            if not col_order or not col_track:
-                return {"error": "Could not identify columns."}
-            df.rename(columns={col_order: "order", col_track: "track"}, inplace=True)
-
-        results = []
-        for _, row in df.iterrows():
-            order_number = str(row["order"]).strip()
-            if order_number.endswith(".0"): order_number = order_number[:-2]
-            track_code = str(row["track"]).strip()
-            
-            if not order_number or not track_code or track_code.lower() == "nan":
-                results.append({"order": order_number, "status": "SKIPPED", "reason": "Empty data"})
-                continue
-
-            try:
-                # Use the helper method for logic
-                track_url = f"https://seguimiento.andreani.com/envio/{track_code}"
-                result_data = self.send_tracking_for_order_number(order_number, track_code, track_url)
-                
-                # Check status
-                status_code = result_data.get("http_status")
-                if status_code in [200, 201]:
-                     results.append({
-                        "order": order_number, 
-                        "status": "SUCCESS", 
-                        "details": f"Updated. Real ID: {result_data.get('real_order_id')}"
-                     })
-                else:
-                    details = f"Endpoint: {result_data.get('endpoint')} | Status: {status_code} | Body: {result_data.get('body')}"
-                    results.append({"order": order_number, "status": "ERROR", "details": details})
-                    
-            except Exception as e:
-                results.append({"order": order_number, "status": "EXCEPTION", "details": str(e)})
-                
+    def process_tracking_file(self, rows: list, workers: int = TRACKING_CONCURRENCY):
+        """
+        Carga los trackings de `rows` ((order_number, track_code), ver
+        tracking_file.leer_archivo_tracking). Hasta `workers` ordenes en paralelo,
+        todas detras del rate limiter de la tienda.
+        """
+        rows = list(rows)
+        workers = max(1, min(workers, len(rows)))
+        if workers == 1:
+            results = [self._tracking_row_result(*row) for row in rows]
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                # map conserva el orden del archivo
+                results = list(pool.map(lambda row: self._tracking_row_result(*row), rows))
         return {"results": results}
@@ -0,0 +1,351 @@
+import asyncio
+import httpx
+from contextlib import aclosing
+
+from app.services import order_mirror
+
+from app.services.tiendanube import (
+    FETCH_CONCURRENCY,
+    BULK_MAX_PAGES,
+    BULK_PER_PAGE,
+    OPEN_ORDERS_MAX_PAGES,
+    HTTP_POOL_SIZE,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_READ_TIMEOUT,
+    TRACKING_CONCURRENCY,
+    IDEMPOTENT_METHODS,
+    RateLimiter,
+    get_rate_limiter,
+    order_id_cache,
+    auth_headers,
+    real_id_from_lookup,
+    order_from_response,
+    pendientes_por_numero,
+    tracking_patch_payload,
+    despues_de_patch,
+    orders_query,
+    parse_orders_page,
+    es_ultima_pagina,
+    fin_de_paginado,
+    pick_orders,
+    merge_bulk_results,
+    ReadyOrdersCollector,
+    pagina_listas,
+    filter_orders_ready,
+    sumar_stats,
+    fulfillment_id_from_order,
+    andreani_tracking_url,
+    skipped_tracking_result,
+    tracking_result,
+)
+
+# Un AsyncClient por event loop: httpx ata el pool de conexiones al loop que lo creo
+_http_clients = {}
+# Syncs de la copia local en segundo plano (referencia para que no las junte el GC)
+_syncs_en_curso = set()
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """
+    AsyncClient con keep-alive compartido por todas las requests del worker
+    (mismo pool y limites que la Session del cliente sync).
+    """
+    loop = asyncio.get_running_loop()
+    client = _http_clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=HTTP_POOL_SIZE, max_keepalive_connections=HTTP_POOL_SIZE),
+            timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        )
+        _http_clients[loop] = client
+    return client
+
+
+async def close_async_http_client():
+    """Cierra el pool del loop actual (shutdown de la app)."""
+    client = _http_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+class AsyncTiendaNubeClient:
+    """
+    Cliente de la API de Tienda Nube para las rutas: mientras espera a la API el
+    worker sigue atendiendo otras requests. Las reglas de filtrado, parseo y armado
+    de resultados son helpers de tiendanube.py.
+    """
+
+    def __init__(self, store_id: str, access_token: str, rate_limiter: RateLimiter = None):
+        if not access_token:
+            raise ValueError("Missing access_token (None/empty). Reconnect and regenerate tokens.json.")
+
+        self.store_id = str(store_id)
+        self.access_token = str(access_token).strip()
+        self.base = f"https://api.tiendanube.com/v1/{self.store_id}"
+        self.headers = auth_headers(self.access_token)
+        self.rate_limiter = rate_limiter or get_rate_limiter(self.store_id)
+
+    async def _req(self, method: str, url: str, idempotente: bool = None, **kwargs) -> httpx.Response:
+        """Request con cuota y reintentos; `idempotente` (default: segun el metodo) habilita reintentar 5xx."""
+        if idempotente is None:
+            idempotente = method.upper() in IDEMPOTENT_METHODS
+        intento = 0
+        while True:
+            await self.rate_limiter.acquire_async()
+            r = await get_async_http_client().request(method, url, headers=self.headers, **kwargs)
+            self.rate_limiter.actualizar(r.headers)
+            espera = self.rate_limiter.espera_reintento(r.status_code, r.headers, intento, idempotente)
+            if espera is None:
+                return r
+            print(f"TiendaNube {method} {url} -> {r.status_code}, retry {intento + 1} in {espera:.2f}s")
+            await asyncio.sleep(espera)
+            intento += 1
+
+    async def lookup_real_order_id(self, order_number: int) -> int:
+        cached = order_id_cache.get_memoria(self.store_id, order_number)
+        if cached is None:
+            cached = await asyncio.to_thread(order_id_cache.get, self.store_id, order_number)
+        if cached is not None:
+            return cached
+
+        url = f"{self.base}/orders"
+        r = await self._req("GET", url, params={"q": str(order_number)})
+        real_id = real_id_from_lookup(r, order_number)
+        await asyncio.to_thread(order_id_cache.guardar, self.store_id, [(r.json()[0].get("number"), real_id)])
+        return real_id
+
+    async def get_order(self, real_order_id: int) -> dict:
+        url = f"{self.base}/orders/{real_order_id}"
+        r = await self._req("GET", url, params={"aggregates": "fulfillment_orders"})
+        return order_from_response(r)
+
+    async def _fetch_order_by_number(self, order_number) -> dict:
+        real_id = await self.lookup_real_order_id(order_number)
+        return await self.get_order(real_id)
+
+    async def get_orders_by_numbers(self, order_numbers: list, concurrency: int = FETCH_CONCURRENCY) -> list:
+        """
+        Lookup + GET de varias ordenes en paralelo (a lo sumo `concurrency` a la vez).
+        Devuelve una lista en el mismo orden que `order_numbers`, con un dict por orden:
+        {"number", "order"} si salio bien o {"number", "error"} si fallo.
+        """
+        semaforo = asyncio.Semaphore(max(1, concurrency))
+
+        async def fetch(num):
+            async with semaforo:
+                try:
+                    return {"number": num, "order": await self._fetch_order_by_number(num)}
+                except Exception as e:
+                    return {"number": num, "error": str(e)}
+
+        if not order_numbers:
+            return []
+        return list(await asyncio.gather(*(fetch(num) for num in order_numbers)))
+
+    async def iter_open_orders(self, per_page: int = BULK_PER_PAGE, max_pages: int = OPEN_ORDERS_MAX_PAGES,
+                               prefetch: bool = True, estricto: bool = False, **filtros):
+        """
+        Generador de paginas de /orders (por defecto status=open), una lista por pagina.
+        filtros: q, status, created_at_min, aggregates, ... (params de la API).
+        Al cortar por max_pages igual que el cliente sync (ver fin_de_paginado).
+        El prefetch es una task que pide la pagina siguiente; usar con
+        `async with aclosing(...)` para que se cancele al cortar.
+        """
+        url = f"{self.base}/orders"
+        params = orders_query(per_page=per_page, **filtros)
+
+        async def fetch(page):
+            data = parse_orders_page(await self._req("GET", url, params={**params, "page": page}), page)
+            # Cada pagina trae numero e id de cada orden: calienta el cache de lookups
+            await asyncio.to_thread(order_id_cache.guardar, self.store_id, [(o.get("number"), o.get("id")) for o in data])
+            return data
+
+        siguiente = asyncio.ensure_future(fetch(1)) if prefetch else None
+        try:
+            page = 1
+            while True:
+                data = await siguiente if prefetch else await fetch(page)
+                if es_ultima_pagina(data, page, per_page, max_pages):
+                    if data:
+                        yield data
+                    fin_de_paginado(data, page, per_page, max_pages, estricto)
+                    return
+                if prefetch:
+                    siguiente = asyncio.ensure_future(fetch(page + 1))
+                yield data
+                page += 1
+        finally:
+            if siguiente is not None and not siguiente.done():
+                siguiente.cancel()
+
+    async def get_orders_bulk(self, order_numbers: list, status: str = "open", created_at_min: str = None,
+                              max_pages: int = BULK_MAX_PAGES, concurrency: int = FETCH_CONCURRENCY) -> list:
+        """
+        Igual que get_orders_by_numbers pero recorriendo /orders de a BULK_PER_PAGE:
+        N ordenes cuestan ~N/200 requests. Lo que no aparece en las primeras `max_pages`
+        paginas (o con `created_at_min`, en esa ventana) se trae con lookup + GET.
+        """
+        pendientes = pendientes_por_numero(order_numbers)
+        encontradas = {}
+
+        paginas = 0
+        if pendientes:
+            try:
+                async with aclosing(self.iter_open_orders(max_pages=max_pages, status=status, created_at_min=created_at_min,
+                                                          aggregates="fulfillment_orders")) as pages:
+                    async for data in pages:
+                        paginas += 1
+                        pick_orders(data, pendientes, encontradas)
+                        if not pendientes:
+                            break
+            except Exception as e:
+                print(f"Bulk orders paging failed: {e}")
+
+        faltantes = [num for num in order_numbers if num not in encontradas]
+        individuales = await self.get_orders_by_numbers(faltantes, concurrency=concurrency) if faltantes else []
+        print(f"Bulk fetch: {len(encontradas)} from {paginas} page(s), {len(faltantes)} individual")
+        return merge_bulk_results(order_numbers, encontradas, individuales)
+
+    async def patch_fulfillment_tracking(self, real_order_id: int, fulfillment_id: str, tracking_code: str, tracking_url: str | None):
+        endpoint = f"{self.base}/orders/{real_order_id}/fulfillment-orders/{fulfillment_id}"
+        r = await self._req("PATCH", endpoint, json=tracking_patch_payload(tracking_code, tracking_url))
+        await asyncio.to_thread(despues_de_patch, self.store_id, r.status_code)
+        return endpoint, r.status_code, r.text
+
+    async def sync_order_mirror(self, force: bool = False) -> bool:
+        """
+        Trae a la copia local (order_mirror) las ordenes modificadas desde el ultimo cursor;
+        la primera vez, todas las abiertas. No hace nada si se sincronizo hace menos de
+        ORDER_SYNC_INTERVAL o si otra request ya esta sincronizando esta tienda.
+        La base se toca desde un thread.
+        """
+        if not await asyncio.to_thread(order_mirror.reservar_sync, self.store_id, force):
+            return False
+        ok = False
+        try:
+            estado = await asyncio.to_thread(order_mirror.estado_sync, self.store_id)
+            cursor = estado["cursor"] if estado else None
+            # Si queda cortado no se registra: el cursor no avanza y el proximo sync repite desde el anterior
+            async with aclosing(self.iter_open_orders(max_pages=order_mirror.ORDER_SYNC_MAX_PAGES, estricto=True,
+                                                      **order_mirror.sync_filtros(estado))) as pages:
+                async for data in pages:
+                    cursor = order_mirror.cursor_mayor(cursor, await asyncio.to_thread(order_mirror.guardar_ordenes, self.store_id, data))
+            await asyncio.to_thread(order_mirror.registrar_sync, self.store_id, cursor)
+            ok = True
+        finally:
+            await asyncio.to_thread(order_mirror.liberar_sync, self.store_id, ok)
+        return ok
+
+    async def _sync_en_fondo(self):
+        try:
+            await self.sync_order_mirror()
+        except Exception as e:
+            print(f"Order mirror sync failed for store {self.store_id}: {e}")
+
+    def programar_sync(self):
+        """Lanza sync_order_mirror como task del loop; la request que la dispara no la espera."""
+        task = asyncio.create_task(self._sync_en_fondo())
+        _syncs_en_curso.add(task)
+        task.add_done_callback(_syncs_en_curso.discard)
+
+    async def _mirror_listo(self) -> bool:
+        """True si la lectura puede salir de la copia local (sincronizada y sin cambios propios pendientes)."""
+        if not order_mirror.ORDER_MIRROR_ENABLED:
+            return False
+        # reservar_sync decide si toca (intervalo, backoff por fallo, otro sync en curso)
+        self.programar_sync()
+        try:
+            return order_mirror.copia_lista(await asyncio.to_thread(order_mirror.estado_sync, self.store_id))
+        except Exception as e:
+            print(f"Order mirror unavailable: {e}")
+            return False
+
+    async def _pagina_mirror(self, page, per_page, payment_statuses, stage) -> dict:
+        data, has_more = await asyncio.to_thread(order_mirror.ready_order_payloads, self.store_id, page, per_page, payment_statuses, stage)
+        listado = filter_orders_ready(data, payment_statuses=payment_statuses, stage=stage)
+        return pagina_listas(listado["results"], listado["debug"], page, per_page, has_more)
+
+    async def list_orders_ready(self, page: int = 1, per_page: int = 50, q: str = None, payment_statuses: list = None, stage: str = None, debug: bool = False) -> dict:
+        """
+        Una pagina de ordenes listas. `page`/`per_page` cuentan ordenes listas (no paginas
+        de /orders); has_more indica si hay pagina siguiente.
+        """
+        if not q and not debug and await self._mirror_listo():
+            return await self._pagina_mirror(page, per_page, payment_statuses, stage)
+
+        if debug:
+            print(f"DEBUG: Requesting orders {self.base}/orders page={page} per_page={per_page} q={q} stage={stage}")
+
+        collector = ReadyOrdersCollector(page, per_page, payment_statuses, stage, debug)
+        async with aclosing(self.iter_open_orders(q=str(q) if q else None)) as pages:
+            async for data in pages:
+                if collector.agregar(data):
+                    break
+        return collector.resultado()
+
+    async def list_orders_with_stats(self, page: int = 1, per_page: int = 50, q: str = None, payment_statuses: list = None, stage: str = None, debug: bool = False) -> dict:
+        """
+        list_orders_ready + contadores por etapa en una sola pasada: cada pagina de /orders
+        se baja y se clasifica una vez (sin corte temprano, los contadores necesitan todas).
+        Con copia local son dos consultas a la base. Con `q`, los contadores son de la busqueda.
+        """
+        if not q and not debug and await self._mirror_listo():
+            listado = await self._pagina_mirror(page, per_page, payment_statuses, stage)
+            listado["stats"] = await asyncio.to_thread(order_mirror.order_stats, self.store_id, payment_statuses)
+            return listado
+
+        collector = ReadyOrdersCollector(page, per_page, payment_statuses, stage, debug)
+        async with aclosing(self.iter_open_orders(q=str(q) if q else None)) as pages:
+            async for data in pages:
+                collector.agregar(data)
+        return {**collector.resultado(), "stats": collector.stats}
+
+    async def get_order_stats(self) -> dict:
+        if await self._mirror_listo():
+            return await asyncio.to_thread(order_mirror.order_stats, self.store_id)
+
+        stats = {"unpacked": 0, "packed": 0}
+        try:
+            async with aclosing(self.iter_open_orders()) as pages:
+                async for data in pages:
+                    stats = sumar_stats(stats, data)
+        except Exception as e:
+            print(f"Stats paging failed: {e}")
+            return {"unpacked": 0, "packed": 0}
+        return stats
+
+    async def send_tracking_for_order_number(self, order_number: int, tracking_code: str, tracking_url: str | None = None) -> dict:
+        real_id = await self.lookup_real_order_id(order_number)
+        order = await self.get_order(real_id)
+        fulfillment_id = fulfillment_id_from_order(order, order_number, real_id)
+        endpoint, status, body = await self.patch_fulfillment_tracking(real_id, fulfillment_id, tracking_code, tracking_url)
+
+        return {
+            "order_number": order_number,
+            "real_order_id": real_id,
+            "fulfillment_id": fulfillment_id,
+            "endpoint": endpoint,
+            "http_status": status,
+            "body": body
+        }
+
+    async def _tracking_row_result(self, order_number, track_code) -> dict:
+        if track_code is None:
+            return skipped_tracking_result(order_number)
+        try:
+            track_url = andreani_tracking_url(track_code)
+            result_data = await self.send_tracking_for_order_number(order_number, track_code, track_url)
+            return tracking_result(order_number, result_data)
+        except Exception as e:
+            return {"order": order_number, "status": "EXCEPTION", "details": str(e)}
+
+    async def process_tracking_file(self, rows: list, workers: int = TRACKING_CONCURRENCY):
+        """Carga los trackings de `rows` ((order_number, track_code), ver tracking_file.leer_archivo_tracking)."""
+        semaforo = asyncio.Semaphore(max(1, workers))
+
+        async def enviar(row):
+            async with semaforo:
+                return await self._tracking_row_result(*row)
+
+        results = await asyncio.gather(*(enviar(row) for row in rows))
+        return {"results": list(results)}
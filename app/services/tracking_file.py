@@ -0,0 +1,80 @@
+"""
+Lectura del archivo de codigos de seguimiento de /api/update-tracking (PDF de
+etiquetas Andreani, Excel o CSV). Queda aparte del cliente de Tienda Nube para
+que este no cargue pandas ni las librerias de PDF.
+"""
+import io
+
+import pandas as pd
+
+from app.services.pdf_processing import datos_etiquetas
+
+
+def extract_tracking_from_pdf(file_content):
+    """
+    Extracts (order_id, tracking_number) tuples from an Andreani PDF.
+    El texto de cada pagina sale del cache de etiquetas si el PDF ya se proceso.
+    """
+    results = []
+    try:
+        for datos in datos_etiquetas(file_content):
+            if datos["order"] and datos["track"]:
+                results.append({"order": datos["order"], "track": datos["track"]})
+
+    except Exception as e:
+        print(f"Error parsing PDF: {e}")
+        raise e
+
+    return pd.DataFrame(results)
+
+
+def load_tracking_dataframe(file_content):
+    """
+    Lee el archivo de tracking (PDF de etiquetas, Excel o CSV).
+    Devuelve (df con columnas 'order'/'track', None) o (None, mensaje de error).
+    """
+    # Determine file type
+    try:
+        if file_content.startswith(b"%PDF"):
+             df = extract_tracking_from_pdf(file_content)
+             if df.empty:
+                 return None, "No valid labels found in PDF. Could not identify 'Interno.'"
+        else:
+            try:
+                df = pd.read_excel(io.BytesIO(file_content))
+            except:
+                df = pd.read_csv(io.BytesIO(file_content), sep=None, engine='python')
+    except Exception as e:
+         return None, f"Could not read file: {str(e)}"
+
+    if not 'order' in df.columns:
+        df.columns = [str(c).lower().strip() for c in df.columns]
+        col_order = next((c for c in df.columns if "orden" in c or "numero" in c or "id" in c), None)
+        col_track = next((c for c in df.columns if "seguimiento" in c or "track" in c or "codigo" in c), None)
+
+        if not col_order or not col_track:
+            return None, "Could not identify columns."
+        df.rename(columns={col_order: "order", col_track: "track"}, inplace=True)
+
+    return df, None
+
+
+def tracking_rows(df):
+    """(order_number, track_code) por fila; track_code es None si la fila viene vacia."""
+    for _, row in df.iterrows():
+        order_number = str(row["order"]).strip()
+        if order_number.endswith(".0"): order_number = order_number[:-2]
+        track_code = str(row["track"]).strip()
+
+        if not order_number or not track_code or track_code.lower() == "nan":
+            yield order_number, None
+        else:
+            yield order_number, track_code
+
+
+def leer_archivo_tracking(file_content):
+    """(lista de (order_number, track_code), None) o (None, mensaje de error)."""
+    df, error = load_tracking_dataframe(file_content)
+    if error:
+        return None, error
+    return list(tracking_rows(df)), None
@@ -0,0 +1,173 @@
+"""
+Webhooks de ordenes de Tienda Nube -> copia local (order_mirror).
+
+La ruta solo verifica la firma y encola; un worker del event loop trae la orden
+actualizada y la guarda, asi /api/orders/ready y /api/orders/stats responden desde
+la base sin esperar a la proxima sincronizacion.
+
+La cola es en memoria: con la cola llena la ruta responde 503 y Tienda Nube
+reintenta, pero lo ya aceptado (200) y no procesado se pierde si el worker se
+reinicia. Esas ordenes las recupera la sincronizacion incremental de order_mirror
+(a lo sumo WEBHOOK_SYNC_INTERVAL despues).
+"""
+import os
+import hmac
+import json
+import asyncio
+import hashlib
+
+from sqlmodel import select, Session
+
+from app.database import engine
+from app.models import Store
+from app.services import order_mirror
+from app.services.response_cache import orders_cache
+from app.services.tiendanube import CLIENT_SECRET, TiendaNubeAuth, TiendaNubeAPIError, order_id_cache
+from app.services.tiendanube_async import AsyncTiendaNubeClient
+
+# Tienda Nube firma el body con el client secret de la app (HMAC-SHA256, hex)
+WEBHOOK_SECRET = os.getenv("TIENDANUBE_WEBHOOK_SECRET") or CLIENT_SECRET
+SIGNATURE_HEADER = "x-linkedstore-hmac-sha256"
+# URL publica de la ruta /webhooks/tiendanube; si esta, se registran los webhooks al conectar una tienda
+WEBHOOK_URL = os.getenv("TIENDANUBE_WEBHOOK_URL")
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "2"))
+
+ORDER_EVENTS = [
+    "order/created",
+    "order/updated",
+    "order/paid",
+    "order/packed",
+    "order/fulfilled",
+    "order/cancelled",
+]
+
+
+def firmar(body: bytes, secret: str = None) -> str:
+    return hmac.new((secret or WEBHOOK_SECRET or "").encode("utf-8"), body, hashlib.sha256).hexdigest()
+
+
+def verificar_firma(body: bytes, firma: str, secret: str = None) -> bool:
+    if not firma or not (secret or WEBHOOK_SECRET):
+        return False
+    return hmac.compare_digest(firmar(body, secret), firma.strip().lower())
+
+
+def _access_token_tienda(tn_store_id):
+    with Session(engine) as session:
+        store = session.exec(select(Store).where(Store.tiendanube_user_id == int(tn_store_id))).first()
+        store_id = store.id if store else None
+    token_data = TiendaNubeAuth.get_valid_token(store_id) if store_id else None
+    return token_data.get("access_token") if token_data else None
+
+
+async def procesar_evento_orden(evento: dict):
+    """Trae la orden del evento y la deja al dia en la copia local."""
+    tn_store_id = evento["store_id"]
+    real_id = int(evento["id"])
+    access_token = await asyncio.to_thread(_access_token_tienda, tn_store_id)
+    if not access_token:
+        print(f"Webhook {evento.get('event')} for unknown store {tn_store_id}, ignored")
+        return
+
+    client = AsyncTiendaNubeClient(tn_store_id, access_token)
+    try:
+        order = await client.get_order(real_id)
+    except TiendaNubeAPIError as e:
+        if e.status_code != 404:
+            raise
+        # Borrada: se saca del espejo como si se hubiera cerrado
+        order = {"id": real_id, "status": "deleted"}
+    await asyncio.to_thread(order_mirror.guardar_ordenes, tn_store_id, [order])
+    if order.get("number"):
+        await asyncio.to_thread(order_id_cache.guardar, tn_store_id, [(order.get("number"), real_id)])
+    await asyncio.to_thread(order_mirror.registrar_webhook, tn_store_id)
+    orders_cache.invalidar(tn_store_id)
+
+
+class WebhookQueue:
+    """
+    Cola interna entre la ruta y los workers. `procesador` es la corutina que aplica
+    cada evento (por defecto procesar_evento_orden; se puede reemplazar para probar
+    con un doble local).
+    """
+
+    def __init__(self, procesador=procesar_evento_orden, workers: int = WEBHOOK_WORKERS, maxsize: int = WEBHOOK_QUEUE_SIZE):
+        self.procesador = procesador
+        self.workers = workers
+        self.maxsize = maxsize
+        self.queue = None
+        self.tasks = []
+        self.recibidos = 0
+        self.procesados = 0
+        self.errores = 0
+        self.descartados = 0
+
+    def _corriendo(self) -> bool:
+        return bool(self.tasks) and not all(t.done() for t in self.tasks)
+
+    def start(self):
+        if self._corriendo():
+            return
+        self.queue = asyncio.Queue(maxsize=self.maxsize)
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(max(1, self.workers))]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def encolar(self, evento: dict) -> bool:
+        """False si la cola esta llena: la ruta responde 503 para que Tienda Nube lo reintente."""
+        self.start()
+        self.recibidos += 1
+        try:
+            self.queue.put_nowait(evento)
+            return True
+        except asyncio.QueueFull:
+            self.descartados += 1
+            print(f"Webhook queue full, dropped {evento.get('event')} {evento.get('id')}")
+            return False
+
+    async def join(self):
+        """Espera a que se procese todo lo encolado."""
+        if self.queue is not None:
+            await self.queue.join()
+
+    async def _worker(self):
+        while True:
+            evento = await self.queue.get()
+            try:
+                await self.procesador(evento)
+                self.procesados += 1
+            except Exception as e:
+                self.errores += 1
+                print(f"Webhook {evento.get('event')} {evento.get('id')} failed: {e}")
+            finally:
+                self.queue.task_done()
+
+    def estadisticas(self) -> dict:
+        return {
+            "pendientes": self.queue.qsize() if self.queue is not None else 0,
+            "recibidos": self.recibidos,
+            "procesados": self.procesados,
+            "errores": self.errores,
+            "descartados": self.descartados,
+        }
+
+
+webhook_queue = WebhookQueue()
+
+
+def parse_evento(body: bytes):
+    """Evento de orden valido o None (JSON roto, evento que no es de ordenes, faltan datos)."""
+    try:
+        evento = json.loads(body)
+    except ValueError:
+        return None
+    if not isinstance(evento, dict) or evento.get("event") not in ORDER_EVENTS:
+        return None
+    if not evento.get("store_id") or not evento.get("id"):
+        return None
+    return evento
@@ -40,10 +40,17 @@ document.addEventListener('DOMContentLoaded', () => {
         // Switch to loading state
         uploadStep.innerHTML = '<div style="text-align:center; padding: 2rem; color: #666;"><i class="fas fa-spinner fa-spin fa-2x"></i><p style="margin-top:1rem; font-weight:600;">Cargando lote de pedidos...</p></div>';
 
-        fetch(`/api/batch/${batchId}`)
-            .then(res => res.json())
-            .then(data => {
-                if (data.error) throw new Error(data.error);
+        // El lote se procesa en segundo plano: se consulta hasta que termine
+        const loadingText = uploadStep.querySelector('p');
+        const pollBatch = () => fetch(`/api/batch/${batchId}`)
+            .then(async res => {
+                const data = await res.json();
+                if (res.status === 202) {
+                    loadingText.textContent = `${data.etapa || 'Procesando lote'}... ${data.progress || 0}%`;
+                    setTimeout(pollBatch, 1000);
+                    return;
+                }
+                if (!res.ok || data.error) throw new Error(data.error || "Error procesando lote");
 
                 // Success: Load Data
                 currentData = data.records;
@@ -61,6 +68,7 @@ document.addEventListener('DOMContentLoaded', () => {
                 // Reload to reset UI or show upload again
                 window.location.href = "/excel";
             });
+        pollBatch();
     }
 
     let stagedFile = null;
@@ -370,11 +378,12 @@ document.addEventListener('DOMContentLoaded', () => {
                 throw new Error('Failed to generate excel');
             })
             .then(blob => {
-                // Download file
+                // Download file (big batches may come back as a zip of several xlsx)
+                const isZip = blob.type === 'application/zip';
                 const url = window.URL.createObjectURL(blob);
                 const a = document.createElement('a');
                 a.href = url;
-                a.download = "EnvioMasivoExcelPaquetes_cargado.xlsx";
+                a.download = isZip ? "EnvioMasivoExcelPaquetes_cargado.zip" : "EnvioMasivoExcelPaquetes_cargado.xlsx";
                 document.body.appendChild(a);
                 a.click();
                 a.remove();
@@ -0,0 +1,58 @@
+"""
+Reenvia webhooks de ordenes grabados a una instancia local, firmados como Tienda Nube.
+
+    python scripts/replay_webhooks.py                       # ejemplos de abajo contra localhost:8000
+    python scripts/replay_webhooks.py grabados.json --url http://localhost:8000/webhooks/tiendanube
+
+El archivo es una lista JSON de payloads tal cual llegan ({"store_id", "event", "id"}).
+La firma usa TIENDANUBE_WEBHOOK_SECRET o CLIENT_SECRET, igual que el servidor.
+"""
+import os
+import sys
+import json
+import argparse
+
+import requests
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.services.webhooks import firmar, SIGNATURE_HEADER  # noqa: E402
+
+load_dotenv()
+
+EJEMPLOS = [
+    {"store_id": 123456, "event": "order/created", "id": 1001},
+    {"store_id": 123456, "event": "order/paid", "id": 1001},
+    {"store_id": 123456, "event": "order/packed", "id": 1001},
+    {"store_id": 123456, "event": "order/fulfilled", "id": 1001},
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("archivo", nargs="?", help="JSON con la lista de payloads grabados")
+    parser.add_argument("--url", default="http://localhost:8000/webhooks/tiendanube")
+    parser.add_argument("--secret", default=None, help="Secreto para firmar (por defecto el del .env)")
+    parser.add_argument("--store-id", type=int, default=None, help="Reemplaza store_id en todos los payloads")
+    args = parser.parse_args()
+
+    payloads = EJEMPLOS
+    if args.archivo:
+        with open(args.archivo, encoding="utf-8") as f:
+            payloads = json.load(f)
+
+    for payload in payloads:
+        if args.store_id:
+            payload = {**payload, "store_id": args.store_id}
+        body = json.dumps(payload).encode("utf-8")
+        r = requests.post(
+            args.url,
+            data=body,
+            headers={"Content-Type": "application/json", SIGNATURE_HEADER: firmar(body, args.secret)},
+            timeout=10,
+        )
+        print(f"{payload.get('event')} {payload.get('id')} -> {r.status_code} {r.text}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import os
+import re
+import threading
+
+# Antes de importar app.*: app.database arma el engine al importarse
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import httpx
+import pytest
+from sqlalchemy.pool import StaticPool
+from sqlmodel import SQLModel, create_engine
+
+import app.models  # noqa: F401  (registra las tablas en SQLModel.metadata)
+from app.services import tiendanube, tiendanube_async, order_mirror, batch_jobs
+from app.services.response_cache import ResponseCache
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """SQLite en memoria con todas las tablas, en lugar del engine de app.database."""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    SQLModel.metadata.create_all(engine)
+    for modulo in (tiendanube, order_mirror, batch_jobs):
+        monkeypatch.setattr(modulo, "engine", engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def caches(monkeypatch):
+    """Caches de proceso vacios (numero -> id y respuestas), para que no se filtren entre tests."""
+    ids = tiendanube.OrderIdCache()
+    respuestas = ResponseCache()
+    monkeypatch.setattr(tiendanube, "order_id_cache", ids)
+    monkeypatch.setattr(tiendanube_async, "order_id_cache", ids)
+    monkeypatch.setattr(tiendanube, "orders_cache", respuestas)
+    return ids, respuestas
+
+
+class FakeTiendaNube:
+    """
+    API de Tienda Nube en memoria: /orders (paginado o ?q=), /orders/{id} y el PATCH
+    de fulfillment-orders. `calls` registra (metodo, path, params) de cada request;
+    `patch_status` es el status que devuelven los PATCH.
+    """
+
+    def __init__(self, orders=()):
+        self.orders = list(orders)
+        self.calls = []
+        self.patch_status = 200
+        self.lock = threading.Lock()
+
+    def _orden(self, real_id):
+        return next((o for o in self.orders if o["id"] == real_id), None)
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        params = dict(request.url.params)
+        with self.lock:
+            self.calls.append((request.method, request.url.path, params))
+        path = request.url.path
+        if request.method == "PATCH":
+            return httpx.Response(self.patch_status, json={"ok": self.patch_status < 300})
+        m = re.search(r"/orders/(\d+)$", path)
+        if m:
+            order = self._orden(int(m.group(1)))
+            return httpx.Response(200, json=order) if order else httpx.Response(404, json={"code": 404})
+        if path.endswith("/orders"):
+            if "q" in params:
+                encontradas = [o for o in self.orders if str(o["number"]) == params["q"]]
+                return httpx.Response(200, json=encontradas) if encontradas else httpx.Response(404, json=[])
+            lista = [o for o in self.orders if params.get("status") in ("any", o.get("status"))]
+            if "updated_at_min" in params:
+                lista = [o for o in lista if o["updated_at"] >= params["updated_at_min"]]
+            per_page, page = int(params["per_page"]), int(params["page"])
+            pagina = lista[(page - 1) * per_page:page * per_page]
+            return httpx.Response(200, json=pagina) if pagina else httpx.Response(404, json=[])
+        return httpx.Response(404, json={})
+
+    def rutas(self, metodo: str = None):
+        return [(m, p) for m, p, _ in self.calls if metodo is None or m == metodo]
+
+
+class FakeSession:
+    """Lo que usa TiendaNubeClient de requests.Session, respondido por un handler de httpx."""
+
+    def __init__(self, handler):
+        self.handler = handler
+
+    def request(self, method, url, headers=None, params=None, json=None, timeout=None):
+        return self.handler(httpx.Request(method, url, headers=headers, params=params, json=json))
+
+
+def mock_http(monkeypatch, handler):
+    """Conecta los dos clientes (sync y async) a `handler(httpx.Request) -> httpx.Response`."""
+    monkeypatch.setattr(tiendanube, "get_http_session", lambda: FakeSession(handler))
+    monkeypatch.setattr(
+        tiendanube_async, "get_async_http_client",
+        lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+    )
+
+
+def orden(numero, status="open", payment_status="paid", fulfillment="unpacked", updated_at="2026-10-01T10:00:00+0000"):
+    """Orden con la forma que devuelve /orders."""
+    return {
+        "id": 1000 + numero,
+        "number": numero,
+        "status": status,
+        "payment_status": payment_status,
+        "shipping_status": "unpacked",
+        "fulfillments": [{"id": f"ff-{numero}", "status": fulfillment}],
+        "products": [],
+        "updated_at": updated_at,
+    }
+
+
+@pytest.fixture
+def api(monkeypatch):
+    fake = FakeTiendaNube()
+    mock_http(monkeypatch, fake.handler)
+    return fake
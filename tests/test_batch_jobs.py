@@ -0,0 +1,146 @@
+import asyncio
+import socket
+from datetime import datetime, timedelta
+
+from sqlmodel import Session
+
+from app.models import BatchJob
+from app.services import batch_jobs
+from app.services.batch_jobs import BatchJobQueue, ERROR_INTERRUMPIDO
+
+STORE = 1
+
+
+def _correr(*trabajos, workers=1, maxsize=10):
+    """Crea un job por trabajo, los encola y espera a la cola; devuelve (ids, encolados, cola)."""
+    cola = BatchJobQueue(workers=workers, maxsize=maxsize)
+    ids = [batch_jobs.crear_job(STORE) for _ in trabajos]
+
+    async def escenario():
+        encolados = [await cola.encolar(job_id, trabajo) for job_id, trabajo in zip(ids, trabajos)]
+        await cola.join()
+        await cola.stop()
+        return encolados
+
+    return ids, asyncio.run(escenario()), cola
+
+
+def _atrasar(db, job_id, segundos, **campos):
+    with Session(db) as session:
+        job = session.get(BatchJob, job_id)
+        job.updated_at = datetime.utcnow() - timedelta(seconds=segundos)
+        for campo, valor in campos.items():
+            setattr(job, campo, valor)
+        session.add(job)
+        session.commit()
+
+
+def test_new_job_is_queued_and_owned_by_this_process(db):
+    job_id = batch_jobs.crear_job(STORE)
+
+    job = batch_jobs.obtener_job(job_id, STORE)
+    assert (job["status"], job["progress"]) == ("queued", 0)
+    with Session(db) as session:
+        assert session.get(BatchJob, job_id).owner == batch_jobs._owner()
+
+
+def test_job_runs_to_done_with_progress_and_result(db):
+    async def trabajo(avance):
+        await avance(50, "A mitad")
+        return {"filas": 3}
+
+    (job_id,), encolados, cola = _correr(trabajo)
+
+    assert encolados == [True]
+    job = batch_jobs.obtener_job(job_id, STORE)
+    assert (job["status"], job["progress"], job["etapa"]) == ("done", 100, "Listo")
+    assert batch_jobs.resultado_job(job_id, STORE) == {"filas": 3}
+    assert cola.estadisticas()["terminados"] == 1
+
+
+def test_jobs_are_scoped_to_their_store(db):
+    job_id = batch_jobs.crear_job(STORE)
+
+    assert batch_jobs.obtener_job(job_id, STORE + 1) is None
+    assert batch_jobs.resultado_job(job_id, STORE + 1) is None
+
+
+def test_error_result_and_exceptions_leave_the_job_in_error(db):
+    async def con_error(avance):
+        return {"error": "CSV invalido"}
+
+    async def explota(avance):
+        raise ValueError("boom")
+
+    ids, _, cola = _correr(con_error, explota)
+
+    errores = [batch_jobs.obtener_job(job_id, STORE)["error"] for job_id in ids]
+    assert errores == ["CSV invalido", "boom"]
+    assert batch_jobs.resultado_job(ids[0], STORE) is None
+    assert cola.estadisticas()["errores"] == 2
+
+
+def test_full_queue_rejects_and_marks_the_job(db):
+    async def trabajo(avance):
+        return {}
+
+    # El worker no llega a sacar el primero antes de encolar el segundo
+    ids, encolados, cola = _correr(trabajo, trabajo, maxsize=1)
+
+    assert encolados == [True, False]
+    assert batch_jobs.obtener_job(ids[1], STORE)["status"] == "error"
+    assert cola.estadisticas()["rechazados"] == 1
+
+
+def test_startup_closes_jobs_of_dead_local_processes_only(db):
+    host = socket.gethostname()
+    sin_owner, muerto, remoto, vivo = (batch_jobs.crear_job(STORE) for _ in range(4))
+    with Session(db) as session:
+        for job_id, owner in [
+            (sin_owner, None),
+            (muerto, f"{host}:999999999"),
+            (remoto, "otra-maquina:1"),
+            (vivo, f"{host}:1"),  # pid 1 siempre existe
+        ]:
+            job = session.get(BatchJob, job_id)
+            job.owner = owner
+            session.add(job)
+        session.commit()
+
+    assert batch_jobs.marcar_interrumpidos() == 2
+
+    estados = [batch_jobs.obtener_job(j, STORE)["status"] for j in (sin_owner, muerto, remoto, vivo)]
+    assert estados == ["error", "error", "queued", "queued"]
+    assert batch_jobs.obtener_job(muerto, STORE)["error"] == ERROR_INTERRUMPIDO
+
+
+def test_stale_job_reads_as_error_until_the_sweep_closes_it(db):
+    colgado = batch_jobs.crear_job(STORE)
+    terminado = batch_jobs.crear_job(STORE)
+    _atrasar(db, colgado, batch_jobs.BATCH_JOB_STALE + 1, status="running", owner="otra-maquina:1")
+    _atrasar(db, terminado, batch_jobs.BATCH_JOB_STALE + 1, status="done")
+
+    job = batch_jobs.obtener_job(colgado, STORE)
+    assert (job["status"], job["error"]) == ("error", ERROR_INTERRUMPIDO)
+    with Session(db) as session:
+        # Consultar no escribe
+        assert session.get(BatchJob, colgado).status == "running"
+
+    assert batch_jobs.cerrar_colgados() == 1
+    with Session(db) as session:
+        assert session.get(BatchJob, colgado).status == "error"
+        assert session.get(BatchJob, terminado).status == "done"
+
+
+def test_expired_jobs_disappear_and_are_purged(db):
+    job_id = batch_jobs.crear_job(STORE)
+    with Session(db) as session:
+        job = session.get(BatchJob, job_id)
+        job.expires_at = datetime.utcnow() - timedelta(seconds=1)
+        session.add(job)
+        session.commit()
+
+    assert batch_jobs.obtener_job(job_id, STORE) is None
+    batch_jobs.crear_job(STORE)
+    with Session(db) as session:
+        assert session.get(BatchJob, job_id) is None
@@ -0,0 +1,80 @@
+import os
+
+from app.services.label_cache import LABEL_CACHE_VERSION, LabelCache
+
+PAGINAS = [{"interno": "123", "orden": 45, "tracking": "360000111", "ancho": 288.0, "alto": 432.0}]
+
+
+def _tamano(tmp_path):
+    """Bytes que ocupa en disco una entrada con PAGINAS."""
+    cache = LabelCache(directorio=str(tmp_path / "medir"), max_bytes=10**9)
+    cache.guardar("x", PAGINAS)
+    return cache.estadisticas()["bytes"]
+
+
+def test_roundtrip_and_miss(tmp_path):
+    cache = LabelCache(directorio=str(tmp_path), max_bytes=10**6)
+    clave = LabelCache.clave(b"%PDF-1.4 etiqueta")
+
+    assert cache.get(clave) is None
+    cache.guardar(clave, PAGINAS)
+
+    assert cache.get(clave) == PAGINAS
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_file_name_carries_the_format_version(tmp_path):
+    cache = LabelCache(directorio=str(tmp_path), max_bytes=10**6)
+
+    cache.guardar("abc", PAGINAS)
+
+    assert os.listdir(tmp_path) == [f"abc.v{LABEL_CACHE_VERSION}.json"]
+
+
+def test_disabled_cache_neither_reads_nor_writes(tmp_path):
+    LabelCache(directorio=str(tmp_path), max_bytes=10**6).guardar("abc", PAGINAS)
+    cache = LabelCache(directorio=str(tmp_path), max_bytes=10**6, enabled=False)
+
+    assert cache.get("abc") is None
+    cache.guardar("def", PAGINAS)
+
+    assert len(os.listdir(tmp_path)) == 1
+    assert (cache.hits, cache.misses) == (0, 0)
+
+
+def test_corrupt_entry_is_a_miss(tmp_path):
+    cache = LabelCache(directorio=str(tmp_path), max_bytes=10**6)
+    cache.guardar("abc", PAGINAS)
+    with open(cache._ruta("abc"), "w", encoding="utf-8") as f:
+        f.write("{a medias")
+
+    assert cache.get("abc") is None
+
+
+def test_eviction_drops_least_recently_used_first(tmp_path):
+    directorio = tmp_path / "cache"
+    cache = LabelCache(directorio=str(directorio), max_bytes=int(_tamano(tmp_path) * 2.5))
+    cache.guardar("a", PAGINAS)
+    cache.guardar("b", PAGINAS)
+    os.utime(cache._ruta("a"), (100, 100))
+    os.utime(cache._ruta("b"), (200, 200))
+
+    cache.get("a")  # "a" pasa a ser la mas reciente
+    cache.guardar("c", PAGINAS)
+
+    assert sorted(os.listdir(directorio)) == [f"{c}.v{LABEL_CACHE_VERSION}.json" for c in ("a", "c")]
+
+
+def test_stats_report_files_and_bytes(tmp_path):
+    tamano = _tamano(tmp_path)
+    cache = LabelCache(directorio=str(tmp_path / "cache"), max_bytes=10**6)
+    assert cache.estadisticas()["archivos"] == 0
+
+    cache.guardar("a", PAGINAS)
+    cache.guardar("b", PAGINAS)
+    cache.get("a")
+    cache.get("z")
+
+    stats = cache.estadisticas()
+    assert (stats["archivos"], stats["bytes"]) == (2, 2 * tamano)
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 0.5)
@@ -0,0 +1,85 @@
+import asyncio
+
+from sqlmodel import Session, select
+
+from app.models import OrderIdMapping
+from app.services import tiendanube
+from app.services.tiendanube import OrderIdCache, RateLimiter, TiendaNubeClient
+from app.services.tiendanube_async import AsyncTiendaNubeClient
+
+from conftest import orden
+
+
+def test_lru_evicts_least_recently_used(db):
+    cache = OrderIdCache(maxsize=2)
+    cache.guardar(1, [(10, 110), (11, 111)])
+
+    cache.get_memoria(1, 10)  # 10 pasa a ser la mas reciente
+    cache.guardar(1, [(12, 112)])
+
+    assert cache.get_memoria(1, 11) is None
+    assert cache.get_memoria(1, 10) == 110
+    assert cache.get_memoria(1, 12) == 112
+
+
+def test_evicted_entry_comes_back_from_the_database(db):
+    cache = OrderIdCache(maxsize=1)
+    cache.guardar(1, [(10, 110)])
+    cache.guardar(1, [(11, 111)])
+
+    assert cache.get_memoria(1, 10) is None
+    assert cache.get(1, "#10") == 110
+    assert cache.get_memoria(1, 10) == 110
+    assert cache.estadisticas()["db_hits"] == 1
+
+
+def test_entries_are_per_store_and_normalized(db):
+    cache = OrderIdCache()
+    cache.guardar(1, [("#10", 110), ("abc", 1), (11, None)])
+
+    assert cache.get(1, 10.0) == 110
+    assert cache.get(2, 10) is None
+    with Session(db) as session:
+        assert session.exec(select(OrderIdMapping.order_number)).all() == [10]
+
+
+def test_changed_id_overwrites_the_row(db):
+    cache = OrderIdCache()
+    cache.guardar(1, [(10, 110)])
+    cache.guardar(1, [(10, 999)])
+
+    assert OrderIdCache().get(1, 10) == 999
+
+
+def test_lookup_hits_the_api_once_per_order_number(db, caches, api):
+    api.orders = [orden(7)]
+    client = AsyncTiendaNubeClient(1, "token", rate_limiter=RateLimiter(rate=0))
+
+    async def dos_veces():
+        return [await client.lookup_real_order_id(7), await client.lookup_real_order_id("#7")]
+
+    assert asyncio.run(dos_veces()) == [1007, 1007]
+    assert len(api.calls) == 1
+
+
+def test_other_worker_reads_the_mapping_from_the_database(db, caches, api, monkeypatch):
+    api.orders = [orden(7)]
+    TiendaNubeClient(1, "token", rate_limiter=RateLimiter(rate=0)).lookup_real_order_id(7)
+
+    # Otro proceso: memoria vacia, misma base
+    monkeypatch.setattr(tiendanube, "order_id_cache", OrderIdCache())
+
+    assert TiendaNubeClient(1, "token", rate_limiter=RateLimiter(rate=0)).lookup_real_order_id(7) == 1007
+    assert len(api.calls) == 1
+
+
+def test_paging_orders_warms_the_cache(db, caches, api):
+    api.orders = [orden(n) for n in range(1, 6)]
+    client = AsyncTiendaNubeClient(1, "token", rate_limiter=RateLimiter(rate=0))
+
+    # debug: sin copia local, recorre /orders
+    asyncio.run(client.list_orders_ready(debug=True))
+    api.calls.clear()
+
+    assert asyncio.run(client.lookup_real_order_id(3)) == 1003
+    assert api.calls == []
@@ -0,0 +1,171 @@
+import asyncio
+from contextlib import aclosing
+from datetime import datetime, timedelta
+from functools import partial
+
+import pytest
+from sqlmodel import Session, select
+
+from app.models import OrderMirror
+from app.services import order_mirror
+from app.services.tiendanube import PaginadoTruncado, RateLimiter
+from app.services.tiendanube_async import AsyncTiendaNubeClient
+
+from conftest import orden
+
+STORE = 1
+
+
+def _client():
+    return AsyncTiendaNubeClient(STORE, "token", rate_limiter=RateLimiter(rate=0))
+
+
+def _sync(client=None, force=True):
+    return asyncio.run((client or _client()).sync_order_mirror(force=force))
+
+
+def _filas(db):
+    with Session(db) as session:
+        return {f.order_number: f for f in session.exec(select(OrderMirror))}
+
+
+def test_first_sync_loads_open_orders_and_sets_cursor(db, caches, api):
+    api.orders = [
+        orden(1, updated_at="2026-10-01T10:00:00+0000"),
+        orden(2, updated_at="2026-10-01T12:00:00+0000", fulfillment="packed"),
+        orden(3, status="closed", updated_at="2026-10-01T13:00:00+0000"),
+    ]
+
+    assert _sync() is True
+
+    assert {n: f.stage for n, f in _filas(db).items()} == {1: "unpacked", 2: "packed"}
+    estado = order_mirror.estado_sync(STORE)
+    assert estado["cursor"] == "2026-10-01T12:00:00+0000"
+    assert order_mirror.copia_lista(estado)
+    assert api.calls[0][2]["status"] == "open"
+
+
+def test_incremental_sync_asks_from_cursor_and_applies_changes(db, caches, api):
+    api.orders = [orden(1, updated_at="2026-10-01T10:00:00+0000"), orden(2, updated_at="2026-10-01T11:00:00+0000")]
+    _sync()
+    api.orders = [
+        orden(1, status="closed", updated_at="2026-10-02T09:00:00+0000"),
+        orden(2, fulfillment="packed", updated_at="2026-10-02T10:00:00+0000"),
+    ]
+    api.calls.clear()
+
+    _sync()
+
+    params = api.calls[0][2]
+    assert (params["status"], params["updated_at_min"]) == ("any", "2026-10-01T11:00:00+0000")
+    filas = _filas(db)
+    assert list(filas) == [2]
+    assert filas[2].stage == "packed"
+    assert order_mirror.estado_sync(STORE)["cursor"] == "2026-10-02T10:00:00+0000"
+
+
+def test_older_payload_does_not_overwrite_newer_row(db):
+    order_mirror.guardar_ordenes(STORE, [orden(1, fulfillment="packed", updated_at="2026-10-02T10:00:00+0000")])
+
+    order_mirror.guardar_ordenes(STORE, [orden(1, fulfillment="unpacked", updated_at="2026-10-01T10:00:00+0000")])
+    order_mirror.guardar_ordenes(STORE, [orden(1, status="closed", updated_at="2026-10-01T11:00:00+0000")])
+
+    fila = _filas(db)[1]
+    assert (fila.stage, fila.updated_at_tn) == ("packed", "2026-10-02T10:00:00+0000")
+
+
+def test_iterator_reports_truncation_only_when_strict(db, caches, api):
+    api.orders = [orden(n) for n in range(1, 6)]
+
+    async def paginas(estricto):
+        async with aclosing(_client().iter_open_orders(per_page=2, max_pages=2, estricto=estricto)) as pages:
+            return [len(page) async for page in pages]
+
+    assert asyncio.run(paginas(False)) == [2, 2]
+    with pytest.raises(PaginadoTruncado):
+        asyncio.run(paginas(True))
+
+
+def test_truncated_sync_does_not_register_or_move_cursor(db, caches, api, monkeypatch):
+    monkeypatch.setattr(order_mirror, "ORDER_SYNC_MAX_PAGES", 2)
+    api.orders = [orden(n, updated_at=f"2026-10-01T10:{n:02d}:00+0000") for n in range(1, 6)]
+    client = _client()
+    monkeypatch.setattr(client, "iter_open_orders", partial(client.iter_open_orders, per_page=2))
+
+    with pytest.raises(PaginadoTruncado):
+        _sync(client)
+
+    estado = order_mirror.estado_sync(STORE)
+    assert estado["cursor"] is None and estado["last_synced_at"] is None
+    assert estado["sync_failed_at"] is not None
+    assert not order_mirror.copia_lista(estado)
+
+
+def test_own_change_keeps_reads_off_the_mirror_until_a_later_sync(db, caches, api):
+    api.orders = [orden(1)]
+    _sync()
+
+    order_mirror.marcar_desactualizado(STORE)
+    assert not order_mirror.copia_lista(order_mirror.estado_sync(STORE))
+    # Aunque no haya pasado el intervalo, el cambio propio habilita el sync
+    assert order_mirror.reservar_sync(STORE)
+    order_mirror.registrar_sync(STORE, None)
+    order_mirror.liberar_sync(STORE, True)
+
+    assert order_mirror.copia_lista(order_mirror.estado_sync(STORE))
+
+
+def test_change_during_a_sync_survives_it(db):
+    assert order_mirror.reservar_sync(STORE)
+    order_mirror.marcar_desactualizado(STORE)  # llega mientras el sync corre
+    order_mirror.registrar_sync(STORE, None)
+    order_mirror.liberar_sync(STORE, True)
+
+    assert order_mirror.estado_sync(STORE)["dirty_at"] is not None
+
+
+def test_sync_claim_is_shared_through_the_database(db):
+    assert order_mirror.reservar_sync(STORE)
+    # Otro worker: ve el sync en curso en ordersyncstate
+    assert not order_mirror.reservar_sync(STORE, force=True)
+
+    order_mirror.liberar_sync(STORE, False)
+    assert not order_mirror.reservar_sync(STORE)  # backoff despues del fallo
+    assert order_mirror.reservar_sync(STORE, force=True)
+
+
+def test_abandoned_claim_expires_after_the_lease(db):
+    assert order_mirror.reservar_sync(STORE)
+    vencido = datetime.utcnow() - timedelta(seconds=order_mirror.ORDER_SYNC_LEASE + 1)
+    order_mirror._actualizar_estado(STORE, sync_started_at=vencido)
+
+    assert order_mirror.reservar_sync(STORE)
+
+
+def test_interval_between_syncs_and_webhook_spacing(db):
+    assert order_mirror.reservar_sync(STORE)
+    order_mirror.registrar_sync(STORE, None)
+    order_mirror.liberar_sync(STORE, True)
+
+    assert not order_mirror.reservar_sync(STORE)
+    order_mirror.registrar_webhook(STORE)
+    assert order_mirror.intervalo_sync(order_mirror.estado_sync(STORE)) == order_mirror.WEBHOOK_SYNC_INTERVAL
+
+
+def test_ready_orders_come_from_the_mirror_once_synced(db, caches, api):
+    api.orders = [orden(n, payment_status="paid" if n % 2 else "pending") for n in range(1, 8)]
+    client = _client()
+    _sync(client)
+    api.calls.clear()
+
+    async def leer():
+        listado = await client.list_orders_ready(page=1, per_page=2)
+        stats = await client.get_order_stats()
+        return listado, stats
+
+    listado, stats = asyncio.run(leer())
+
+    assert [o["number"] for o in listado["results"]] == [7, 5]
+    assert listado["has_more"] is True
+    assert stats == {"unpacked": 4, "packed": 0}
+    assert api.calls == []
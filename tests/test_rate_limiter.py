@@ -0,0 +1,137 @@
+import asyncio
+
+import httpx
+import pytest
+
+from app.services import tiendanube
+from app.services.tiendanube import MAX_RETRIES, RateLimiter, TiendaNubeClient
+from app.services.tiendanube_async import AsyncTiendaNubeClient
+
+from conftest import mock_http
+
+
+@pytest.fixture(autouse=True)
+def sin_backoff(monkeypatch):
+    # El jitter sale de random.uniform(0, base * 2**intento): con base 0 los reintentos no esperan
+    monkeypatch.setattr(tiendanube, "RETRY_BASE_DELAY", 0.0)
+
+
+def test_headers_resize_bucket_and_derive_rate():
+    limiter = RateLimiter(rate=2, burst=40)
+
+    limiter.actualizar({"x-rate-limit-limit": "80", "x-rate-limit-remaining": "5", "x-rate-limit-reset": "15000"})
+
+    assert limiter.capacity == 80
+    assert limiter.tokens <= 5
+    # 75 ocupados que se vacian en 15 s
+    assert limiter.rate == pytest.approx(5.0)
+
+
+def test_response_without_rate_headers_leaves_bucket_alone():
+    limiter = RateLimiter(rate=2, burst=40)
+
+    limiter.actualizar({"content-type": "application/json"})
+
+    assert (limiter.capacity, limiter.rate) == (40, 2)
+
+
+def test_empty_bucket_makes_callers_wait_their_turn():
+    limiter = RateLimiter(rate=10, burst=2)
+
+    esperas = [limiter._reservar() for _ in range(4)]
+
+    assert esperas[:2] == [0.0, 0.0]
+    assert esperas[2] == pytest.approx(0.1, abs=0.01)
+    assert esperas[3] == pytest.approx(0.2, abs=0.01)
+    assert limiter.estadisticas()["waits"] == 2
+
+
+def test_429_honours_retry_after_and_drains_bucket():
+    limiter = RateLimiter(rate=2, burst=40)
+
+    espera = limiter.espera_reintento(429, {"retry-after": "3"}, 0)
+
+    assert espera >= 3
+    assert limiter.tokens <= 0
+    assert limiter.estadisticas()["rate_limited"] == 1
+
+
+def test_retries_stop_after_max_retries():
+    limiter = RateLimiter(rate=0)
+
+    assert limiter.espera_reintento(503, {}, MAX_RETRIES - 1) is not None
+    assert limiter.espera_reintento(503, {}, MAX_RETRIES) is None
+    assert limiter.espera_reintento(404, {}, 0) is None
+
+
+@pytest.mark.parametrize("status, idempotente, reintenta", [
+    (429, True, True),
+    (429, False, True),  # la API no lo proceso: reintentar un PATCH no duplica nada
+    (503, True, True),
+    (503, False, False),  # pudo haberse aplicado
+])
+def test_retry_rule_by_status_and_idempotency(status, idempotente, reintenta):
+    espera = RateLimiter(rate=0).espera_reintento(status, {}, 0, idempotente)
+
+    assert (espera is not None) == reintenta
+
+
+def _secuencia(monkeypatch, statuses):
+    """Responde los status en orden (y 200 despues); devuelve la lista de metodos pedidos."""
+    pedidos = []
+    pendientes = list(statuses)
+
+    def handler(request):
+        pedidos.append(request.method)
+        status = pendientes.pop(0) if pendientes else 200
+        return httpx.Response(status, json={})
+
+    mock_http(monkeypatch, handler)
+    return pedidos
+
+
+def test_async_get_is_retried_on_5xx(monkeypatch):
+    pedidos = _secuencia(monkeypatch, [502, 503])
+    client = AsyncTiendaNubeClient(1, "token", rate_limiter=RateLimiter(rate=0))
+
+    r = asyncio.run(client._req("GET", f"{client.base}/orders"))
+
+    assert r.status_code == 200
+    assert pedidos == ["GET"] * 3
+
+
+def test_async_patch_is_not_retried_on_5xx(monkeypatch):
+    pedidos = _secuencia(monkeypatch, [503])
+    client = AsyncTiendaNubeClient(1, "token", rate_limiter=RateLimiter(rate=0))
+
+    r = asyncio.run(client._req("PATCH", f"{client.base}/orders/1/fulfillment-orders/f", json={}))
+
+    assert r.status_code == 503
+    assert pedidos == ["PATCH"]
+
+
+def test_async_patch_is_retried_on_429(monkeypatch):
+    pedidos = _secuencia(monkeypatch, [429])
+    client = AsyncTiendaNubeClient(1, "token", rate_limiter=RateLimiter(rate=0))
+
+    r = asyncio.run(client._req("PATCH", f"{client.base}/orders/1/fulfillment-orders/f", json={}))
+
+    assert r.status_code == 200
+    assert pedidos == ["PATCH", "PATCH"]
+
+
+def test_sync_client_applies_the_same_rule(monkeypatch):
+    pedidos = _secuencia(monkeypatch, [500, 500])
+    client = TiendaNubeClient(1, "token", rate_limiter=RateLimiter(rate=0))
+
+    assert client._req("POST", f"{client.base}/webhooks", json={}).status_code == 500
+    assert client._req("GET", f"{client.base}/webhooks").status_code == 200
+    assert pedidos == ["POST", "GET", "GET"]
+
+
+def test_explicit_idempotent_flag_allows_retrying_a_post(monkeypatch):
+    pedidos = _secuencia(monkeypatch, [500])
+    client = TiendaNubeClient(1, "token", rate_limiter=RateLimiter(rate=0))
+
+    assert client._req("POST", f"{client.base}/orders/search", idempotente=True, json={}).status_code == 200
+    assert pedidos == ["POST", "POST"]
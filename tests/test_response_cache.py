@@ -0,0 +1,150 @@
+import asyncio
+
+import pytest
+
+from app.services import tiendanube
+from app.services.response_cache import ResponseCache
+
+
+class Productor:
+    """Cuenta las llamadas; cada una tarda `demora` y devuelve el numero de llamada."""
+
+    def __init__(self, demora=0.01, error=None):
+        self.demora = demora
+        self.error = error
+        self.llamadas = 0
+
+    async def __call__(self):
+        self.llamadas += 1
+        numero = self.llamadas
+        await asyncio.sleep(self.demora)
+        if self.error:
+            raise self.error
+        return {"llamada": numero}
+
+
+def test_concurrent_identical_requests_share_one_call():
+    cache = ResponseCache(ttl=60)
+    productor = Productor()
+
+    async def cinco_a_la_vez():
+        return await asyncio.gather(*[cache.obtener(1, ("ready", 1), productor) for _ in range(5)])
+
+    valores = asyncio.run(cinco_a_la_vez())
+
+    assert productor.llamadas == 1
+    assert valores == [{"llamada": 1}] * 5
+    assert cache.estadisticas()["compartidas"] == 4
+
+
+def test_hit_within_ttl_and_miss_after_it():
+    cache = ResponseCache(ttl=0.05)
+    productor = Productor(demora=0)
+
+    async def leer_tres():
+        primero = await cache.obtener(1, ("stats",), productor)
+        segundo = await cache.obtener(1, ("stats",), productor)
+        await asyncio.sleep(0.06)
+        tercero = await cache.obtener(1, ("stats",), productor)
+        return primero, segundo, tercero
+
+    assert asyncio.run(leer_tres()) == ({"llamada": 1}, {"llamada": 1}, {"llamada": 2})
+
+
+def test_keys_are_per_store_and_per_params():
+    cache = ResponseCache(ttl=60)
+    productor = Productor(demora=0)
+
+    async def leer():
+        for store_id, clave in [(1, ("ready", 1)), (2, ("ready", 1)), (1, ("ready", 2)), (1, ("ready", 1))]:
+            await cache.obtener(store_id, clave, productor)
+
+    asyncio.run(leer())
+
+    assert productor.llamadas == 3
+
+
+def test_errors_reach_every_waiter_and_are_not_cached():
+    cache = ResponseCache(ttl=60)
+    productor = Productor(error=RuntimeError("api caida"))
+
+    async def tres_a_la_vez():
+        return await asyncio.gather(*[cache.obtener(1, ("ready",), productor) for _ in range(3)], return_exceptions=True)
+
+    errores = asyncio.run(tres_a_la_vez())
+
+    assert productor.llamadas == 1
+    assert all(isinstance(e, RuntimeError) for e in errores)
+    productor.error = None
+    assert asyncio.run(cache.obtener(1, ("ready",), productor)) == {"llamada": 2}
+
+
+def test_invalidar_drops_only_that_store():
+    cache = ResponseCache(ttl=60)
+    productor = Productor(demora=0)
+
+    async def escenario():
+        await cache.obtener(1, ("stats",), productor)
+        await cache.obtener(2, ("stats",), productor)
+        cache.invalidar(1)
+        return await cache.obtener(1, ("stats",), productor), await cache.obtener(2, ("stats",), productor)
+
+    assert asyncio.run(escenario()) == ({"llamada": 3}, {"llamada": 2})
+
+
+def test_value_computed_across_an_invalidation_is_not_stored():
+    cache = ResponseCache(ttl=60)
+    productor = Productor(demora=0.02)
+
+    async def escenario():
+        en_curso = asyncio.ensure_future(cache.obtener(1, ("ready",), productor))
+        await asyncio.sleep(0.005)
+        cache.invalidar(1)  # p.ej. un PATCH mientras se calculaba
+        viejo = await en_curso
+        return viejo, await cache.obtener(1, ("ready",), productor)
+
+    viejo, nuevo = asyncio.run(escenario())
+
+    assert viejo == {"llamada": 1}
+    assert nuevo == {"llamada": 2}
+
+
+@pytest.mark.parametrize("ttl", [0, -1])
+def test_non_positive_ttl_disables_the_cache(ttl):
+    cache = ResponseCache(ttl=ttl)
+    productor = Productor(demora=0)
+
+    async def dos_veces():
+        await cache.obtener(1, ("stats",), productor)
+        await cache.obtener(1, ("stats",), productor)
+
+    asyncio.run(dos_veces())
+
+    assert productor.llamadas == 2
+
+
+def test_oldest_entry_is_evicted_at_maxsize():
+    cache = ResponseCache(ttl=60, maxsize=2)
+    productor = Productor(demora=0)
+
+    async def leer(*paginas):
+        for pagina in paginas:
+            await cache.obtener(1, ("ready", pagina), productor)
+
+    asyncio.run(leer(1, 2, 3, 1))
+
+    assert productor.llamadas == 4
+
+
+def test_successful_patch_invalidates_the_store(db, caches):
+    _, cache = caches
+    productor = Productor(demora=0)
+    asyncio.run(cache.obtener(1, ("stats",), productor))
+
+    tiendanube.despues_de_patch(1, 422)
+    asyncio.run(cache.obtener(1, ("stats",), productor))
+    assert productor.llamadas == 1
+
+    tiendanube.despues_de_patch(1, 200)
+    asyncio.run(cache.obtener(1, ("stats",), productor))
+    assert productor.llamadas == 2
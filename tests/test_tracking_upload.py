@@ -0,0 +1,84 @@
+import asyncio
+
+import httpx
+
+from app.services.tiendanube import RateLimiter, TiendaNubeClient
+from app.services.tiendanube_async import AsyncTiendaNubeClient
+
+from conftest import FakeTiendaNube, mock_http, orden
+
+
+def _client_async():
+    return AsyncTiendaNubeClient(1, "token", rate_limiter=RateLimiter(rate=0))
+
+
+def test_results_keep_file_order_and_row_shapes(db, caches, api):
+    api.orders = [orden(1), orden(2), orden(3)]
+    rows = [(3, "TRK3"), (99, "TRK99"), (1, None), (2, "TRK2")]
+
+    resultado = asyncio.run(_client_async().process_tracking_file(rows, workers=3))
+
+    estados = [(r["order"], r["status"]) for r in resultado["results"]]
+    assert estados == [(3, "SUCCESS"), (99, "EXCEPTION"), (1, "SKIPPED"), (2, "SUCCESS")]
+
+
+def test_failed_patch_is_reported_as_error_row(db, caches, api):
+    api.orders = [orden(1)]
+    api.patch_status = 422
+
+    resultado = asyncio.run(_client_async().process_tracking_file([(1, "TRK1")]))
+
+    fila = resultado["results"][0]
+    assert fila["status"] == "ERROR"
+    assert "422" in fila["details"]
+
+
+def test_orders_run_in_parallel_but_each_order_in_sequence(db, caches, monkeypatch):
+    fake = FakeTiendaNube([orden(n) for n in range(1, 9)])
+    en_vuelo = {"ahora": 0, "max": 0}
+
+    async def handler(request):
+        en_vuelo["ahora"] += 1
+        en_vuelo["max"] = max(en_vuelo["max"], en_vuelo["ahora"])
+        await asyncio.sleep(0.01)
+        en_vuelo["ahora"] -= 1
+        return fake.handler(request)
+
+    mock_http(monkeypatch, handler)
+    rows = [(n, f"TRK{n}") for n in range(1, 9)]
+
+    resultado = asyncio.run(_client_async().process_tracking_file(rows, workers=3))
+
+    assert all(r["status"] == "SUCCESS" for r in resultado["results"])
+    assert 1 < en_vuelo["max"] <= 3
+    for n in range(1, 9):
+        pasos = [
+            metodo for metodo, path, params in fake.calls
+            if params.get("q") == str(n) or f"/orders/{1000 + n}" in path
+        ]
+        # lookup -> GET de la orden -> PATCH del fulfillment
+        assert pasos == ["GET", "GET", "PATCH"]
+
+
+def test_sync_client_dispatches_rows_like_the_async_one(db, caches, api):
+    api.orders = [orden(n) for n in range(1, 6)]
+    rows = [(n, f"TRK{n}") for n in range(1, 6)] + [(7, None)]
+    client = TiendaNubeClient(1, "token", rate_limiter=RateLimiter(rate=0))
+
+    resultado = client.process_tracking_file(rows, workers=4)
+
+    assert [r["order"] for r in resultado["results"]] == [1, 2, 3, 4, 5, 7]
+    assert [r["status"] for r in resultado["results"]] == ["SUCCESS"] * 5 + ["SKIPPED"]
+    assert len(api.rutas("PATCH")) == 5
+
+
+def test_shared_rate_limiter_paces_parallel_orders(db, caches, api):
+    api.orders = [orden(n) for n in range(1, 5)]
+    limiter = RateLimiter(rate=50, burst=2)
+    client = AsyncTiendaNubeClient(1, "token", rate_limiter=limiter)
+
+    asyncio.run(client.process_tracking_file([(n, f"TRK{n}") for n in range(1, 5)], workers=4))
+
+    stats = limiter.estadisticas()
+    assert stats["requests"] == 12
+    assert stats["waits"] > 0